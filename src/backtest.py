@@ -1,15 +1,15 @@
 import pandas as pd
 import numpy as np
-import psycopg
 import json
-import pprint
-import mplfinance as mpf
 import argparse
+import heapq
+import os
 
-from typing import List
-from matplotlib import pyplot as plt
-from numpy.testing import assert_almost_equal, assert_equal
-import matplotlib.pyplot as plt
+import storage
+import metrics
+import instrument
+
+from tick_index import load_candle_index
 
 # --- Constants ---
 multiplier = 100000
@@ -18,67 +18,395 @@ AR = 0.8
 fee_points = 0.47
 
 # Initialize asset variables
-total_asset = 100_000_000  # Total asset in VND
-available_asset = total_asset  # Funds available for trading
+initial_asset = 100_000_000  # Total asset in VND
 
 # --- Trade State ---
-open_positions = []  # List of currently open positions
-trades = []          # List to record completed trades
+# Ledger row layout; the columns and their order are storage.trade_columns
+TRADE_DTYPE = np.dtype([
+    ('type', 'U5'),                # 'long' or 'short'
+    ('entry_price', np.float64),
+    ('entry_time', 'datetime64[ns]'),
+    ('deposit', np.float64),
+    ('exit_price', np.float64),
+    ('exit_time', 'datetime64[ns]'),
+    ('raw_points', np.float64),
+    ('net_points', np.float64),
+    ('profit_vnd', np.float64),
+    ('profit_pct', np.float64),
+])
+POSITION_TYPES = ('long', 'short')  # Position type codes of the position book
 
-def open_position(position_type, entry_price, entry_time):
-    global available_asset
-    deposit = (entry_price * multiplier * margin_ratio) / AR
-    if available_asset < deposit:
-        print(f"Insufficient funds to open {position_type} trade at {entry_time}. Required deposit: {deposit}, available: {available_asset}")
-        return
-    available_asset -= deposit  # Lock the deposit
-    new_position = {
-        'type': position_type,  # 'long' or 'short'
-        'entry_price': entry_price,
-        'entry_time': entry_time,
-        'deposit': deposit
+class PositionBook:
+    # Open positions as parallel arrays indexed by slot; closed slots go to a free list and
+    # are reused. `open` keeps the open slots in opening order, the order positions close in.
+    def __init__(self, capacity=16):
+        self.kind = np.zeros(capacity, dtype=np.int8)  # Index into POSITION_TYPES
+        self.entry_price = np.zeros(capacity)
+        self.entry_time = np.zeros(capacity, dtype='datetime64[ns]')
+        self.deposit = np.zeros(capacity)
+        self.free = list(range(capacity - 1, -1, -1))
+        self.open = {}       # Open slots (as keys), in opening order
+
+    def __len__(self):
+        return len(self.open)
+
+    def add(self, kind, entry_price, entry_time, deposit):
+        if not self.free:
+            self._grow()
+        slot = self.free.pop()
+        self.kind[slot] = kind
+        self.entry_price[slot] = entry_price
+        self.entry_time[slot] = entry_time
+        self.deposit[slot] = deposit
+        self.open[slot] = None
+        return slot
+
+    def remove(self, slot):
+        del self.open[slot]
+        self.free.append(slot)
+
+    def slots(self):
+        # Open slots in opening order (a copy, so positions can be closed while iterating)
+        return list(self.open)
+
+    def _grow(self):
+        capacity = len(self.kind)
+        for name in ('kind', 'entry_price', 'entry_time', 'deposit'):
+            column = getattr(self, name)
+            grown = np.zeros(2 * capacity, dtype=column.dtype)
+            grown[:capacity] = column
+            setattr(self, name, grown)
+        self.free.extend(range(2 * capacity - 1, capacity - 1, -1))
+
+class TradeLedger:
+    # Completed trades in a structured array that doubles when full
+    def __init__(self, capacity=256):
+        self.rows = np.zeros(capacity, dtype=TRADE_DTYPE)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, *values):
+        if self.size == len(self.rows):
+            grown = np.zeros(2 * len(self.rows), dtype=TRADE_DTYPE)
+            grown[:self.size] = self.rows
+            self.rows = grown
+        self.rows[self.size] = values
+        self.size += 1
+
+    def array(self):
+        return self.rows[:self.size]
+
+    def to_frame(self):
+        # Column by column, with the row layout of storage.trade_columns
+        return pd.DataFrame(self.array())
+
+class BacktestState:
+    # Capital, open positions and completed trades of one simulation; independent states
+    # can run side by side in one process
+    def __init__(self, initial=initial_asset):
+        self.total_asset = initial
+        self.available_asset = initial  # Funds available for trading
+        self.positions = PositionBook()
+        self.trades = TradeLedger()
+
+    def open_position(self, position_type, entry_price, entry_time):
+        # Returns the slot of the new position, or None without enough funds
+        deposit = (entry_price * multiplier * margin_ratio) / AR
+        if self.available_asset < deposit:
+            print(f"Insufficient funds to open {position_type} trade at {entry_time}. Required deposit: {deposit}, available: {self.available_asset}")
+            return None
+        self.available_asset -= deposit  # Lock the deposit
+        return self.positions.add(POSITION_TYPES.index(position_type), entry_price, entry_time, deposit)
+
+    def close_position(self, slot, exit_price, exit_time):
+        book = self.positions
+        entry_price = float(book.entry_price[slot])
+        deposit = float(book.deposit[slot])
+        position_type = POSITION_TYPES[book.kind[slot]]
+        if position_type == 'long':
+            raw_points = exit_price - entry_price
+        else:  # For a short position:
+            raw_points = entry_price - exit_price
+        net_points = raw_points - fee_points
+        profit_vnd = net_points * multiplier
+        self.available_asset += deposit + profit_vnd  # Return deposit and profit
+        self.total_asset += profit_vnd  # Update overall asset value
+        entry_time = book.entry_time[slot]
+        book.remove(slot)
+        # Record the trade details.
+        if pd.isna(exit_time):
+            return
+        self.trades.append(position_type, entry_price, entry_time, deposit, exit_price, exit_time,
+                           raw_points, net_points, profit_vnd, profit_vnd / deposit)
+
+    def close_all_positions(self, exit_price, exit_time):
+        # Close each open position.
+        for slot in self.positions.slots():
+            self.close_position(slot, exit_price, exit_time)
+
+    def trades_frame(self):
+        return self.trades.to_frame()
+
+# --- Vectorized Engine ---
+def load_candles(input_file):
+    # Load the candles written by data_processing.py into contiguous NumPy columns
+    store_path = input_file[:-len('.json')] if input_file.endswith('.json') else input_file
+    if os.path.isdir(store_path):
+        # Columnar store: the columns are memory-mapped, not copied
+        arrays, meta = storage.read_table(store_path)
+        candles = {name: arrays[name] for name in ('datetime', 'open', 'high', 'low', 'close', 'SMA')}
+        candles['ticker'] = arrays['tickersymbol']
+        candles['tickers'] = np.asarray(meta['categories']['tickersymbol'], dtype=object)
+        return candles
+
+    # Legacy JSON records (in-sample.json / out-sample.json)
+    with open(input_file, 'r') as f:
+        df_list = json.load(f)
+    df = pd.DataFrame(df_list, columns=['datetime', 'tickersymbol', 'open', 'high', 'low', 'close', 'SMA'])
+    return candles_to_arrays(df)
+
+def candles_to_arrays(df):
+    # Turn a candle DataFrame into the column layout used by run_backtest
+    ticker_codes, tickers = pd.factorize(df['tickersymbol'])
+    candles = {
+        'datetime': np.ascontiguousarray(pd.to_datetime(df['datetime']).to_numpy()),
+        'ticker': np.ascontiguousarray(ticker_codes, dtype=np.int32),
+        'tickers': np.asarray(tickers, dtype=object),
     }
-    open_positions.append(new_position)
-    #print(f"Opened {position_type} position at {entry_price} on {entry_time} with deposit {deposit}")
-
-def close_position(position, exit_price, exit_time):
-    global available_asset, total_asset
-    entry_price = position['entry_price']
-    deposit = position['deposit']
-    if position['type'] == 'long':
-        raw_points = exit_price - entry_price
-    else:  # For a short position:
-        raw_points = entry_price - exit_price
-    net_points = raw_points - fee_points
-    profit_vnd = net_points * multiplier
-    available_asset += deposit + profit_vnd  # Return deposit and profit
-    total_asset += profit_vnd  # Update overall asset value
-    # Record the trade details.
-    trade = position.copy()
-    trade['exit_price'] = exit_price
-    trade['exit_time'] = exit_time
-    trade['raw_points'] = raw_points
-    trade['net_points'] = net_points
-    trade['profit_vnd'] = profit_vnd
-    trade['profit_pct'] = profit_vnd / deposit
-    if pd.isna(exit_time):
-        return
-    trades.append(trade)
-    #print(f"Closed {position['type']} position opened on {position['entry_time']} at {exit_price} on {exit_time} with profit {profit_vnd} VND, return {trade['profit_pct']*100:.2f}%")
-
-def close_all_positions(exit_price, exit_time):
-    # Close each open position.
-    for pos in open_positions.copy():
-        close_position(pos, exit_price, exit_time)
-        open_positions.remove(pos)
-        
+    for column in ('open', 'high', 'low', 'close', 'SMA'):
+        candles[column] = np.ascontiguousarray(df[column].to_numpy(dtype=np.float64))
+    return candles
+
+def find_entry_patterns(candles, time_frame):
+    # Boolean masks of the bars that close a long or a short 3-candle reversal, before the
+    # SMA filter; strategies that differ only in their SMA window share them
+    dt = candles['datetime']
+    ticker = candles['ticker']
+    open_ = candles['open']
+    high = candles['high']
+    low = candles['low']
+    close = candles['close']
+    n = len(close)
+    long_pattern = np.zeros(n, dtype=bool)
+    short_pattern = np.zeros(n, dtype=bool)
+    if n < 4:
+        return long_pattern, short_pattern
+
+    # The current candle and the previous 3 must be time_frame minutes apart and share a ticker
+    # (always true of a single-ticker series such as the continuous front month)
+    step_ok = np.diff(dt) == np.timedelta64(time_frame, 'm')
+    if len(candles['tickers']) > 1:
+        step_ok &= ticker[1:] == ticker[:-1]
+    consecutive = step_ok[2:] & step_ok[1:-1] & step_ok[:-2]
+
+    # Bearish if close < open, bullish if close > open, for all of the previous 3 candles
+    bearish = close < open_
+    bullish = close > open_
+    bearish_pattern = bearish[2:-1] & bearish[1:-2] & bearish[:-3]
+    bullish_pattern = bullish[2:-1] & bullish[1:-2] & bullish[:-3]
+
+    cur_close = close[3:]
+    long_pattern[3:] = consecutive & bearish_pattern & (high[2:-1] < cur_close)
+    short_pattern[3:] = consecutive & bullish_pattern & (low[2:-1] > cur_close)
+    return long_pattern, short_pattern
+
+def find_entry_signals(candles, time_frame, patterns=None):
+    # Boolean masks of the bars on which a long or a short position is opened: a reversal
+    # pattern closing above (long) or below (short) the SMA
+    long_pattern, short_pattern = patterns if patterns is not None else find_entry_patterns(candles, time_frame)
+    close = candles['close']
+    sma = candles['SMA']
+    trend = ~np.isnan(sma)
+    return long_pattern & trend & (sma < close), short_pattern & trend & (sma > close)
+
+def order_entries(long_signal, short_signal):
+    # Entry candle indices in loop order; long entries are checked before short entries on
+    # the same candle
+    entry_idx = np.concatenate([np.flatnonzero(long_signal), np.flatnonzero(short_signal)])
+    is_long = np.concatenate([np.ones(long_signal.sum(), dtype=bool), np.zeros(short_signal.sum(), dtype=bool)])
+    order = np.lexsort((~is_long, entry_idx))
+    return entry_idx[order], is_long[order]
+
+def find_entries(candles, time_frame):
+    return order_entries(*find_entry_signals(candles, time_frame))
+
+def find_exits_grid(candles, entry_idx, is_long, take_profits, stop_losses):
+    # For every entry and every (take_profit, stop_loss) pair return (close_step, exit_idx),
+    # both of shape (entries, pairs): the loop step at which the position is closed and the
+    # candle whose close/datetime is used as the exit.
+    dt = candles['datetime']
+    close = candles['close']
+    n = len(close)
+    take_profits = np.asarray(take_profits, dtype=np.float64)
+    stop_losses = np.asarray(stop_losses, dtype=np.float64)
+    day = dt.astype('datetime64[D]')
+    # Steps at which the date changes and every open position is closed at the previous candle
+    day_breaks = np.flatnonzero(day[1:] != day[:-1]) + 1
+    next_break = np.searchsorted(day_breaks, entry_idx, side='right')
+    segment_end = np.append(day_breaks, n)[next_break]
+
+    close_step = np.empty((len(entry_idx), len(take_profits)), dtype=np.int64)
+    exit_idx = np.empty_like(close_step)
+    for k, (e, end) in enumerate(zip(entry_idx, segment_end)):
+        path = close[e + 1:end]
+        entry_price = close[e]
+        unrealized = path - entry_price if is_long[k] else entry_price - path
+        # First crossing of every threshold at once: the running best and worst unrealized
+        # points are monotonic, so each first crossing is a binary search (NaN never crosses)
+        best = np.maximum.accumulate(np.where(np.isnan(unrealized), -np.inf, unrealized))
+        worst = np.maximum.accumulate(np.where(np.isnan(unrealized), -np.inf, -unrealized))
+        hit = np.minimum(np.searchsorted(best, take_profits, side='left'),
+                         np.searchsorted(worst, -stop_losses, side='left'))
+        crossed = hit < len(path)
+        # Otherwise the overnight close, or the final close after the last candle
+        close_step[k] = np.where(crossed, e + 1 + hit, end)
+        exit_idx[k] = np.where(crossed, e + 1 + hit, end - 1)
+    return close_step, exit_idx
+
+def find_exits(candles, entry_idx, is_long, take_profit, stop_loss):
+    # (close_step, exit_idx) of every entry for a single exit parameter pair
+    close_step, exit_idx = find_exits_grid(candles, entry_idx, is_long, [take_profit], [stop_loss])
+    return close_step[:, 0], exit_idx[:, 0]
+
+def find_exit_fills(candles, entry_idx, is_long, take_profits, stop_losses, time_frame=1, tick_index=None):
+    # (close_step, exit_price, exit_time) of every entry and (take_profit, stop_loss) pair.
+    # By default positions are filled at the close of the candle that crosses a threshold.
+    # With a TickIndex (see tick_index.py) the ticks of the entry's contract after the entry
+    # candle are scanned instead, and the position is filled at the first crossing tick.
+    # Without a crossing tick the candle rules still apply (overnight or final close).
+    dt = candles['datetime']
+    close = candles['close']
+    ticker = candles['ticker']
+    n = len(close)
+    close_step, exit_idx = find_exits_grid(candles, entry_idx, is_long, take_profits, stop_losses)
+    exit_price = close[exit_idx]
+    exit_time = dt[exit_idx]
+    if tick_index is None or not len(entry_idx):
+        return close_step, exit_price, exit_time
+
+    take_profits = np.asarray(take_profits, dtype=np.float64)
+    stop_losses = np.asarray(stop_losses, dtype=np.float64)
+    exit_time = exit_time.astype('datetime64[ns]')
+    dt_ns = dt.astype('datetime64[ns]').view(np.int64)
+    bar_ns = np.int64(time_frame) * 60 * 10**9
+    # Ticks are scanned up to the end of the entry day or of the entry's contract in the candles
+    day = dt.astype('datetime64[D]')
+    breaks = np.flatnonzero((day[1:] != day[:-1]) | (ticker[1:] != ticker[:-1])) + 1
+    run_end = np.append(breaks, n)[np.searchsorted(breaks, entry_idx, side='right')]
+    labels = candles['tickers']
+    for k, e in enumerate(entry_idx):
+        lo, hi = tick_index.range(labels[ticker[e]], dt_ns[e] + bar_ns, dt_ns[run_end[k] - 1] + bar_ns)
+        if lo == hi:
+            continue
+        path = tick_index.prices[lo:hi]
+        unrealized = path - close[e] if is_long[k] else close[e] - path
+        # First crossing tick of every threshold at once, as in find_exits_grid
+        best = np.maximum.accumulate(unrealized)
+        worst = np.maximum.accumulate(-unrealized)
+        hit = np.minimum(np.searchsorted(best, take_profits, side='left'),
+                         np.searchsorted(worst, -stop_losses, side='left'))
+        crossed = hit < len(path)
+        if not crossed.any():
+            continue
+        tick = lo + hit[crossed]
+        # The position closes at the step of the candle holding the tick, before that
+        # candle's entries
+        close_step[k, crossed] = e + (tick_index.times[tick] - dt_ns[e]) // bar_ns
+        exit_price[k, crossed] = tick_index.prices[tick]
+        exit_time[k, crossed] = tick_index.times[tick].view('datetime64[ns]')
+    return close_step, exit_price, exit_time
+
+def run_backtest(candles, take_profit=3, stop_loss=-1, time_frame=1, tick_index=None, initial=initial_asset):
+    state = BacktestState(initial)
+    dt = candles['datetime']
+    close = candles['close']
+    n = len(close)
+    if n == 0:
+        return state.trades_frame()
+
+    with instrument.stage('signals'):
+        entry_idx, is_long = find_entries(candles, time_frame)
+    with instrument.stage('exits'):
+        close_step, exit_price, exit_time = find_exit_fills(
+            candles, entry_idx, is_long, [take_profit], [stop_loss], time_frame, tick_index)
+    close_step, exit_price, exit_time = close_step[:, 0], exit_price[:, 0], exit_time[:, 0]
+
+    # --- Replay entries and exits in loop order for the capital accounting ---
+    # Positions closing on the same step are closed in the order they were opened.
+    with instrument.stage('capital'):
+        pending = []
+        for k, e in enumerate(entry_idx):
+            while pending and pending[0][0] <= e:
+                _, j, slot = heapq.heappop(pending)
+                state.close_position(slot, exit_price[j], exit_time[j])
+            slot = state.open_position('long' if is_long[k] else 'short', close[e], dt[e])
+            if slot is not None:
+                heapq.heappush(pending, (close_step[k], k, slot))
+        while pending:
+            _, j, slot = heapq.heappop(pending)
+            state.close_position(slot, exit_price[j], exit_time[j])
+    return state.trades_frame()
+
+def run_backtest_grid(candles, take_profits, stop_losses, time_frame=1, tick_index=None):
+    # Score many (take_profit, stop_loss) pairs in one pass: the entries are found once, the
+    # exits of every pair come from one forward scan per entry, and the capital check is
+    # replayed for all pairs at once. Returns one row per pair.
+    take_profits = np.atleast_1d(np.asarray(take_profits, dtype=np.float64))
+    stop_losses = np.atleast_1d(np.asarray(stop_losses, dtype=np.float64))
+    take_profits, stop_losses = np.broadcast_arrays(take_profits, stop_losses)
+    pairs = len(take_profits)
+    dt = candles['datetime']
+    close = candles['close']
+
+    with instrument.stage('signals'):
+        entry_idx, is_long = find_entries(candles, time_frame) if len(close) else (np.empty(0, np.int64), np.empty(0, bool))
+    with instrument.stage('exits'):
+        close_step, exit_price, exit_time = find_exit_fills(
+            candles, entry_idx, is_long, take_profits, stop_losses, time_frame, tick_index)
+
+    entry_price = close[entry_idx]
+    deposit = (entry_price * multiplier * margin_ratio) / AR
+    raw_points = np.where(is_long[:, None], exit_price - entry_price[:, None], entry_price[:, None] - exit_price)
+    profit_vnd = (raw_points - fee_points) * multiplier
+
+    # Capital check, one column per pair: a position returns its deposit and profit before
+    # the first entry at or after its close step
+    release_before = np.searchsorted(entry_idx, close_step, side='left')
+    with instrument.stage('capital'):
+        released = np.zeros((len(entry_idx) + 1, pairs))
+        available = np.full(pairs, float(initial_asset))
+        opened = np.zeros((len(entry_idx), pairs), dtype=bool)
+        columns = np.arange(pairs)
+        for k in range(len(entry_idx)):
+            available += released[k]
+            opened[k] = ~(available < deposit[k])  # A NaN balance never blocks, as in BacktestState.open_position
+            available[opened[k]] -= deposit[k]
+            np.add.at(released, (release_before[k][opened[k]], columns[opened[k]]),
+                      deposit[k] + profit_vnd[k][opened[k]])
+
+    # Score every pair's ledger, with the trades in closing order as run_backtest appends them
+    with instrument.stage('metrics'):
+        ledger_order = np.argsort(close_step * (len(entry_idx) + 1) + np.arange(len(entry_idx))[:, None],
+                                  axis=0, kind='stable')
+        scores = metrics.compute_batch(
+            np.take_along_axis(np.broadcast_to(dt[entry_idx][:, None], close_step.shape), ledger_order, axis=0),
+            np.take_along_axis(exit_time, ledger_order, axis=0),
+            np.take_along_axis(profit_vnd, ledger_order, axis=0),
+            np.take_along_axis(opened, ledger_order, axis=0),
+        )
+    return pd.DataFrame({'take_profit': take_profits, 'stop_loss': stop_losses, **scores._asdict()})
+
 # --- Main Script ---
 if __name__ == "__main__":
     # Parse command-line arguments
-    parser = argparse.ArgumentParser(description="Backtesting script with input JSON file.")
-    parser.add_argument("input_file", type=str, help="Path to the input JSON file (e.g., src/in-sample.json)")
+    parser = argparse.ArgumentParser(description="Backtesting script with input candle store.")
+    parser.add_argument("input_file", type=str, help="Name of the candle store in src/ (e.g., in-sample)")
     parser.add_argument("--log", action="store_true", help="Log the trade details")
     parser.add_argument("--params", action="store_true", help="Use external params")
+    parser.add_argument("--tick-exits", action="store_true",
+                        help="Fill take-profit/stop-loss exits at the first crossing tick instead of the candle close")
     args = parser.parse_args()
     if args.params:
         with open('src/params.json', 'r') as pf:
@@ -90,74 +418,19 @@ if __name__ == "__main__":
         take_profit = 3
         stop_loss = -1
         time_frame = 1
-    time_step = pd.Timedelta(minutes=time_frame)
-
-    # Load df_list back from the JSON file
-    with open("src/" + args.input_file, 'r') as f:
-        df_list = json.load(f)
 
-    # Convert datetime strings back to pandas Timestamps
-    for record in df_list:
-        record['datetime'] = pd.Timestamp(record['datetime'])
-    # --- Backtesting Loop Using df_list ---
-    n = len(df_list)
-    for i in range(n):
-        current_candle = df_list[i]
-        current_time = current_candle['datetime']
-        
-        # --- Overnight Position Closing ---
-        if i > 0:
-            prev_time = df_list[i-1]['datetime']
-            if current_time.date() != prev_time.date():
-                # Close all open positions at the previous candle's close.
-                close_all_positions(df_list[i-1]['close'], prev_time)
-        
-        # --- Check Exit Conditions for Each Open Position ---
-        for pos in open_positions.copy():
-            if pos['type'] == 'long':
-                unrealized_points = current_candle['close'] - pos['entry_price']
-            else:
-                unrealized_points = pos['entry_price'] - current_candle['close']
-            # Exit if take profit (>= 3 points) or stop loss (<= -1 point) is reached.
-            if unrealized_points >= take_profit or unrealized_points <= stop_loss:
-                close_position(pos, current_candle['close'], current_time)
-                open_positions.remove(pos)
-        
-        # --- Check for Entry Signals ---
-        if i >= 3:
-            # Check if the previous 3 candles are consecutive (time_frame minute apart)
-            if ((current_time - df_list[i-1]['datetime'] == pd.Timedelta(minutes=time_frame)) and
-                (df_list[i-1]['datetime'] - df_list[i-2]['datetime'] == pd.Timedelta(minutes=time_frame)) and
-                (df_list[i-2]['datetime'] - df_list[i-3]['datetime'] == pd.Timedelta(minutes=time_frame)) and
-                (current_candle['tickersymbol'] == df_list[i-1]['tickersymbol'] ==
-                df_list[i-2]['tickersymbol'] == df_list[i-3]['tickersymbol'])):
-                # Get the previous three candles
-                prev_candles = df_list[i-3:i]
-                # Define patterns: bearish if close < open, bullish if close > open.
-                bearish_pattern = all(candle['close'] < candle['open'] for candle in prev_candles)
-                bullish_pattern = all(candle['close'] > candle['open'] for candle in prev_candles)
-                # Ensure SMA is available.
-                if np.isnan(current_candle['SMA']):
-                    continue
-                
-                # Entry Signal for LONG: previous 3 candles are bearish, previous candle’s high is below current candle’s close,
-                # and current candle’s close is above its SMA.
-                if bearish_pattern and (df_list[i-1]['high'] < current_candle['close']) and (current_candle['SMA'] < current_candle['close']):
-                    open_position('long', current_candle['close'], current_time)
-                # Entry Signal for SHORT can be added similarly if desired.
-                if bullish_pattern and (df_list[i-1]['low'] > current_candle['close']) and (current_candle['SMA'] > current_candle['close']):
-                    open_position('short', current_candle['close'], current_time)
-        
-    # --- End of Backtesting Loop ---
-    if open_positions:
-        close_all_positions(df_list[-1]['close'], df_list[-1]['datetime'])
+    candles = load_candles("src/" + args.input_file)
+    tick_index = None
+    if args.tick_exits:
+        # Index the ticks of the same sample the candles were resampled from
+        tick_index = load_candle_index("src/" + args.input_file)
+    trades_df = run_backtest(candles, take_profit, stop_loss, time_frame, tick_index)
 
     # --- Trade Summary ---
-    trades_df = pd.DataFrame(trades)
     print("\nBacktesting completed. Trade summary:")
     if args.log:
         print(trades_df)
-    trades_df.to_pickle("src/trades.pkl")
+    storage.write_trades("src/trades", trades_df)
     total_profit = trades_df['profit_vnd'].sum() if not trades_df.empty else 0
-    print(f"Total Trades: {len(trades)}")
+    print(f"Total Trades: {len(trades_df)}")
     print(f"Total Profit: {total_profit}")
@@ -0,0 +1,238 @@
+import gc
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import backtest
+import metrics
+import optimize
+import streaming
+import tick_store
+import data_processing
+import synthetic_ticks
+
+from candle_pyramid import CandlePyramid
+
+# Benchmarks of every pipeline stage on seeded synthetic ticks (see synthetic_ticks.py).
+# Each stage is timed (best of --repeat runs) and memory-profiled (tracemalloc peak of one
+# extra run). Results can be saved as a JSON baseline and later runs compared against it;
+# a stage slower or bigger than the baseline by more than --threshold is a regression.
+BASELINE_PATH = 'src/benchmark_baseline.json'
+SCALES = {'day': 1, 'week': 5, 'month': 21, 'year': 250, 'years': 750}  # Trading days
+TICKS_PER_DAY = 4000
+PARAMS = {'sma_window': 20, 'take_profit': 3.0, 'stop_loss': -1.0, 'time_frame': 5}
+GRID_SIZE = 50  # GRID_SIZE x GRID_SIZE take-profit/stop-loss pairs
+
+# Cold start of the scripts: a fresh interpreter that only imports the module, best of
+# --repeat runs. Plotting libraries and the database driver must only be loaded by the
+# features that use them, and evaluate.py --optimize (metrics on the stored trades) must
+# start without pandas.
+IMPORT_MODULES = ['backtest', 'data_processing', 'evaluate', 'metrics', 'optimize', 'portfolio',
+                  'robustness', 'streaming', 'walk_forward', 'work_queue']
+IMPORT_BUDGET = 1.0                                    # Seconds per cold start
+LAZY_IMPORTS = ['psycopg', 'matplotlib', 'mplfinance']  # Never loaded on import
+LEAN_IMPORTS = {'evaluate': ['pandas'], 'metrics': ['pandas']}  # Also not loaded by these
+
+def stages(workdir, ticks):
+    # (name, setup, run) of every stage; setup() builds the input of run() outside the timing
+    csv_path = os.path.join(workdir, 'ticks.csv')
+    store_path = os.path.join(workdir, 'ticks')
+    cache_dir = os.path.join(workdir, 'cache')
+    ticks.to_csv(csv_path, index=False)
+    tick_store.convert_csv(csv_path, store_path)
+    loaded = data_processing.load_ticks(store_path)
+    in_sample_ticks, _ = data_processing.split_dataset(loaded)
+    time_frame, sma_window = PARAMS['time_frame'], PARAMS['sma_window']
+    candles = backtest.candles_to_arrays(data_processing.process(loaded, time_frame, sma_window)['in-sample'])
+    trades_df = backtest.run_backtest(candles, PARAMS['take_profit'], PARAMS['stop_loss'], time_frame)
+    take_profits, stop_losses = [a.ravel() for a in np.meshgrid(
+        np.linspace(optimize.TP_MIN, optimize.TP_MAX, GRID_SIZE),
+        np.linspace(optimize.SL_MIN, optimize.SL_MAX, GRID_SIZE))]
+
+    def cold_trial():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        optimize.init_worker(store_path, cache_dir=cache_dir)
+        return optimize.run_trial_group([PARAMS])
+
+    def warm_trial():
+        optimize.init_worker(store_path, cache_dir=cache_dir)
+        return optimize.run_trial_group([PARAMS])
+
+    return [
+        ('ingest', None, lambda: tick_store.convert_csv(csv_path, os.path.join(workdir, 'ingest'))),
+        ('load_ticks', None, lambda: data_processing.load_ticks(store_path)),
+        ('resample_pandas', None, lambda: data_processing.process(loaded, time_frame, sma_window)),
+        ('candle_pyramid', None, lambda: CandlePyramid.build(in_sample_ticks).candles(time_frame)),
+        ('backtest', None, lambda: backtest.run_backtest(
+            candles, PARAMS['take_profit'], PARAMS['stop_loss'], time_frame)),
+        ('backtest_grid', None, lambda: backtest.run_backtest_grid(
+            candles, take_profits, stop_losses, time_frame)),
+        ('evaluate', None, lambda: metrics.compute(trades_df)),
+        ('streaming_replay', None, lambda: streaming.replay(
+            in_sample_ticks, PARAMS['take_profit'], PARAMS['stop_loss'], time_frame, sma_window)),
+        ('trial_cold', None, cold_trial),
+        ('trial_warm', cold_trial, warm_trial),
+    ]
+
+def measure(setup, run, repeat):
+    # Best wall time of `repeat` runs, then the tracemalloc peak of one more run
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        gc.collect()
+        started = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - started)
+    if setup is not None:
+        setup()
+    gc.collect()
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': min(times), 'peak_mb': peak / 2**20}
+
+def run_benchmarks(scales, repeat=3, seed=0, only=None, report=print):
+    results = {}
+    for scale in scales:
+        ticks = synthetic_ticks.generate_ticks(SCALES[scale], ticks_per_day=TICKS_PER_DAY, seed=seed)
+        report(f"[{scale}] {len(ticks):,} ticks over {SCALES[scale]} trading days")
+        workdir = tempfile.mkdtemp(prefix=f'benchmark-{scale}-')
+        try:
+            results[scale] = {}
+            # Open-position messages of the backtest are noise here
+            stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+            try:
+                stage_list = stages(workdir, ticks)
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+            for name, setup, run in stage_list:
+                if only and name not in only:
+                    continue
+                stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+                try:
+                    result = measure(setup, run, repeat)
+                finally:
+                    sys.stdout.close()
+                    sys.stdout = stdout
+                result['ticks'] = len(ticks)
+                results[scale][name] = result
+                report(f"  {name:<18} {result['seconds']:>9.4f} s {result['peak_mb']:>9.1f} MB")
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+def import_times(modules=IMPORT_MODULES, repeat=3):
+    # {module: {'seconds': cold start, 'loaded': [modules it must not load]}}
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [src_dir, os.environ.get('PYTHONPATH')]))}
+    results = {}
+    for module in modules:
+        unwanted = LAZY_IMPORTS + LEAN_IMPORTS.get(module, [])
+        check = f"import sys, {module}; print(' '.join(m for m in {unwanted!r} if m in sys.modules))"
+        times = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            output = subprocess.run([sys.executable, '-c', check], env=env, capture_output=True, text=True,
+                                    check=True).stdout
+            times.append(time.perf_counter() - started)
+        results[module] = {'seconds': min(times), 'loaded': output.split()}
+    return results
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+    }
+
+def compare(results, baseline, threshold):
+    # Rows of (scale, stage, metric, baseline, current, change, status); status is
+    # 'REGRESSION' when current > baseline * (1 + threshold)
+    rows = []
+    for scale, stage_results in results.items():
+        for stage, result in stage_results.items():
+            base = baseline.get('results', {}).get(scale, {}).get(stage)
+            for metric in ('seconds', 'peak_mb'):
+                if base is None or not base.get(metric):
+                    rows.append((scale, stage, metric, None, result[metric], None, 'new'))
+                    continue
+                change = result[metric] / base[metric] - 1
+                status = 'REGRESSION' if change > threshold else 'improved' if change < -threshold else 'ok'
+                rows.append((scale, stage, metric, base[metric], result[metric], change, status))
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage on synthetic ticks")
+    parser.add_argument("--scales", nargs="+", choices=list(SCALES), default=["day", "month"],
+                        help="Data sizes to benchmark")
+    parser.add_argument("--stages", nargs="+", help="Only run these stages")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per stage (best is kept)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the tick generator")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Relative slowdown or memory growth flagged as a regression")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    parser.add_argument("--import-time", action="store_true",
+                        help="Only time the cold start of every script against --import-budget")
+    parser.add_argument("--import-budget", type=float, default=IMPORT_BUDGET,
+                        help="Seconds a script may take to start (import only)")
+    args = parser.parse_args()
+
+    if args.import_time:
+        failures = 0
+        for module, result in import_times(repeat=args.repeat).items():
+            over = result['seconds'] > args.import_budget
+            status = 'OVER BUDGET' if over else f"loads {', '.join(result['loaded'])}" if result['loaded'] else 'ok'
+            print(f"  {module:<16} {result['seconds']:>8.3f} s  {status}")
+            failures += over or bool(result['loaded'])
+        if failures:
+            print(f"{failures} script(s) over the {args.import_budget:.2f} s budget or loading heavy modules")
+            raise SystemExit(1)
+        print(f"Every script starts within {args.import_budget:.2f} s")
+        raise SystemExit(0)
+
+    results = run_benchmarks(args.scales, args.repeat, args.seed, args.stages)
+    document = {'environment': environment(), 'seed': args.seed, 'ticks_per_day': TICKS_PER_DAY,
+                'params': PARAMS, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=1)
+
+    regressions = 0
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if baseline.get('environment') != document['environment']:
+            print("Warning: the baseline was recorded in a different environment.")
+        print(f"\nCompared with {args.baseline} (threshold {args.threshold:.0%}):")
+        for scale, stage, metric, base, current, change, status in compare(results, baseline, args.threshold):
+            if change is None:
+                print(f"  {scale:<6} {stage:<18} {metric:<8} {current:>10.4f}   (no baseline)")
+                continue
+            print(f"  {scale:<6} {stage:<18} {metric:<8} {base:>10.4f} -> {current:>10.4f} {change:>+8.1%}  {status}")
+            regressions += status == 'REGRESSION'
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(document, f, indent=1)
+        print(f"Baseline written to {args.baseline}")
+    if regressions:
+        print(f"{regressions} regression(s) beyond {args.threshold:.0%}")
+        raise SystemExit(1)
@@ -0,0 +1,202 @@
+import os
+import shutil
+import hashlib
+import tempfile
+
+from collections import OrderedDict
+
+import data_processing
+import tick_store
+
+from candle_pyramid import CandlePyramid
+from tick_index import TickIndex
+
+# Resampled OHLC candles depend only on the ticks and the time frame. The candle pyramids
+# (every time frame, see candle_pyramid.py) of the in-sample and out-sample ticks are cached
+# on disk per ticks version and the SMA is added on demand for any window.
+CACHE_DIR = 'src/cache/candles'
+MAX_CACHE_BYTES = 1 << 30      # LRU bound for the on-disk cache (1 GiB)
+MAX_MEMORY_ENTRIES = 4         # Gap-filled time frames kept in memory per process
+
+# Content hash of a ticks file, memoized on (size, mtime) so it is computed once per change
+_fingerprints = {}
+
+def ticks_fingerprint(path):
+    if not path.endswith('.csv'):
+        # The tick store version changes whenever one of its day partitions changes
+        return tick_store.TickStore(data_processing.ensure_tick_store(path)).version
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _fingerprints:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        _fingerprints[key] = digest.hexdigest()[:16]
+    return _fingerprints[key]
+
+def data_version(fingerprint):
+    return f'{fingerprint}-split{data_processing.in_sample_ratio:g}'
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+class CandleCache:
+    def __init__(self, ticks_path=data_processing.ticks_path, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.ticks_path = ticks_path
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._ticks = None
+        self._ticks_fingerprint = None
+        self._pyramids = None
+        self._full_pyramid = None
+        self._tick_indexes = None
+        self._memory = OrderedDict()
+
+    def _entry_path(self, fingerprint):
+        return os.path.join(self.cache_dir, data_version(fingerprint))
+
+    def data_version(self):
+        # Identifies the candles every trial runs on: the ticks version plus the split ratio
+        return data_version(ticks_fingerprint(self.ticks_path))
+
+    def ticks(self):
+        # Tick-level work only happens on a cache miss
+        fingerprint = ticks_fingerprint(self.ticks_path)
+        if self._ticks is None or self._ticks_fingerprint != fingerprint:
+            self._ticks = data_processing.load_ticks(self.ticks_path)
+            self._ticks_fingerprint = fingerprint
+        return self._ticks
+
+    def pyramids(self):
+        # {'in-sample': CandlePyramid, 'out-sample': CandlePyramid} of the current ticks
+        fingerprint = ticks_fingerprint(self.ticks_path)
+        path = self._entry_path(fingerprint)
+        if self._pyramids is not None and self._pyramids[0] == path:
+            return self._pyramids[1]
+
+        try:
+            entry = {name: CandlePyramid.load(os.path.join(path, name))
+                     for name in ('in-sample', 'out-sample')}
+            os.utime(path)  # Mark as recently used
+        except (FileNotFoundError, ValueError, KeyError):
+            in_sample_ticks, out_sample_ticks = data_processing.split_dataset(self.ticks())
+            entry = {
+                'in-sample': CandlePyramid.build(in_sample_ticks),
+                'out-sample': CandlePyramid.build(out_sample_ticks),
+            }
+            self._store(path, entry)
+        self._pyramids = (path, entry)
+        return entry
+
+    def full_pyramid(self):
+        # CandlePyramid of all the ticks, for time-based windows (see walk_forward.py). It does
+        # not depend on the split ratio, so it is its own cache entry.
+        fingerprint = ticks_fingerprint(self.ticks_path)
+        path = os.path.join(self.cache_dir, f'{fingerprint}-all')
+        if self._full_pyramid is not None and self._full_pyramid[0] == path:
+            return self._full_pyramid[1]
+
+        try:
+            pyramid = CandlePyramid.load(os.path.join(path, 'all'))
+            os.utime(path)  # Mark as recently used
+        except (FileNotFoundError, ValueError, KeyError):
+            pyramid = CandlePyramid.build(self.ticks())
+            self._store(path, {'all': pyramid})
+        self._full_pyramid = (path, pyramid)
+        return pyramid
+
+    def full_samples(self, time_frame, sma_window):
+        # Candles of all the ticks with SMA, in the layout of data_processing.process
+        pyramid = self.full_pyramid()
+        key = (self._full_pyramid[0], time_frame)
+        if key in self._memory:
+            self._memory.move_to_end(key)
+        else:
+            self._memory[key] = pyramid.candles(time_frame)
+            if len(self._memory) > MAX_MEMORY_ENTRIES:
+                self._memory.popitem(last=False)
+        return data_processing.add_sma(self._memory[key], sma_window)
+
+    def candles(self, time_frame):
+        # {'in-sample': ohlc, 'out-sample': ohlc} for one time frame, without SMA
+        pyramids = self.pyramids()
+        key = (self._pyramids[0], time_frame)
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+
+        entry = {name: pyramid.candles(time_frame) for name, pyramid in pyramids.items()}
+        self._memory[key] = entry
+        if len(self._memory) > MAX_MEMORY_ENTRIES:
+            self._memory.popitem(last=False)
+        return entry
+
+    def samples(self, time_frame, sma_window):
+        # Same output as data_processing.process, served from the cache
+        entry = self.candles(time_frame)
+        return {name: data_processing.add_sma(ohlc, sma_window) for name, ohlc in entry.items()}
+
+    def tick_index(self, name='in-sample'):
+        # TickIndex of the in-sample or out-sample ticks, for tick-precise exits
+        fingerprint = ticks_fingerprint(self.ticks_path)
+        if self._tick_indexes is None or self._tick_indexes[0] != fingerprint:
+            in_sample_ticks, out_sample_ticks = data_processing.split_dataset(self.ticks())
+            self._tick_indexes = (fingerprint, {
+                'in-sample': TickIndex.from_ticks(in_sample_ticks),
+                'out-sample': TickIndex.from_ticks(out_sample_ticks),
+            })
+        return self._tick_indexes[1][name]
+
+    def _store(self, path, entry):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Write to a temporary directory first so concurrent workers never read a partial entry
+        tmp_path = tempfile.mkdtemp(dir=self.cache_dir, suffix='.tmp')
+        for name, pyramid in entry.items():
+            pyramid.save(os.path.join(tmp_path, name))
+        os.chmod(tmp_path, 0o755)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another worker stored the same entry first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        self.evict(keep=path)
+
+    def evict(self, keep=None):
+        # Drop entries of older ticks files, then the least recently used ones over max_bytes
+        fingerprint = ticks_fingerprint(self.ticks_path)
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith('.tmp'):
+                continue
+            try:
+                stat = os.stat(path)
+                if not name.startswith(fingerprint + '-'):
+                    shutil.rmtree(path, ignore_errors=True)
+                    continue
+                size = _dir_size(path)
+            except FileNotFoundError:
+                continue  # Removed by another worker
+            entries.append((stat.st_mtime_ns, size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        self._pyramids = None
+        self._full_pyramid = None
+        self._tick_indexes = None
+        self._memory.clear()
+        if not os.path.isdir(self.cache_dir):
+            return
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+
+import storage
+import instrument
+import data_processing
+
+# Multi-resolution candles built once from the ticks. The ticks are binned into 1-minute OHLC
+# bars per contract and every higher time frame is aggregated from those 1-minute bars.
+# Levels are kept sparse (only bars that contain ticks); candles() expands a level to the
+# gap-filled layout of data_processing.resample_candles.
+PYRAMID_TIME_FRAMES = tuple(range(1, 21)) + (60,)
+NS_PER_MINUTE = 60 * 10**9
+MINUTES_PER_DAY = 24 * 60
+
+def _segments(*keys):
+    # Start index of every run of equal keys in rows sorted by those keys
+    n = len(keys[0])
+    change = np.zeros(n, dtype=bool)
+    if n:
+        change[0] = True
+        for key in keys:
+            change[1:] |= key[1:] != key[:-1]
+    return np.flatnonzero(change)
+
+def _ends(starts, n):
+    # Last index of every run started at starts
+    return np.append(starts[1:], n)[:len(starts)] - 1
+
+def aggregate(codes, bins, open_, high, low, close):
+    # OHLC of consecutive rows sharing (code, bin); rows must be ordered by (code, time)
+    starts = _segments(codes, bins)
+    if not len(starts):
+        return codes[:0], bins[:0], open_[:0], high[:0], low[:0], close[:0]
+    ends = _ends(starts, len(codes))
+    return (codes[starts], bins[starts], open_[starts],
+            np.maximum.reduceat(high, starts), np.minimum.reduceat(low, starts), close[ends])
+
+class CandlePyramid:
+    def __init__(self, tickers, origins, levels):
+        self.tickers = list(tickers)     # ticker label per code
+        self.origins = np.asarray(origins, dtype=np.int64)  # minute of midnight of each ticker's first day
+        self.levels = levels             # {time_frame: (codes, bins, open, high, low, close)}
+
+    @classmethod
+    @instrument.timed('resample')
+    def build(cls, ticks, time_frames=PYRAMID_TIME_FRAMES):
+        candle = data_processing.filter_contracts(ticks)
+        candle = candle[candle['price'].notna()]
+        codes, tickers = pd.factorize(candle['tickersymbol'], sort=True)
+        codes = codes.astype(np.int64)
+        # Group by ticker, keeping the datetime order within each ticker (as groupby does)
+        order = np.argsort(codes, kind='stable')
+        codes = codes[order]
+        minute = candle.index.to_numpy(dtype='datetime64[ns]').view(np.int64)[order] // NS_PER_MINUTE
+        price = candle['price'].to_numpy(dtype=np.float64)[order]
+
+        # resample() bins from midnight of the first day of each ticker
+        first = _segments(codes)
+        origins = minute[first] // MINUTES_PER_DAY * MINUTES_PER_DAY
+
+        pyramid = cls(tickers, origins, {})
+        base = aggregate(codes, minute - origins[codes], price, price, price, price)
+        pyramid.levels[1] = base
+        for time_frame in time_frames:
+            if time_frame != 1:
+                pyramid.levels[time_frame] = pyramid._from_base(time_frame)
+        return pyramid
+
+    def _from_base(self, time_frame):
+        codes, bins, open_, high, low, close = self.levels[1]
+        return aggregate(codes, bins // time_frame, open_, high, low, close)
+
+    def level(self, time_frame):
+        if time_frame not in self.levels:
+            self.levels[time_frame] = self._from_base(time_frame)
+        return self.levels[time_frame]
+
+    @instrument.timed('resample')
+    def candles(self, time_frame):
+        # Gap-filled candles of one time frame, identical to data_processing.resample_candles
+        codes, bins, open_, high, low, close = self.level(time_frame)
+        starts = _segments(codes)
+        ends = _ends(starts, len(codes))
+        first_bin = bins[starts]
+        lengths = bins[ends] - first_bin + 1
+        offsets = np.cumsum(lengths) - lengths
+        total = int(lengths.sum())
+
+        segment = np.repeat(np.arange(len(starts)), lengths)
+        dense_codes = codes[starts][segment]
+        dense_bins = np.arange(total) - offsets[segment] + first_bin[segment]
+        bar_segment = np.repeat(np.arange(len(starts)), ends - starts + 1)
+        position = offsets[bar_segment] + bins - first_bin[bar_segment]
+
+        columns = {}
+        for name, values in (('open', open_), ('high', high), ('low', low), ('close', close)):
+            dense = np.full(total, np.nan)
+            dense[position] = values
+            columns[name] = dense
+        minutes = self.origins[dense_codes] + dense_bins * time_frame
+        index = pd.DatetimeIndex((minutes * NS_PER_MINUTE).astype('datetime64[ns]'), name='datetime')
+        tickersymbol = np.asarray(self.tickers, dtype=object)[dense_codes]
+        return pd.DataFrame({'tickersymbol': tickersymbol, **columns}, index=index)
+
+    # --- Persistence: all levels in one columnar table, indexed by row ranges per level ---
+    def save(self, path):
+        time_frames = sorted(self.levels)
+        parts = [self.levels[tf] for tf in time_frames]
+        lengths = [len(part[0]) for part in parts]
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).tolist()
+        columns = {name: np.concatenate([part[i] for part in parts])
+                   for i, name in enumerate(('tickersymbol', 'bin', 'open', 'high', 'low', 'close'))}
+        columns['tickersymbol'] = columns['tickersymbol'].astype(np.uint16)
+        storage.write_table(path, columns, categories={'tickersymbol': self.tickers}, extra={
+            'origins': self.origins.tolist(),
+            'levels': {str(tf): offsets[i:i + 2] for i, tf in enumerate(time_frames)},
+        })
+
+    @classmethod
+    @instrument.timed('load')
+    def load(cls, path):
+        arrays, meta = storage.read_table(path)
+        levels = {}
+        for tf, (start, stop) in meta['levels'].items():
+            levels[int(tf)] = (arrays['tickersymbol'][start:stop].astype(np.int64), arrays['bin'][start:stop],
+                               arrays['open'][start:stop], arrays['high'][start:stop],
+                               arrays['low'][start:stop], arrays['close'][start:stop])
+        return cls(meta['categories']['tickersymbol'], meta['origins'], levels)
@@ -0,0 +1,123 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import data_processing
+
+# Continuous front-month series. VN30F contracts expire on the third Thursday of their month;
+# the front month is the listed contract with the nearest expiry, and the series rolls to
+# the next contract the day after the front month's last day (optionally a few business
+# days before expiry). The roll schedule is computed once as (roll start, contract) pairs,
+# each tick is kept only if it belongs to the front month of its time, and the kept ticks
+# are resampled as one time-ordered series with one candle per bar, so contracts that trade
+# side by side around expiry never produce duplicate bars.
+CONTINUOUS_TICKER = 'VN30F1M'
+ADJUSTMENTS = ('none', 'difference', 'ratio')
+
+def expiry(contract):
+    # Third Thursday of the contract month, VN30FYYMM
+    year, month = 2000 + int(contract[-4:-2]), int(contract[-2:])
+    first_weekday = pd.Timestamp(year=year, month=month, day=1).weekday()
+    return pd.Timestamp(year=year, month=month, day=1 + (3 - first_weekday) % 7 + 14)
+
+def roll_schedule(contracts, roll_days_before=0, first_time=None, last_time=None):
+    # (starts, contracts): contracts[i] is the front month from starts[i] (ns since the epoch)
+    # until starts[i + 1]; the first contract has no lower bound. With the time range of the
+    # data, contracts that are not the front month anywhere in it are left out (a quarterly
+    # contract is listed long before it becomes the front month).
+    contracts = sorted(set(contracts), key=expiry)
+    starts = [np.iinfo(np.int64).min]
+    for previous in contracts[:-1]:
+        last_day = expiry(previous) - pd.offsets.BDay(roll_days_before)
+        starts.append((last_day.normalize() + pd.Timedelta(days=1)).value)
+    starts = np.asarray(starts, dtype=np.int64)
+    first = 0 if first_time is None else max(0, np.searchsorted(starts, first_time, side='right') - 1)
+    last = len(starts) if last_time is None else np.searchsorted(starts, last_time, side='right')
+    starts, contracts = starts[first:last].copy(), contracts[first:last]
+    if len(starts):
+        starts[0] = np.iinfo(np.int64).min
+    return starts, contracts
+
+def front_month_ticks(ticks, roll_days_before=0, adjust='none'):
+    # Time-ordered ticks of the front month (datetime index, price and contract columns).
+    # adjust='difference' shifts every earlier contract by the price gap at each roll and
+    # 'ratio' scales it, so the series has no jumps at rolls; prices of the last contract
+    # are never changed.
+    if adjust not in ADJUSTMENTS:
+        raise ValueError(f"Unknown adjustment '{adjust}', expected one of {ADJUSTMENTS}")
+    price = pd.to_numeric(ticks['price'], errors='coerce').to_numpy(dtype=np.float64)
+    times = pd.to_datetime(ticks['datetime']).to_numpy(dtype='datetime64[ns]').view(np.int64)
+    codes, labels = pd.factorize(ticks['tickersymbol'])
+    traded = ~np.isnan(price)
+    price, times, codes = price[traded], times[traded], codes[traded]
+    if not len(times):
+        return pd.DataFrame({'price': np.empty(0), 'contract': np.empty(0, object)},
+                            index=pd.DatetimeIndex(np.empty(0, 'datetime64[ns]'), name='datetime'))
+    starts, contracts = roll_schedule(labels, roll_days_before, times.min(), times.max())
+    front = np.asarray([labels.get_loc(contract) for contract in contracts], dtype=codes.dtype)
+
+    # Keep each tick whose contract is the front month at its time
+    segment = np.searchsorted(starts, times, side='right') - 1
+    selected = np.flatnonzero(codes == front[segment])
+    selected = selected[np.argsort(times[selected], kind='stable')]
+    front_price, front_times, segment = price[selected], times[selected], segment[selected]
+
+    if adjust != 'none' and len(contracts) > 1:
+        # Gap at each roll: last price of the new contract minus that of the old one before
+        # the roll, from all their ticks (the new contract is not the front month yet)
+        by_contract = np.lexsort((times, codes))
+        codes, times, price = codes[by_contract], times[by_contract], price[by_contract]
+
+        def last_price(code, before):
+            lo, hi = np.searchsorted(codes, [code, code + 1])
+            i = lo + np.searchsorted(times[lo:hi], before, side='left') - 1
+            return price[i] if i >= lo else np.nan
+
+        adjustment = np.zeros(len(contracts)) if adjust == 'difference' else np.ones(len(contracts))
+        for k in range(len(contracts) - 1, 0, -1):
+            old, new = last_price(front[k - 1], starts[k]), last_price(front[k], starts[k])
+            # Without a price of both contracts before the roll, the gap is unknown: no shift
+            if adjust == 'difference':
+                adjustment[k - 1] = adjustment[k] + (new - old if not np.isnan(new - old) else 0.0)
+            else:
+                adjustment[k - 1] = adjustment[k] * (new / old if old and not np.isnan(new / old) else 1.0)
+        if adjust == 'difference':
+            front_price = front_price + adjustment[segment]
+        else:
+            front_price = front_price * adjustment[segment]
+
+    return pd.DataFrame({
+        'price': front_price,
+        'contract': np.asarray(contracts, dtype=object)[segment],
+    }, index=pd.DatetimeIndex(front_times.astype('datetime64[ns]'), name='datetime'))
+
+def resample_front_month(front_ticks, time_frame):
+    # One gap-filled candle series in the layout of data_processing.resample_candles
+    candle_ohlc = front_ticks['price'].resample(f'{time_frame}min').ohlc()
+    candle_ohlc.insert(0, 'tickersymbol', CONTINUOUS_TICKER)
+    return candle_ohlc
+
+def sample_ticks(ticks, roll_days_before=0, adjust='none'):
+    # In-sample and out-sample front-month ticks: a time cut at the same share of the
+    # front-month ticks as data_processing.split_dataset
+    front_ticks = front_month_ticks(ticks, roll_days_before, adjust)
+    cut = int(len(front_ticks) * data_processing.in_sample_ratio)
+    return {'in-sample': front_ticks.iloc[:cut], 'out-sample': front_ticks.iloc[cut:]}
+
+def process(ticks, time_frame=1, sma_window=50, roll_days_before=0, adjust='none'):
+    # data_processing.process on the continuous series
+    return {name: data_processing.add_sma(resample_front_month(front_ticks, time_frame), sma_window)
+            for name, front_ticks in sample_ticks(ticks, roll_days_before, adjust).items()}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the front-month roll schedule of the ticks")
+    parser.add_argument("--roll-days", type=int, default=0, help="Roll this many business days before expiry")
+    args = parser.parse_args()
+
+    ticks = data_processing.load_ticks()
+    times = pd.to_datetime(ticks['datetime']).to_numpy(dtype='datetime64[ns]').view(np.int64)
+    starts, contracts = roll_schedule(ticks['tickersymbol'].unique(), args.roll_days, times.min(), times.max())
+    for start, contract in zip(starts, contracts):
+        since = "start" if start == np.iinfo(np.int64).min else f"{pd.Timestamp(start):%Y-%m-%d}"
+        print(f"{since:>10}  {contract} (expires {expiry(contract):%Y-%m-%d})")
@@ -1,48 +1,246 @@
-import pandas as pd
-import numpy as np
 import psycopg
 import json
-import pprint
-import mplfinance as mpf
-
-from typing import List
-from matplotlib import pyplot as plt
-from numpy.testing import assert_almost_equal, assert_equal
-
-# Load data
-with open('src/database.json', 'rb') as fb:
-    db_info = json.load(fb)
-conn = psycopg.connect(
-    host=db_info['host'],
-    port=db_info['port'],
-    dbname=db_info['database'],
-    user=db_info['user'],
-    password=db_info['password']
-)
-with psycopg.connect(
-    host=db_info['host'],
-    port=db_info['port'],
-    dbname=db_info['database'],
-    user=db_info['user'],
-    password=db_info['password']
-) as conn:
-    # Open a cursor to perform database operations
-    with conn.cursor() as data:
-        
-        # Execute a query
-        data.execute("""
-            SELECT m.datetime, m.tickersymbol, m.price
-            FROM "quote"."matched" m
-            WHERE m.tickersymbol LIKE 'VN30F23%'
-            and m.datetime >= '2023-01-01 00:00:00'
-        """)
-
-        # Use fetchall() to get all the data of the query.
-        # Note: fetchall() can be costly and inefficient.
-        # Other efficient ways have been discussed extensively on the Internet. Or you can ask ChatGPT ;)
-        dataset = data.fetchall()
-        df = pd.DataFrame(dataset, columns=['datetime', 'tickersymbol', 'price'])
-        df.to_csv('src/ticks.csv', index=False)
-
-        # Print the total number of ticks of that day
-        print(f'Total number of tick: {len(dataset)}')
\ No newline at end of file
+import time
+import queue
+import argparse
+import threading
+
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from tick_store import TickStore
+
+# Ticks newer than the (datetime, tickersymbol) watermark, in ingestion order
+tick_query = """
+    SELECT m.datetime, m.tickersymbol, m.price
+    FROM "quote"."matched" m
+    WHERE m.tickersymbol LIKE %(ticker_pattern)s
+    and m.datetime >= %(start)s
+    and (m.datetime, m.tickersymbol) > (%(watermark_datetime)s, %(watermark_ticker)s)
+    ORDER BY m.datetime, m.tickersymbol
+"""
+
+# Contracts with ticks after the watermark, with the time range of those ticks
+contracts_query = """
+    SELECT m.tickersymbol, min(m.datetime), max(m.datetime)
+    FROM "quote"."matched" m
+    WHERE m.tickersymbol LIKE %(ticker_pattern)s
+    and m.datetime >= %(start)s
+    and (m.datetime, m.tickersymbol) > (%(watermark_datetime)s, %(watermark_ticker)s)
+    GROUP BY m.tickersymbol
+"""
+
+# Ticks of one contract after the watermark in [range_start, range_end), up to until
+range_query = """
+    SELECT m.datetime, m.tickersymbol, m.price
+    FROM "quote"."matched" m
+    WHERE m.tickersymbol = %(ticker)s
+    and m.datetime >= %(start)s
+    and m.datetime >= %(range_start)s and m.datetime < %(range_end)s and m.datetime <= %(until)s
+    and (m.datetime, m.tickersymbol) > (%(watermark_datetime)s, %(watermark_ticker)s)
+    ORDER BY m.datetime
+"""
+
+def load_db_info(path='src/database.json'):
+    with open(path, 'rb') as fb:
+        return json.load(fb)
+
+def connect(db_info):
+    return psycopg.connect(
+        host=db_info['host'],
+        port=db_info['port'],
+        dbname=db_info['database'],
+        user=db_info['user'],
+        password=db_info['password']
+    )
+
+def sync_ticks(conn, store_path='src/ticks', batch_size=100_000,
+               ticker_pattern='VN30F23%', start='2023-01-01 00:00:00', full=False, report=print):
+    # Download only the ticks after the store's watermark, streamed through a server-side
+    # cursor. Rows arrive in datetime order, so each finished day is flushed to its partition
+    # together with the new watermark and at most one day of ticks is held in memory.
+    store = TickStore(store_path)
+    if full:
+        store.clear()
+    watermark_datetime, watermark_ticker = store.watermark or (start, '')
+    params = {
+        'ticker_pattern': ticker_pattern,
+        'start': start,
+        'watermark_datetime': pd.Timestamp(watermark_datetime).to_pydatetime(),
+        'watermark_ticker': watermark_ticker,
+    }
+
+    started = time.perf_counter()
+    total = 0
+    pending = None
+    with conn.cursor(name='tick_sync') as data:
+        data.itersize = batch_size
+        data.execute(tick_query, params)
+        while True:
+            rows = data.fetchmany(batch_size)
+            if rows:
+                total += len(rows)
+                batch = pd.DataFrame(rows, columns=['datetime', 'tickersymbol', 'price'])
+                pending = batch if pending is None else pd.concat([pending, batch], ignore_index=True)
+            if pending is not None and len(pending):
+                day = pd.to_datetime(pending['datetime']).dt.normalize()
+                # Keep the last (possibly unfinished) day in memory until the next batch
+                done = (day < day.iloc[-1]).to_numpy() if rows else np.ones(len(pending), dtype=bool)
+                if done.any():
+                    last = pending[done].iloc[-1]
+                    store.append(pending[done], (last['datetime'], last['tickersymbol']))
+                    pending = pending[~done]
+            elapsed = time.perf_counter() - started
+            report(f'{total:,} ticks in {elapsed:.1f}s ({total / elapsed if elapsed else 0:,.0f} ticks/s)')
+            if not rows:
+                break
+    return total
+
+class ConnectionPool:
+    # At most `size` connections, opened on first use and shared by the download threads.
+    # A connection whose query failed is closed; the next user opens a fresh one.
+    def __init__(self, db_info, size):
+        self.db_info = db_info
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle = queue.SimpleQueue()
+
+    @contextmanager
+    def connection(self):
+        with self.slots:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                conn = connect(self.db_info)
+                conn.autocommit = True  # Read-only queries, no transaction left open between ranges
+            try:
+                yield conn
+            except BaseException:
+                conn.close()
+                raise
+            self.idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def plan_ranges(contracts, range_days=7):
+    # [(range_start, range_end, [ticker])]: consecutive ranges of range_days days from
+    # midnight of the first tick, each with the contracts that have ticks in it
+    first = min(pd.Timestamp(lo) for _, lo, _ in contracts).normalize()
+    last = max(pd.Timestamp(hi) for _, _, hi in contracts)
+    step = pd.Timedelta(days=range_days)
+    ranges = []
+    range_start = first
+    while range_start <= last:
+        range_end = range_start + step
+        tickers = sorted(ticker for ticker, lo, hi in contracts
+                         if pd.Timestamp(lo) < range_end and pd.Timestamp(hi) >= range_start)
+        if tickers:
+            ranges.append((range_start, range_end, tickers))
+        range_start = range_end
+    return ranges
+
+def fetch_range(pool, params, retries=3):
+    # One contract's ticks in one range, retried with exponential backoff on database errors
+    for attempt in range(retries + 1):
+        try:
+            with pool.connection() as conn:
+                return conn.execute(range_query, params).fetchall()
+        except psycopg.Error:
+            if attempt == retries:
+                raise
+            time.sleep(0.5 * 2 ** attempt)
+
+def parallel_sync(db_info, store_path='src/ticks', connections=4, range_days=7, ticker_pattern='VN30F23%',
+                  start='2023-01-01 00:00:00', full=False, retries=3, report=print):
+    # sync_ticks over concurrent queries: the period after the watermark is cut into
+    # range_days ranges per contract, fetched by a thread pool sharing `connections` pooled
+    # connections. The ranges are merged and flushed to the store in time order, each range
+    # with its watermark, so only a few ranges are in memory and a failed run resumes after
+    # the last range stored.
+    store = TickStore(store_path)
+    if full:
+        store.clear()
+    watermark_datetime, watermark_ticker = store.watermark or (start, '')
+    params = {
+        'ticker_pattern': ticker_pattern,
+        'start': start,
+        'watermark_datetime': pd.Timestamp(watermark_datetime).to_pydatetime(),
+        'watermark_ticker': watermark_ticker,
+    }
+
+    started = time.perf_counter()
+    total = 0
+    with ConnectionPool(db_info, connections) as pool, ThreadPoolExecutor(max_workers=connections) as executor:
+        with pool.connection() as conn:
+            contracts = conn.execute(contracts_query, params).fetchall()
+        if not contracts:
+            return 0
+        # Ticks that arrive during the download are left to the next sync
+        params['until'] = max(hi for _, _, hi in contracts)
+        ranges = iter(plan_ranges(contracts, range_days))
+        pending = deque()
+        try:
+            while True:
+                # Keep about two queries per connection in flight, whole ranges at a time
+                while sum(len(futures) for futures in pending) < 2 * connections:
+                    planned = next(ranges, None)
+                    if planned is None:
+                        break
+                    range_start, range_end, tickers = planned
+                    pending.append([executor.submit(fetch_range, pool, {
+                        **params, 'ticker': ticker, 'range_start': range_start.to_pydatetime(),
+                        'range_end': range_end.to_pydatetime()}, retries) for ticker in tickers])
+                if not pending:
+                    break
+                rows = [row for future in pending.popleft() for row in future.result()]
+                if rows:
+                    total += len(rows)
+                    batch = pd.DataFrame(rows, columns=['datetime', 'tickersymbol', 'price'])
+                    batch = batch.sort_values(['datetime', 'tickersymbol'], kind='stable', ignore_index=True)
+                    last = batch.iloc[-1]
+                    store.append(batch, (last['datetime'], last['tickersymbol']))
+                elapsed = time.perf_counter() - started
+                report(f'{total:,} ticks in {elapsed:.1f}s ({total / elapsed if elapsed else 0:,.0f} ticks/s)')
+        except BaseException:
+            executor.shutdown(cancel_futures=True)
+            raise
+    return total
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Download VN30F ticks into the tick store')
+    parser.add_argument('--database', default='src/database.json', help='Database connection file')
+    parser.add_argument('--store', default='src/ticks', help='Tick store directory')
+    parser.add_argument('--batch-size', type=int, default=100_000, help='Rows fetched per batch')
+    parser.add_argument('--start', default='2023-01-01 00:00:00', help='First tick datetime')
+    parser.add_argument('--tickers', default='VN30F23%', help='SQL LIKE pattern of the tickers')
+    parser.add_argument('--full', action='store_true', help='Drop the store and download everything again')
+    parser.add_argument('--connections', type=int, default=4,
+                        help='Concurrent range queries (1 streams everything through one cursor)')
+    parser.add_argument('--range-days', type=int, default=7, help='Days per range query of one contract')
+    parser.add_argument('--retries', type=int, default=3, help='Retries of a failed range query')
+    args = parser.parse_args()
+
+    db_info = load_db_info(args.database)
+    if args.connections > 1:
+        total = parallel_sync(db_info, args.store, args.connections, args.range_days, args.tickers, args.start,
+                              args.full, args.retries)
+    else:
+        with connect(db_info) as conn:
+            total = sync_ticks(conn, args.store, args.batch_size, args.tickers, args.start, args.full)
+
+    # Print the total number of new ticks
+    print(f'Total number of tick: {total}')
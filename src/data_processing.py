@@ -1,131 +1,148 @@
-
 import pandas as pd
 import numpy as np
-import psycopg
 import json
-import pprint
-import mplfinance as mpf
 import argparse
-
-from typing import List
-from matplotlib import pyplot as plt
-from numpy.testing import assert_almost_equal, assert_equal
-import matplotlib.pyplot as plt
-
-df = pd.read_csv('src/ticks.csv', parse_dates=['datetime'])
-dataset = list(df.itertuples(index=False, name=None))
-parser = argparse.ArgumentParser(description='Flag for data processing')
-parser.add_argument('--params', action='store_true', help='Use external params')
-args = parser.parse_args()
-if args.params:
-    with open('src/params.json', 'r') as pf:
-        params = json.load(pf)
-    time_frame = params.get('time_frame', 1)            # default to 1 minute if not set
-    sma_window = params.get('sma_window', 50)
-    
-else:
-    time_frame = 1                                     # default to 1 minute if not set
-    sma_window = 50                                   # default to 50 if not set
-    
-resample_interval = f'{time_frame}min'  
-# Sort dataset by ticker, then by datetime
-dataset.sort(key=lambda x: (x[1], x[0]))
-# Devide data into in-sample and out-sample
-in_sample_dataset = dataset[:int(len(dataset)*0.7)]
-out_sample_dataset = dataset[int(len(dataset)*0.7):]
-
-# Chuyển dữ liệu sang DataFrame của in_sample_data
-in_sample_candle = pd.DataFrame(in_sample_dataset, columns=['datetime', 'tickersymbol', 'price'])
-in_sample_candle['price'] = pd.to_numeric(in_sample_candle['price'], errors='coerce')
-
-# Chuyển đổi cột datetime về kiểu datetime
-in_sample_candle['datetime'] = pd.to_datetime(in_sample_candle['datetime'])
-in_sample_candle.set_index('datetime', inplace=True)
-in_sample_candle['ticker_month'] = in_sample_candle['tickersymbol'].str[-2:].astype(int)
-
-# Create a boolean mask: keep rows if ticker_month <= (datetime month + 1)
-mask = in_sample_candle['ticker_month'] <= (in_sample_candle.index.month + 1)
-
-# Filter the DataFrame using the mask
-in_sample_candle = in_sample_candle[mask]
-
-# (Optional) Remove the temporary column if no longer needed
-in_sample_candle.drop(columns='ticker_month', inplace=True)
-
-# Sort by datetime
-in_sample_candle.sort_index(inplace=True)
-
-# Resample dữ liệu theo khung 1 giờ (1h)
-in_sample_candle_ohlc = in_sample_candle['price'].resample(resample_interval).ohlc()
-in_sample_candle_ohlc = (
-    in_sample_candle
-    .groupby('tickersymbol')
-    .resample(resample_interval)['price']
-    .ohlc()
-    .reset_index()
-)
-in_sample_candle_ohlc.set_index('datetime', inplace=True)
-
-# Vẽ biểu đồ nến
-#mpf.plot(in_sample_candle_ohlc[50:200], type='candle', style='charles',
-      #  title=" In sample data VN30F2311 Candlestick Chart (1m)", ylabel="Price")
-
-# Chuyển dữ liệu sang DataFrame của out_sample_data
-out_sample_candle = pd.DataFrame(out_sample_dataset, columns=['datetime', 'tickersymbol', 'price'])
-out_sample_candle['price'] = pd.to_numeric(out_sample_candle['price'], errors='coerce')
-
-# Chuyển đổi cột datetime về kiểu datetime
-out_sample_candle['datetime'] = pd.to_datetime(out_sample_candle['datetime'])
-out_sample_candle.set_index('datetime', inplace=True)
-out_sample_candle['ticker_month'] = out_sample_candle['tickersymbol'].str[-2:].astype(int)
-
-# Filter the DataFrame using the mask
-out_sample_candle = out_sample_candle[out_sample_candle['ticker_month'] <= (out_sample_candle.index.month + 1)]
-
-# (Optional) Remove the temporary column if no longer needed
-out_sample_candle.drop(columns='ticker_month', inplace=True)
-
-# Sort by datetime
-out_sample_candle.sort_index(inplace=True)
-
-# Resample dữ liệu theo khung 1 giờ (1h)
-out_sample_candle_ohlc = out_sample_candle['price'].resample(resample_interval).ohlc()
-out_sample_candle_ohlc = (
-    out_sample_candle
-    .groupby('tickersymbol')
-    .resample(resample_interval)['price']
-    .ohlc()
-    .reset_index()
-)
-out_sample_candle_ohlc.set_index('datetime', inplace=True)
-
-# Vẽ biểu đồ nến
-#mpf.plot(out_sample_candle_ohlc[50:200], type='candle', style='charles',
-       # title=" Out sample data VN30F2311 Candlestick Chart (1m)", ylabel="Price")
-
-# --- Prepare Data ---
-# Assume in_sample_candle_ohlc is a DataFrame with a DateTimeIndex.
-df = in_sample_candle_ohlc.copy()
-df['SMA'] = df['close'].rolling(window=sma_window, min_periods=sma_window).mean()
-
-# Reset the index so that the datetime becomes a column.
-df.reset_index(inplace=True)
-df.rename(columns={'index': 'datetime'}, inplace=True)
-
-# Convert DataFrame to list of dictionaries for faster common indexing
-df_list = df.to_dict('records')
-# Save df_list to a JSON file
-with open('src/in-sample.json', 'w') as f:
-    json.dump(df_list, f, default=str, indent=4)
-
-df = out_sample_candle_ohlc.copy()
-df['SMA'] = df['close'].rolling(window=sma_window, min_periods=sma_window).mean()
-# Reset the index so that the datetime becomes a column.
-df.reset_index(inplace=True)
-df.rename(columns={'index': 'datetime'}, inplace=True)
-
-# Convert DataFrame to list of dictionaries for faster common indexing
-df_list = df.to_dict('records')
-# Save df_list to a JSON file
-with open('src/out-sample.json', 'w') as f:
-    json.dump(df_list, f, default=str, indent=4)
+import math
+import os
+
+import storage
+import tick_store
+import instrument
+
+in_sample_ratio = 0.7
+
+ticks_path = 'src/ticks'
+
+def ensure_tick_store(path=ticks_path, csv_path=None):
+    # Convert a downloaded ticks.csv into the tick store once (or when it changes)
+    csv_path = csv_path or path.rstrip('/') + '.csv'
+    manifest_path = os.path.join(path, tick_store.MANIFEST_FILE)
+    if os.path.exists(csv_path) and (
+        not os.path.exists(manifest_path) or os.path.getmtime(csv_path) > os.path.getmtime(manifest_path)
+    ):
+        tick_store.convert_csv(csv_path, path)
+    return path
+
+@instrument.timed('load')
+def load_ticks(path=ticks_path):
+    if path.endswith('.csv'):
+        df = pd.read_csv(path, parse_dates=['datetime'])
+        # Sort dataset by ticker, then by datetime (stable, so equal keys keep their file order)
+        return df.sort_values(['tickersymbol', 'datetime'], kind='stable', ignore_index=True)
+    return tick_store.TickStore(ensure_tick_store(path)).read_ticks()
+
+def split_dataset(ticks, ratio=in_sample_ratio):
+    # Devide data into in-sample and out-sample
+    cut = int(len(ticks) * ratio)
+    return ticks.iloc[:cut], ticks.iloc[cut:]
+
+def first_days(candles, fraction):
+    # Candles of the first `fraction` of the trading days (days with a traded candle, at least
+    # one), in their original order; used to score trials cheaply on part of the in-sample data
+    if fraction >= 1 or candles.empty:
+        return candles
+    days = candles['datetime'].dt.normalize()
+    trading_days = np.sort(days[candles['close'].notna()].unique())
+    if len(trading_days) == 0:
+        return candles
+    last_day = trading_days[max(1, math.ceil(len(trading_days) * fraction)) - 1]
+    return candles[days <= last_day]
+
+def filter_contracts(ticks):
+    # Ticks indexed by datetime, restricted to the traded contracts and sorted by datetime
+    candle = ticks[['datetime', 'tickersymbol', 'price']].copy()
+    candle['price'] = pd.to_numeric(candle['price'], errors='coerce')
+
+    # Chuyển đổi cột datetime về kiểu datetime
+    candle['datetime'] = pd.to_datetime(candle['datetime'])
+    candle.set_index('datetime', inplace=True)
+    ticker_month = candle['tickersymbol'].str[-2:].astype(int)
+
+    # Keep rows if ticker_month <= (datetime month + 1)
+    candle = candle[ticker_month <= (candle.index.month + 1)]
+
+    # Sort by datetime
+    candle.sort_index(inplace=True)
+    return candle
+
+@instrument.timed('resample')
+def resample_candles(ticks, time_frame):
+    resample_interval = f'{time_frame}min'
+    candle = filter_contracts(ticks)
+
+    # Resample dữ liệu theo khung time_frame phút
+    candle_ohlc = (
+        candle
+        .groupby('tickersymbol')
+        .resample(resample_interval)['price']
+        .ohlc()
+        .reset_index()
+    )
+    candle_ohlc.set_index('datetime', inplace=True)
+    return candle_ohlc
+
+@instrument.timed('sma')
+def add_sma(candle_ohlc, sma_window):
+    df = candle_ohlc.copy()
+    df['SMA'] = df['close'].rolling(window=sma_window, min_periods=sma_window).mean()
+
+    # Reset the index so that the datetime becomes a column.
+    df.reset_index(inplace=True)
+    df.rename(columns={'index': 'datetime'}, inplace=True)
+    return df
+
+def process(ticks, time_frame=1, sma_window=50):
+    # Build the in-sample and out-sample candles (with SMA) for one parameter set
+    in_sample_ticks, out_sample_ticks = split_dataset(ticks)
+    return {
+        'in-sample': add_sma(resample_candles(in_sample_ticks, time_frame), sma_window),
+        'out-sample': add_sma(resample_candles(out_sample_ticks, time_frame), sma_window),
+    }
+
+def save_candles(df, path, extra=None):
+    # Save the candles as a columnar store that backtest.py memory-maps
+    storage.write_candles(path, df, extra)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Flag for data processing')
+    parser.add_argument('--params', action='store_true', help='Use external params')
+    parser.add_argument('--no-cache', action='store_true', help='Always resample from the ticks')
+    parser.add_argument('--plot', action='store_true', help='Plot in-sample candles (needs mplfinance)')
+    parser.add_argument('--continuous', action='store_true',
+                        help='One front-month series (VN30F1M) rolled across contracts')
+    parser.add_argument('--adjust', choices=['none', 'difference', 'ratio'], default='none',
+                        help='Back-adjustment of the continuous series at rolls')
+    parser.add_argument('--roll-days', type=int, default=0,
+                        help='Roll the continuous series this many business days before expiry')
+    args = parser.parse_args()
+    if args.params:
+        with open('src/params.json', 'r') as pf:
+            params = json.load(pf)
+        time_frame = params.get('time_frame', 1)            # default to 1 minute if not set
+        sma_window = params.get('sma_window', 50)
+
+    else:
+        time_frame = 1                                     # default to 1 minute if not set
+        sma_window = 50                                   # default to 50 if not set
+
+    # The time frame the candles were resampled at, checked by portfolio.py
+    extra = {'time_frame': time_frame}
+    if args.continuous:
+        import continuous
+        samples = continuous.process(load_ticks(), time_frame, sma_window, args.roll_days, args.adjust)
+        # The roll settings, for the tick index of --tick-exits (tick_index.load_candle_index)
+        extra['continuous'] = {'roll_days_before': args.roll_days, 'adjust': args.adjust}
+    elif args.no_cache:
+        samples = process(load_ticks(), time_frame, sma_window)
+    else:
+        from candle_cache import CandleCache
+        samples = CandleCache().samples(time_frame, sma_window)
+
+    if args.plot:
+        # Vẽ biểu đồ nến; mplfinance is only loaded for the plot
+        import mplfinance as mpf
+        mpf.plot(samples['in-sample'].set_index('datetime')[50:200], type='candle', style='charles',
+                 title=f" In sample data Candlestick Chart ({time_frame}m)", ylabel="Price")
+
+    save_candles(samples['in-sample'], 'src/in-sample', extra)
+    save_candles(samples['out-sample'], 'src/out-sample', extra)
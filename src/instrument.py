@@ -0,0 +1,166 @@
+import json
+import math
+import time
+import functools
+import tracemalloc
+
+from contextlib import contextmanager
+
+# Stage timers for the pipeline. Library code wraps its stages in `with stage('name'):`; the
+# timers cost nothing unless a record is being collected with `with record() as rec:`, which
+# fills rec['timings'] with the seconds spent in each stage. Stages are exclusive: a stage
+# entered inside another one (e.g. loading ticks inside resampling on a cache miss) pauses its
+# parent, so the timings add up to the instrumented time without double counting.
+STAGES = ('load', 'resample', 'sma', 'prepare', 'signals', 'exits', 'capital', 'metrics')
+
+_record = None  # Record being collected, or None
+_stack = []     # Frames of the open stages, innermost last
+
+@contextmanager
+def stage(name):
+    if _record is None:
+        yield
+        return
+    now = time.perf_counter()
+    memory = 'peak_mb' in _record
+    if _stack:
+        parent = _stack[-1]
+        _add(parent[0], now - parent[1])
+        if memory:
+            # The peak is reset for the child stage, so keep the parent's peak so far
+            parent[3] = max(parent[3], tracemalloc.get_traced_memory()[1])
+    frame = [name, now, 0, 0]  # name, started, bytes in use at the start, peak so far
+    if memory:
+        frame[2] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    _stack.append(frame)
+    try:
+        yield
+    finally:
+        now = time.perf_counter()
+        _stack.pop()
+        _add(name, now - frame[1])
+        if memory:
+            # Peak above the memory in use when the stage started, nested stages included
+            peak = (max(frame[3], tracemalloc.get_traced_memory()[1]) - frame[2]) / 2**20
+            _record['peak_mb'][name] = max(_record['peak_mb'].get(name, 0.0), peak)
+        if _stack:
+            _stack[-1][1] = now
+
+def timed(name):
+    # Decorator form of stage() for functions that are one stage as a whole
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def _add(name, seconds):
+    timings = _record['timings']
+    timings[name] = timings.get(name, 0.0) + seconds
+
+@contextmanager
+def record(profile_path=None, memory=False):
+    # Collect the stage timings of the enclosed code. With profile_path, the code also runs
+    # under cProfile and the stats are dumped there (load them with pstats); with memory, the
+    # tracemalloc peak of each stage goes to rec['peak_mb'].
+    global _record
+    rec = {'timings': {}}
+    if memory:
+        rec['peak_mb'] = {}
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+    profiler = None
+    if profile_path:
+        import cProfile
+        profiler = cProfile.Profile()
+    outer, _record = _record, rec
+    stack = _stack[:]
+    _stack.clear()
+    started = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield rec
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+        rec['seconds'] = time.perf_counter() - started
+        _record = outer
+        _stack[:] = stack
+        if memory and not tracing:
+            tracemalloc.stop()
+
+def breakdown(records):
+    # Total seconds per stage over many records, most expensive first
+    totals = {}
+    for rec in records:
+        for name, seconds in rec.get('timings', {}).items():
+            totals[name] = totals.get(name, 0.0) + seconds
+    return dict(sorted(totals.items(), key=lambda item: -item[1]))
+
+def format_breakdown(totals, trials=None):
+    # Lines of a per-stage time table; with trials, also the mean time per trial
+    total = sum(totals.values()) or 1.0
+    lines = []
+    for name, seconds in totals.items():
+        line = f"  {name:<10} {seconds:>10.3f} s {seconds / total:>7.1%}"
+        if trials:
+            line += f" {seconds / trials * 1000:>10.3f} ms/trial"
+        lines.append(line)
+    return lines
+
+def _json_value(value):
+    # NaN and infinity are not JSON; write them as null
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {key: _json_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_value(item) for item in value]
+    return value
+
+class TraceLog:
+    # Appends one JSON record per line and keeps the stage totals of the records it wrote
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a')
+        self.records = 0
+        self.totals = {}
+
+    def write(self, rec):
+        self.file.write(json.dumps(_json_value(rec), sort_keys=True) + '\n')
+        self.file.flush()
+        self.records += 1
+        for name, seconds in rec.get('timings', {}).items():
+            self.totals[name] = self.totals.get(name, 0.0) + seconds
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def read_trace(path):
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Per-stage time breakdown of a JSON-lines trace")
+    parser.add_argument("trace", nargs="?", default="src/optimization_trials.jsonl", help="Trace file")
+    args = parser.parse_args()
+
+    records = read_trace(args.trace)
+    trials = sum(rec.get('kind') == 'trial' for rec in records)
+    print(f"{len(records)} records, {trials} trials in {args.trace}")
+    for line in format_breakdown(breakdown(records), trials):
+        print(line)
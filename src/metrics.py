@@ -0,0 +1,159 @@
+import numpy as np
+
+import instrument
+
+from typing import NamedTuple
+
+# Performance metrics of trade ledgers, computed with NumPy in one pass over the trades.
+# A batch of ledgers is given as (trades, ledgers) arrays plus a mask of the trades that
+# belong to each ledger, so scoring thousands of ledgers is a handful of array operations.
+# A single ledger gives the same values as the original pandas code in evaluate.py, except
+# that exits at the same time are taken in ledger order rather than in quicksort order.
+initial_capital = 100_000_000  # VND
+
+# Sharpe Ratio settings (daily-based)
+risk_free_rate_annual = 0.03  # 3% annual risk-free rate
+trading_days_per_year = 252
+
+class Metrics(NamedTuple):
+    total_profit: float   # VND, trades with an unknown (NaN) profit are skipped
+    total_trades: int
+    final_capital: float  # VND
+    hpr: float            # Holding period return, %
+    mdd: float            # Maximum drawdown of the capital at each exit, %
+    sharpe: float         # Daily-based Sharpe ratio, NaN without return variance
+    win_rate: float       # Winning trades among trades with a known profit, %
+    profit_factor: float  # Gross profit / gross loss
+    exposure: float       # Time with at least one open position, % of first entry to last exit
+
+def _as_batch(values, shape):
+    return np.broadcast_to(values[:, None] if values.ndim == 1 else values, shape)
+
+def compute_batch(entry_time, exit_time, profit, traded=None):
+    # entry_time, exit_time: datetime64 arrays of shape (trades,) or (trades, ledgers)
+    # profit: VND per trade, shape (trades, ledgers); rows in ledger (closing) order
+    # traded: whether each trade is part of each ledger (default: all of them)
+    # Returns Metrics of arrays with one value per ledger
+    profit = np.asarray(profit, dtype=np.float64)
+    if profit.ndim == 1:
+        profit = profit[:, None]
+    shape = profit.shape
+    trades, ledgers = shape
+    traded = np.ones(shape, dtype=bool) if traded is None else _as_batch(np.asarray(traded, dtype=bool), shape)
+    entry_time = _as_batch(np.asarray(entry_time, dtype='datetime64[ns]'), shape)
+    exit_time = _as_batch(np.asarray(exit_time, dtype='datetime64[ns]'), shape)
+    valid = traded & ~np.isnan(profit)
+
+    # Profit in ledger order, like trades_df["profit_vnd"].sum()
+    ledger_profit = np.ascontiguousarray(np.where(valid, profit, 0.0).T)
+    total_profit = ledger_profit.sum(axis=1)
+    total_trades = traded.sum(axis=0)
+    final_capital = initial_capital + total_profit
+    hpr = ((final_capital - initial_capital) / initial_capital) * 100
+
+    # Capital after each exit in exit-time order; trades without a known profit are skipped.
+    # Trades outside the ledger sort last as NaT and the stable sort keeps exits at the same
+    # time in ledger order, so the order does not depend on the other ledgers of the batch.
+    order = np.argsort(np.where(traded, exit_time, np.datetime64('NaT')), axis=0, kind='stable')
+    sorted_valid = np.take_along_axis(valid, order, axis=0)
+    sorted_profit = np.where(sorted_valid, np.take_along_axis(profit, order, axis=0), 0.0)
+    capital = np.where(sorted_valid, initial_capital + np.cumsum(sorted_profit, axis=0), np.nan)
+    running_max = np.fmax.accumulate(capital, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        peak = np.fmax.reduce(running_max, axis=0, initial=-np.inf)
+        drawdown = np.fmax.reduce(running_max - capital, axis=0, initial=-np.inf)
+        mdd = np.where(total_trades == 0, 0.0,
+                       np.where(np.isinf(peak), np.nan, np.where(peak != 0, drawdown / peak * 100, 0.0)))
+
+    sharpe = _daily_sharpe(exit_time, traded, order, capital, sorted_valid)
+
+    # Win rate and profit factor over the trades with a known profit
+    known = valid.sum(axis=0)
+    wins = (valid & (profit > 0)).sum(axis=0)
+    gross_profit = np.where(valid & (profit > 0), profit, 0.0).sum(axis=0)
+    gross_loss = -np.where(valid & (profit < 0), profit, 0.0).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        win_rate = np.where(known > 0, wins / known * 100, np.nan)
+        profit_factor = np.where(gross_loss > 0, gross_profit / gross_loss,
+                                 np.where(gross_profit > 0, np.inf, np.nan))
+
+    # Exposure: union of the holding intervals, swept in entry order
+    base = entry_time[traded].min() if total_trades.any() else np.datetime64(0, 'ns')
+    start = np.where(traded, (entry_time - base).astype(np.float64), np.nan)
+    end = np.where(traded, (exit_time - base).astype(np.float64), np.nan)
+    by_entry = np.argsort(start, axis=0, kind='stable')
+    start = np.take_along_axis(start, by_entry, axis=0)
+    end = np.take_along_axis(end, by_entry, axis=0)
+    covered_until = np.vstack([np.full((1, ledgers), -np.inf), np.fmax.accumulate(end, axis=0)[:-1]])[:trades]
+    held = np.nansum(np.clip(end - np.fmax(start, covered_until), 0, None), axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        span = np.fmax.reduce(end, axis=0, initial=-np.inf) - np.fmin.reduce(start, axis=0, initial=np.inf)
+        exposure = np.where(total_trades == 0, np.nan, np.where(span > 0, held / span * 100, 0.0))
+
+    return Metrics(total_profit, total_trades, final_capital, hpr, mdd, sharpe,
+                   win_rate, profit_factor, exposure)
+
+def _daily_sharpe(exit_time, traded, order, capital, sorted_valid):
+    # The capital at the last exit of each day, forward-filled over calendar days, as daily
+    # returns. A day whose trades all have an unknown profit has no capital; it and the day
+    # after it get a zero return, as pct_change().fillna(0) gives them.
+    trades, ledgers = capital.shape
+    if not traded.any():
+        return np.full(ledgers, np.nan)
+    exit_day = exit_time.astype('datetime64[D]')
+    first_day = exit_day[traded].min()
+    days = (exit_day[traded].max() - first_day).astype(int) + 1
+    sorted_traded = np.take_along_axis(traded, order, axis=0)
+    sorted_day = np.take_along_axis((exit_day - first_day).astype(int), order, axis=0)
+
+    has_trade = np.zeros((days, ledgers), dtype=bool)
+    rows, cols = np.nonzero(sorted_traded)
+    has_trade[sorted_day[rows, cols], cols] = True
+    last_row = np.full((days, ledgers), -1)
+    rows, cols = np.nonzero(sorted_valid)
+    np.maximum.at(last_row, (sorted_day[rows, cols], cols), rows)
+    has_value = last_row >= 0
+    day_equity = np.take_along_axis(capital, np.maximum(last_row, 0), axis=0)
+
+    # Each ledger's equity runs from its first to its last day with a trade
+    day = np.arange(days)[:, None]
+    any_trade = has_trade.any(axis=0)
+    start = np.argmax(has_trade, axis=0)
+    stop = days - np.argmax(has_trade[::-1], axis=0)
+    in_range = (day >= start) & (day < stop) & any_trade
+    filled_from = np.maximum.accumulate(np.where(has_trade, day, 0), axis=0)
+    known = np.take_along_axis(has_value, filled_from, axis=0) & in_range
+    daily_equity = np.take_along_axis(day_equity, filled_from, axis=0)
+
+    daily_returns = np.zeros((days, ledgers))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        daily_returns[1:] = np.where(known[1:] & known[:-1], daily_equity[1:] / daily_equity[:-1] - 1, 0.0)
+    excess_returns = daily_returns - risk_free_rate_annual / trading_days_per_year
+
+    count = in_range.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if ledgers == 1:
+            # Same summation as pandas mean() and std() on the one ledger's days
+            values = excess_returns[in_range[:, 0], 0]
+            mean_excess_return = np.array([values.sum() / count[0]])
+            std_excess_return = np.sqrt(np.array([((mean_excess_return[0] - values) ** 2).sum() / (count[0] - 1)]))
+        else:
+            excess_returns = np.where(in_range, excess_returns, 0.0)
+            mean_excess_return = excess_returns.sum(axis=0) / count
+            deviation = np.where(in_range, mean_excess_return - excess_returns, 0.0)
+            std_excess_return = np.sqrt((deviation ** 2).sum(axis=0) / (count - 1))
+        sharpe = (mean_excess_return / std_excess_return) * np.sqrt(trading_days_per_year)
+    return np.where(std_excess_return != 0, sharpe, np.nan)
+
+@instrument.timed('metrics')
+def compute(trades):
+    # Metrics of one trade ledger: a DataFrame, a structured array (backtest.TradeLedger) or
+    # a dict of column arrays (storage.read_trades(path, frame=False)) with entry_time,
+    # exit_time and profit_vnd
+    if len(trades) == 0 or len(trades["profit_vnd"]) == 0:
+        batch = compute_batch(np.empty(0, 'datetime64[ns]'), np.empty(0, 'datetime64[ns]'), np.empty(0))
+    else:
+        batch = compute_batch(np.asarray(trades["entry_time"], dtype='datetime64[ns]'),
+                              np.asarray(trades["exit_time"], dtype='datetime64[ns]'),
+                              np.asarray(trades["profit_vnd"], dtype=np.float64))
+    return Metrics(*(value[0].item() for value in batch))
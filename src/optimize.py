@@ -1,21 +1,20 @@
 import json
+import os
 import random
-import subprocess
 import argparse
 
-# ─── Parse seed flag ────────────────────────────────────────────────────────
-parser = argparse.ArgumentParser(
-    description="Optimize trading params, with optional random seed"
-)
-parser.add_argument(
-    "--seed",
-    type=int,
-    help="Seed for the RNG to make optimization reproducible"
-)
-args = parser.parse_args()
-if args.seed is not None:
-    random.seed(args.seed)
-    print(f"[optimize.py] Random seed set to {args.seed}")
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ProcessPoolExecutor
+
+import backtest
+import search
+import instrument
+import trial_store
+
+import data_processing
+import candle_cache
+
+from candle_cache import CandleCache
 
 # Define parameter ranges
 SMA_MIN, SMA_MAX = 10, 100               # SMA window range (inclusive)
@@ -23,122 +22,354 @@ TP_MIN, TP_MAX = 2.0, 10.0                # Take-profit range
 SL_MIN, SL_MAX = -5.0, -0.5             # Stop-loss range (negative values)
 TIMEFRAME_MIN, TIMEFRAME_MAX = 1, 20  # Time frame range in minutes (inclusive)
 
+# The same ranges as the search space of the adaptive strategies (see search.py)
+SPACE = [
+    ("sma_window", SMA_MIN, SMA_MAX, True),
+    ("take_profit", TP_MIN, TP_MAX, False),
+    ("stop_loss", SL_MIN, SL_MAX, False),
+    ("time_frame", TIMEFRAME_MIN, TIMEFRAME_MAX, True),
+]
+
 # Configuration: number of random combinations to try
 NUM_COMBINATIONS = 500
 
-best_profit = float("-inf")
-best_params = None
-
-for time in range(NUM_COMBINATIONS):
+def sample_params(rng=random):
     # Randomly sample a combination of parameters
-    sma_window = random.randint(SMA_MIN, SMA_MAX)
-    take_profit = round(random.uniform(TP_MIN, TP_MAX), 2)
-    stop_loss = round(random.uniform(SL_MIN, SL_MAX), 2)
-    time_frame = random.randint(TIMEFRAME_MIN, TIMEFRAME_MAX)
-    
+    sma_window = rng.randint(SMA_MIN, SMA_MAX)
+    take_profit = round(rng.uniform(TP_MIN, TP_MAX), 2)
+    stop_loss = round(rng.uniform(SL_MIN, SL_MAX), 2)
+    time_frame = rng.randint(TIMEFRAME_MIN, TIMEFRAME_MAX)
+
     # But the total time is not more than 500 minutes for a day
     if time_frame * sma_window > 100:
         sma_window = 100 // time_frame
 
-    params = {
+    return {
         "sma_window": sma_window,
         "take_profit": take_profit,
         "stop_loss": stop_loss,
         "time_frame": time_frame
     }
 
-    # Save parameters to params.json for use by other scripts
-    with open("src/params.json", "w") as f:
-        json.dump(params, f, indent=4)
+# --- Trial worker ---
+# Each worker process serves its candles from the shared on-disk candle cache, so the
+# ticks are only loaded and resampled on a cache miss. Every trial group is timed per stage
+# (see instrument.py), optionally under cProfile (one stats file per group in _profile_dir)
+# and tracemalloc.
+_cache = None
+_tick_exits = False
+_profile_dir = None
+_trace_memory = False
 
-    # Run data_processing.py to generate in-sample and out-sample JSON files
-    try:
-        subprocess.run(
-            ["python", "src/data_processing.py"], 
-            check=True, capture_output=True, text=True
-        )
-    except subprocess.CalledProcessError as e:
-        # Handle errors gracefully: print error and skip this combination
-        print(f"Error: data_processing.py failed for params {params} (skipping).")
-        print(e.stderr)  # Print the error message for debugging
-        continue
-    #print("Data processing completed successfully.")
-    # Run backtest.py on the in-sample data to evaluate performance
-    try:
-        result = subprocess.run(
-            ["python", "src/backtest.py", "in-sample.json"],  # backtest reads from src/in-sample.json internally
-            check=True, capture_output=True, text=True
-        )
-    except subprocess.CalledProcessError as e:
-        print(f"Error: backtest.py failed for params {params} (skipping).")
-        print(e.stderr)  # Print the error message for debugging
-        continue
-
-    # Parse the total profit from backtest output
-    output_text = result.stdout
-    total_profit = 0.0
-    trades = 0
-    for line in output_text.splitlines():
-        if "Total Profit:" in line:
-            # Expected format: "Total Profit: X VND"
-            try:
-                profit_str = line.split("Total Profit:")[1].strip()
-                # Remove the currency and commas, convert to float
-                profit_value = profit_str.replace("VND", "").strip().replace(",", "")
-                total_profit = float(profit_value)
-            except ValueError:
-                total_profit = 0.0
-        if "Total Trades:" in line:
-            # Expected format: "Total trades: X"
-            try:
-                trades_str = line.split("Total Trades:")[1].strip()
-                trades = int(trades_str)
-            except ValueError:
-                trades = 0
-    # Run data_processing.py to generate in-sample and out-sample JSON files
-    try:
-        result = subprocess.run(
-            ["python", "src/evaluate.py", "--optimize"], 
-            check=True, capture_output=True, text=True
+def init_worker(ticks_path, tick_exits=False, cache_dir=candle_cache.CACHE_DIR, profile_dir=None,
+                trace_memory=False):
+    global _cache, _tick_exits, _profile_dir, _trace_memory
+    _cache = CandleCache(ticks_path, cache_dir)
+    _tick_exits = tick_exits
+    _profile_dir = profile_dir
+    _trace_memory = trace_memory
+
+def _profile_path(name):
+    if _profile_dir is None:
+        return None
+    os.makedirs(_profile_dir, exist_ok=True)
+    return os.path.join(_profile_dir, f"{name}-{os.getpid()}.prof")
+
+def warm_cache():
+    with instrument.record(_profile_path("warmup"), _trace_memory) as rec:
+        _cache.pyramids()
+    return rec
+
+def run_trial_group(param_group, fraction=1.0):
+    # Trials sharing (time_frame, sma_window) have the same candles and entries, so their
+    # exit parameters are scored together in one batched backtest. With fraction < 1 they
+    # are scored on the first fraction of the in-sample days only.
+    time_frame, sma_window = param_group[0]["time_frame"], param_group[0]["sma_window"]
+    with instrument.record(_profile_path(f"tf{time_frame}-sma{sma_window}"), _trace_memory) as rec:
+        samples = _cache.samples(time_frame, sma_window)
+        with instrument.stage("prepare"):
+            candles = backtest.candles_to_arrays(data_processing.first_days(samples["in-sample"], fraction))
+        scores = backtest.run_backtest_grid(
+            candles,
+            [params["take_profit"] for params in param_group],
+            [params["stop_loss"] for params in param_group],
+            time_frame,
+            _cache.tick_index("in-sample") if _tick_exits else None,
         )
-    except subprocess.CalledProcessError as e:
-        # Handle errors gracefully: print error and skip this combination
-        print(f"Error: evaluate.py failed for params {params} (skipping).")
-        print(e.stderr)  # Print the error message for debugging
-        continue
-    output_text = result.stdout
-    sharpe = 0.0
-    for line in output_text.splitlines():
-        if "Daily-based Sharpe Ratio:" in line:
-            # Expected format: "Daily-based Sharpe Ratio: X"
+    # Each trial is charged an equal share of its group's time
+    share = 1 / len(param_group)
+    return [{
+        "params": params,
+        "total_profit": float(score.total_profit),
+        "total_trades": int(score.total_trades),
+        "sharpe": float(score.sharpe),
+        "seconds": rec["seconds"] * share,
+        "timings": {name: seconds * share for name, seconds in rec["timings"].items()},
+        "group_size": len(param_group),
+        **({"peak_mb": rec["peak_mb"]} if "peak_mb" in rec else {}),
+    } for params, score in zip(param_group, scores.itertuples())]
+
+def trials_version(ticks_path=data_processing.ticks_path, tick_exits=False, fraction=1.0):
+    # Data version trials are stored under: the candles, the exit mode and the days scored
+    version = CandleCache(ticks_path).data_version()
+    if tick_exits:
+        version += "-tick-exits"
+    if fraction < 1:
+        version += f"-days{fraction:.4g}"
+    return version
+
+@contextmanager
+def worker_pool(ticks_path=data_processing.ticks_path, workers=None, tick_exits=False, trace=None,
+                profile_dir=None, trace_memory=False):
+    # Pool of trial workers with the candle pyramid built once, before the trials need it
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=init_worker,
+        initargs=(ticks_path, tick_exits, candle_cache.CACHE_DIR, profile_dir, trace_memory)
+    ) as pool:
+        warmup = pool.submit(warm_cache).result()
+        if trace is not None:
+            trace.write({"kind": "warmup", "data_version": trials_version(ticks_path, tick_exits), **warmup})
+        yield pool
+
+def run_trials(param_sets, ticks_path=data_processing.ticks_path, workers=None, store=None, tick_exits=False,
+               trace=None, profile_dir=None, trace_memory=False, fraction=1.0, pool=None):
+    # Yield (params, result) in submission order; result is None if the trial failed.
+    # With a TrialStore, trials already stored for the current data are not run again
+    # (their result has "cached": True) and new results are stored as they arrive.
+    # tick_exits fills exits at the first crossing tick (see backtest.find_exit_fills).
+    # With an instrument.TraceLog, the cache warm-up and every trial that runs are written
+    # to it as one JSON record each, with their stage timings.
+    # fraction < 1 scores the trials on the first part of the in-sample days only; pool
+    # reuses a worker_pool() across calls instead of starting one per call.
+    if not ticks_path.endswith(".csv"):
+        data_processing.ensure_tick_store(ticks_path)
+    data_version = trials_version(ticks_path, tick_exits, fraction)
+    keys = [trial_store.params_hash(params) for params in param_sets]
+    known = store.get_many(param_sets, data_version) if store is not None else {}
+
+    # Run every parameter set that is neither stored nor repeated earlier in this run
+    groups = {}
+    first = {}
+    for i, (key, params) in enumerate(zip(keys, param_sets)):
+        if key not in known and key not in first:
+            first[key] = i
+            groups.setdefault((params["time_frame"], params["sma_window"]), []).append(i)
+    if not groups:
+        for params, key in zip(param_sets, keys):
+            yield params, {**known[key], "params": params, "cached": True}
+        return
+
+    with nullcontext(pool) if pool is not None else worker_pool(
+        ticks_path, workers, tick_exits, trace, profile_dir, trace_memory
+    ) as pool:
+        # A work_queue.QueuePool takes the trial groups themselves, for its workers to score
+        submit_group = getattr(pool, "submit_group", None) or (
+            lambda param_group, fraction: pool.submit(run_trial_group, param_group, fraction))
+        futures = {}
+        for key, members in groups.items():
+            future = submit_group([param_sets[i] for i in members], fraction)
+            for position, i in enumerate(members):
+                futures[i] = (future, position)
+        for i, (key, params) in enumerate(zip(keys, param_sets)):
+            if key in known or first.get(key) != i:
+                result = known.get(key)
+                yield params, result and {**result, "params": params, "cached": True}
+                continue
+            future, position = futures[i]
             try:
-                profit_str = line.split("Daily-based Sharpe Ratio:")[1].strip()
-                # Remove the currency and commas, convert to float
-                profit_value = profit_str.strip().replace(",", "")
-                sharpe = float(profit_value)
-            except ValueError:
-                sharpe = 0.0
-    print(f"Set {time}: Tested params {params} => Total Profit: {total_profit} VND, "
-        f"Total Trades: {trades} => Sharpe Ratio: {sharpe:.2f}")
-    with open("src/optimization_results.txt", "a") as log_f:
-        log_f.write(
-            f"Tested params {params} => Total Profit: {total_profit} VND, "
-            f"Total Trades: {trades} => Sharpe Ratio: {sharpe:.2f}\n"
-        )
-    # Check if this combination is the best so far
-    if total_profit > best_profit and trades > 10:
-        # Ensure that the number of trades is reasonable (e.g., more than 10)
-        best_profit = total_profit
-        best_params = params
-
-# After testing all combinations, save the best parameters and output the result
-if best_params is not None:
-    with open("src/params.json", "w") as f:
-        json.dump(best_params, f, indent=4)
-    print(f"Best parameters: SMA window = {best_params['sma_window']}, "
-        f"Take-Profit = {best_params['take_profit']}, "
-        f"Stop-Loss = {best_params['stop_loss']}, "
-        f"Time-Frame = {best_params['time_frame']} minutes "
-        f"(Profit: {best_profit} VND)")
-else:
-    print("No successful parameter set found during optimization.")
+                result = future.result()[position]
+            except Exception as e:
+                # Handle errors gracefully: print error and skip this combination
+                print(f"Error: trial failed for params {params} (skipping).")
+                print(repr(e))
+                if trace is not None:
+                    trace.write({"kind": "trial", "data_version": data_version, "params": params,
+                                 "error": repr(e)})
+                yield params, None
+                continue
+            known[key] = result
+            if store is not None:
+                store.put(result, data_version)
+            if trace is not None:
+                trace.write({"kind": "trial", "data_version": data_version, "fraction": fraction, **result})
+            yield params, result
+
+if __name__ == "__main__":
+    # ─── Parse seed flag ────────────────────────────────────────────────────────
+    parser = argparse.ArgumentParser(
+        description="Optimize trading params, with optional random seed"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="Seed for the RNG to make optimization reproducible"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: number of CPU cores)"
+    )
+    parser.add_argument(
+        "--results",
+        default=trial_store.RESULTS_PATH,
+        help="SQLite store of trial results, reused across runs"
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        metavar="K",
+        help="Print the K best stored trials by Sharpe ratio (more than 10 trades) and exit"
+    )
+    parser.add_argument(
+        "--tick-exits",
+        action="store_true",
+        help="Fill take-profit/stop-loss exits at the first crossing tick instead of the candle close"
+    )
+    parser.add_argument(
+        "--trace",
+        default="src/optimization_trials.jsonl",
+        help="JSON-lines file that gets one record (results and stage timings) per trial"
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="DIR",
+        help="Run each trial group under cProfile and write the stats to DIR"
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Record the tracemalloc peak of each stage in the trace (slower)"
+    )
+    parser.add_argument(
+        "--search",
+        choices=search.STRATEGIES,
+        default="random",
+        help="Search strategy: independent random draws, successive halving or Hyperband on slices "
+             "of the in-sample days, or a TPE sampler that draws near the best trials so far"
+    )
+    parser.add_argument(
+        "--trials",
+        type=int,
+        default=NUM_COMBINATIONS,
+        help="Random draws (random, and the first rung of halving/hyperband) or total trials (tpe)"
+    )
+    parser.add_argument(
+        "--objective",
+        choices=["profit", "sharpe"],
+        default="profit",
+        help="What the search maximizes and the best parameters are chosen by (more than 10 trades)"
+    )
+    parser.add_argument(
+        "--queue",
+        metavar="PATH",
+        help="Run the trials through a shared SQLite work queue (see work_queue.py); --workers local "
+             "queue workers are started (0 for remote workers only)"
+    )
+    args = parser.parse_args()
+    store = trial_store.TrialStore(args.results)
+
+    if args.top is not None:
+        data_version = trials_version(tick_exits=args.tick_exits)
+        for result in store.top(args.top, by="sharpe", min_trades=10, data_version=data_version):
+            print(f"{result['params']} => Total Profit: {result['total_profit']} VND, "
+                f"Total Trades: {result['total_trades']} => Sharpe Ratio: {result['sharpe']:.2f}")
+        raise SystemExit(0)
+
+    if args.seed is not None:
+        random.seed(args.seed)
+        print(f"[optimize.py] Random seed set to {args.seed}")
+
+    best_value = float("-inf")
+    best_params = None
+    best_result = None
+    trial_counts = {"sets": 0, "run": 0, "full": 0, "days": 0.0}
+
+    def report(params, result, fraction):
+        global best_value, best_params, best_result
+        time = trial_counts["sets"]
+        trial_counts["sets"] += 1
+        if result is None:
+            return
+        if not result.get("cached"):
+            trial_counts["run"] += 1
+            trial_counts["full"] += fraction == 1
+            trial_counts["days"] += fraction
+        total_profit = result["total_profit"]
+        trades = result["total_trades"]
+        sharpe = result["sharpe"]
+        print(f"Set {time}: Tested params {params} => Total Profit: {total_profit} VND, "
+            f"Total Trades: {trades} => Sharpe Ratio: {sharpe:.2f}"
+            + (f" (first {fraction:.0%} of days)" if fraction < 1 else "")
+            + (" (cached)" if result.get("cached") else ""))
+        if fraction < 1:
+            # Partial scores only decide what to promote; they are not comparable
+            return
+        if not result.get("cached"):
+            # Only newly run trials go to the text log; cached ones are already in the store
+            with open("src/optimization_results.txt", "a") as log_f:
+                log_f.write(
+                    f"Tested params {params} => Total Profit: {total_profit} VND, "
+                    f"Total Trades: {trades} => Sharpe Ratio: {sharpe:.2f}\n"
+                )
+        # Check if this combination is the best so far (with more than 10 trades)
+        value = search.score(result, args.objective)
+        if value > best_value:
+            best_value = value
+            best_params = params
+            best_result = result
+
+    trace = instrument.TraceLog(args.trace)
+    # Random search runs its one batch on its own pool; the adaptive strategies run many
+    # small batches on one shared pool. With a queue, every batch goes to the queue workers.
+    if args.queue:
+        import work_queue
+        shared_pool = work_queue.coordinator(args.queue, workers=args.workers, tick_exits=args.tick_exits,
+                                             trace=trace)
+    elif args.search == "random":
+        shared_pool = nullcontext()
+    else:
+        shared_pool = worker_pool(workers=args.workers, tick_exits=args.tick_exits, trace=trace,
+                                  profile_dir=args.profile, trace_memory=args.trace_memory)
+    with shared_pool as pool:
+        def evaluate_trials(param_sets, fraction):
+            results = []
+            for params, result in run_trials(param_sets, workers=args.workers, store=store,
+                                             tick_exits=args.tick_exits, trace=trace,
+                                             profile_dir=args.profile, trace_memory=args.trace_memory,
+                                             fraction=fraction, pool=pool):
+                report(params, result, fraction)
+                results.append(result)
+            return results
+
+        if args.search == "random":
+            search.random_search(evaluate_trials, sample_params, args.trials, args.objective)
+        elif args.search == "halving":
+            search.successive_halving(evaluate_trials, sample_params, args.trials, objective=args.objective)
+        elif args.search == "hyperband":
+            search.hyperband(evaluate_trials, sample_params, args.trials, objective=args.objective)
+        else:
+            search.tpe(evaluate_trials, sample_params, args.trials, random, SPACE, objective=args.objective)
+    trace.close()
+
+    # Where the worker time went, over the trials run now (and the cache warm-up)
+    if trial_counts["run"]:
+        print(f"Ran {trial_counts['run']} trials, {trial_counts['full']} on the full in-sample period "
+              f"({trial_counts['days']:.1f} full-period equivalents)")
+        print(f"Stage breakdown over {trial_counts['run']} new trials (trace in {args.trace}):")
+        for line in instrument.format_breakdown(instrument.breakdown([{"timings": trace.totals}]),
+                                                trial_counts["run"]):
+            print(line)
+
+    # After testing all combinations, save the best parameters and output the result
+    if best_params is not None:
+        with open("src/params.json", "w") as f:
+            json.dump(best_params, f, indent=4)
+        print(f"Best parameters: SMA window = {best_params['sma_window']}, "
+            f"Take-Profit = {best_params['take_profit']}, "
+            f"Stop-Loss = {best_params['stop_loss']}, "
+            f"Time-Frame = {best_params['time_frame']} minutes "
+            f"(Profit: {best_result['total_profit']} VND, Sharpe Ratio: {best_result['sharpe']:.2f})")
+    else:
+        print("No successful parameter set found during optimization.")
@@ -0,0 +1,227 @@
+import os
+import heapq
+import argparse
+import importlib
+import json
+
+import numpy as np
+import pandas as pd
+
+from typing import Callable, NamedTuple, Optional
+
+import backtest
+import metrics
+import storage
+import instrument
+
+from tick_index import load_candle_index
+
+# Portfolio of strategies traded from one account. The candles are loaded once and every
+# strategy runs over the same arrays: the SMA-free part of the reversal pattern is found
+# once, each distinct SMA window is computed once, and strategies that share their entries
+# (same SMA window and signal) share one exit scan for all their (take_profit, stop_loss)
+# pairs. Each strategy keeps its own position book and trade ledger, while the deposits
+# come out of one shared available_asset: the entries of all strategies are replayed in
+# one chronological pass, so a strategy can be refused a position because another one has
+# locked the margin.
+DEFAULT_STRATEGIES = [
+    {"name": "reversal", "sma_window": 50, "take_profit": 3, "stop_loss": -1},
+    {"name": "reversal-long", "sma_window": 20, "take_profit": 3, "stop_loss": -1, "sides": ["long"]},
+    {"name": "reversal-short", "sma_window": 100, "take_profit": 3, "stop_loss": -1, "sides": ["short"]},
+]
+
+class Strategy(NamedTuple):
+    name: str
+    sma_window: int = 50
+    take_profit: float = 3   # Points
+    stop_loss: float = -1    # Points
+    sides: tuple = backtest.POSITION_TYPES  # Position types the strategy opens
+    # signal(candles, time_frame) -> (long_signal, short_signal) boolean masks; candles['SMA']
+    # is the strategy's SMA. None is the 3-candle reversal of backtest.find_entry_signals.
+    signal: Optional[Callable] = None
+
+class Account:
+    # Capital shared by the strategies of a portfolio
+    def __init__(self, initial=backtest.initial_asset):
+        self.total_asset = initial
+        self.available_asset = initial
+
+class Sleeve:
+    # Positions and trades of one strategy, kept by a BacktestState of its own; its deposits
+    # and profits go to the shared account
+    def __init__(self, account):
+        self.account = account
+        self.state = backtest.BacktestState(account.total_asset)
+
+    def _run(self, method, *args):
+        # A BacktestState method on the account's balances, which it updates
+        state, account = self.state, self.account
+        state.total_asset, state.available_asset = account.total_asset, account.available_asset
+        result = method(*args)
+        account.total_asset, account.available_asset = state.total_asset, state.available_asset
+        return result
+
+    def open_position(self, position_type, entry_price, entry_time):
+        return self._run(self.state.open_position, position_type, entry_price, entry_time)
+
+    def close_position(self, slot, exit_price, exit_time):
+        self._run(self.state.close_position, slot, exit_price, exit_time)
+
+    def trades_frame(self):
+        return self.state.trades_frame()
+
+def strategy_from_dict(spec):
+    # A Strategy from its JSON form; "signal" is "module:function", imported from src/
+    spec = dict(spec)
+    if 'sides' in spec:
+        spec['sides'] = tuple(spec['sides'])
+        unknown = set(spec['sides']) - set(backtest.POSITION_TYPES)
+        if unknown:
+            raise ValueError(f"Unknown sides {sorted(unknown)} in strategy '{spec['name']}'")
+    if spec.get('signal'):
+        module, function = spec['signal'].split(':')
+        spec['signal'] = getattr(importlib.import_module(module), function)
+    return Strategy(**spec)
+
+def load_strategies(path):
+    with open(path, 'r') as f:
+        return [strategy_from_dict(spec) for spec in json.load(f)]
+
+def candle_time_frame(input_file, time_frame=None):
+    # The time frame of a candle store: the one data_processing.py recorded in its meta.json,
+    # which time_frame (when given) must match
+    store_path = input_file.removesuffix('.json')
+    recorded = storage.read_meta(store_path).get('time_frame') if os.path.isdir(store_path) else None
+    if time_frame is None and recorded is None:
+        raise ValueError(f"{store_path} does not record its time frame; pass --time-frame")
+    if time_frame is not None and recorded is not None and time_frame != recorded:
+        raise ValueError(f"{store_path} was resampled at {recorded} minutes, not {time_frame}")
+    return recorded if time_frame is None else time_frame
+
+def sma(close, window):
+    # Same rolling mean as data_processing.add_sma, over the candles' close column
+    return pd.Series(close).rolling(window=window, min_periods=window).mean().to_numpy()
+
+def find_strategy_exits(candles, strategies, time_frame=1, tick_index=None):
+    # (entry_idx, is_long, close_step, exit_price, exit_time) of every strategy, in loop order
+    exits = [None] * len(strategies)
+    with instrument.stage('signals'):
+        patterns = backtest.find_entry_patterns(candles, time_frame)
+        smas = {window: sma(candles['close'], window) for window in {s.sma_window for s in strategies}}
+    groups = {}
+    for i, strategy in enumerate(strategies):
+        groups.setdefault((strategy.sma_window, strategy.signal), []).append(i)
+
+    for (window, signal), members in groups.items():
+        with instrument.stage('signals'):
+            group_candles = dict(candles, SMA=smas[window])
+            if signal is None:
+                long_signal, short_signal = backtest.find_entry_signals(group_candles, time_frame, patterns)
+            else:
+                long_signal, short_signal = signal(group_candles, time_frame)
+            # Entries of the sides any member trades; each member keeps its own sides below
+            sides = {side for i in members for side in strategies[i].sides}
+            if 'long' not in sides:
+                long_signal = np.zeros_like(long_signal)
+            if 'short' not in sides:
+                short_signal = np.zeros_like(short_signal)
+            entry_idx, is_long = backtest.order_entries(np.asarray(long_signal, dtype=bool),
+                                                        np.asarray(short_signal, dtype=bool))
+        with instrument.stage('exits'):
+            # One scan over the group's entries for every member's (take_profit, stop_loss)
+            close_step, exit_price, exit_time = backtest.find_exit_fills(
+                candles, entry_idx, is_long,
+                [strategies[i].take_profit for i in members], [strategies[i].stop_loss for i in members],
+                time_frame, tick_index)
+        for column, i in enumerate(members):
+            side = np.asarray(['long' in strategies[i].sides, 'short' in strategies[i].sides])
+            keep = side[np.where(is_long, 0, 1)]
+            exits[i] = (entry_idx[keep], is_long[keep], close_step[keep, column],
+                        exit_price[keep, column], exit_time[keep, column])
+    return exits
+
+def run_portfolio(candles, strategies, time_frame=1, tick_index=None, initial=backtest.initial_asset):
+    # Trade ledger (DataFrame) of each strategy. On each candle the strategies open their
+    # positions in the order they are given, long before short; positions closing on the
+    # same step are closed in the order they were opened, across all strategies.
+    account = Account(initial)
+    sleeves = [Sleeve(account) for _ in strategies]
+    if len(candles['close']) == 0 or not strategies:
+        return [sleeve.trades_frame() for sleeve in sleeves]
+    dt = candles['datetime']
+    close = candles['close']
+    exits = find_strategy_exits(candles, strategies, time_frame, tick_index)
+
+    with instrument.stage('capital'):
+        # Merge the entries of all strategies into one chronological sequence
+        entry_idx = np.concatenate([e[0] for e in exits])
+        is_long = np.concatenate([e[1] for e in exits])
+        close_step = np.concatenate([e[2] for e in exits])
+        exit_price = np.concatenate([e[3] for e in exits])
+        exit_time = np.concatenate([e[4] for e in exits])
+        owner = np.repeat(np.arange(len(strategies)), [len(e[0]) for e in exits])
+        order = np.lexsort((~is_long, owner, entry_idx))
+
+        pending = []
+        for seq, k in enumerate(order):
+            e = entry_idx[k]
+            while pending and pending[0][0] <= e:
+                _, _, j, slot = heapq.heappop(pending)
+                sleeves[owner[j]].close_position(slot, exit_price[j], exit_time[j])
+            slot = sleeves[owner[k]].open_position('long' if is_long[k] else 'short', close[e], dt[e])
+            if slot is not None:
+                heapq.heappush(pending, (close_step[k], seq, k, slot))
+        while pending:
+            _, _, j, slot = heapq.heappop(pending)
+            sleeves[owner[j]].close_position(slot, exit_price[j], exit_time[j])
+    return [sleeve.trades_frame() for sleeve in sleeves]
+
+def combine(strategies, ledgers):
+    # One ledger of all the strategies' trades in exit-time order, with a strategy column
+    frames = [ledger.assign(strategy=strategy.name) for strategy, ledger in zip(strategies, ledgers)]
+    if not frames:
+        return pd.DataFrame(columns=list(backtest.TRADE_DTYPE.names) + ['strategy'])
+    combined = pd.concat(frames, ignore_index=True)
+    return combined.sort_values(by='exit_time', kind='stable', ignore_index=True)
+
+def report(strategies, ledgers):
+    # {name: Metrics} of each strategy and of the whole portfolio ('portfolio')
+    with instrument.stage('metrics'):
+        results = {strategy.name: metrics.compute(ledger) for strategy, ledger in zip(strategies, ledgers)}
+        results['portfolio'] = metrics.compute(combine(strategies, ledgers))
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtest a portfolio of strategies over one candle store.")
+    parser.add_argument("input_file", type=str, help="Name of the candle store in src/ (e.g., in-sample)")
+    parser.add_argument("--strategies", help="JSON list of strategies (default: three reversal variants)")
+    parser.add_argument("--time-frame", type=int, default=None,
+                        help="Time frame the candle store was resampled at, in minutes "
+                             "(default: the one the store records)")
+    parser.add_argument("--tick-exits", action="store_true",
+                        help="Fill take-profit/stop-loss exits at the first crossing tick instead of the candle close")
+    parser.add_argument("--log", action="store_true", help="Log the combined trade details")
+    args = parser.parse_args()
+
+    if args.strategies:
+        strategies = load_strategies(args.strategies)
+    else:
+        strategies = [strategy_from_dict(spec) for spec in DEFAULT_STRATEGIES]
+    names = [strategy.name for strategy in strategies]
+    if len(set(names)) != len(names) or 'portfolio' in names:
+        parser.error("strategy names must be unique and not 'portfolio'")
+
+    try:
+        time_frame = candle_time_frame("src/" + args.input_file, args.time_frame)
+    except ValueError as e:
+        parser.error(str(e))
+    candles = backtest.load_candles("src/" + args.input_file)
+    tick_index = load_candle_index("src/" + args.input_file) if args.tick_exits else None
+    ledgers = run_portfolio(candles, strategies, time_frame, tick_index)
+
+    if args.log:
+        print(combine(strategies, ledgers))
+    print(f"\n{'Strategy':<20} {'Trades':>7} {'Profit (VND)':>16} {'HPR':>8} {'MDD':>8} {'Sharpe':>8} {'Win rate':>9}")
+    for name, result in report(strategies, ledgers).items():
+        print(f"{name:<20} {result.total_trades:>7} {result.total_profit:>16.0f} {result.hpr:>7.2f}% "
+              f"{result.mdd:>7.2f}% {result.sharpe:>8.2f} {result.win_rate:>8.2f}%")
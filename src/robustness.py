@@ -0,0 +1,153 @@
+import argparse
+
+import numpy as np
+
+from typing import NamedTuple
+
+import storage
+
+from metrics import initial_capital, risk_free_rate_annual, trading_days_per_year
+
+# Robustness of one trade ledger. The trades keep their exit times (their slots in the
+# capital curve), and many alternative ledgers are made by refilling the slots with profits
+# drawn from the ledger itself:
+# - bootstrap: the slots are filled with trades drawn with replacement, so the total profit,
+#   the drawdown and the Sharpe ratio all vary;
+# - permutation: the trades are shuffled over the slots, so the total profit is fixed and
+#   only the path (drawdown, Sharpe) changes with the order of the trades.
+# Each chunk of samples is one (samples, trades) index matrix: the capital curves are a
+# cumulative sum along the trade axis and the daily equity is a gather of the capital at the
+# last exit of each day, so thousands of ledgers are scored as a few array operations. Trades
+# with an unknown (NaN) profit are left out; on the other trades the metrics are those of
+# metrics.compute, and the identity permutation gives the ledger's own values.
+METHODS = ('bootstrap', 'permutation')
+MAX_CHUNK_BYTES = 64 * 2**20  # Working memory of one chunk of samples
+CHUNK_MATRICES = 3            # (samples, trades or days) float matrices alive at once in a chunk
+
+class Interval(NamedTuple):
+    observed: float  # Value of the ledger itself
+    low: float       # Lower bound of the confidence interval
+    median: float
+    high: float      # Upper bound of the confidence interval
+
+class Ledger(NamedTuple):
+    profit: np.ndarray  # VND per trade with a known profit, in exit-time order
+    last_trade: np.ndarray  # Per calendar day from the first to the last exit: last trade closed by then
+
+def prepare(trades):
+    # The trades of a ledger (DataFrame or structured array) with a known profit, in the
+    # exit-time order metrics.compute uses, and the daily gather index of the Sharpe ratio
+    profit = np.asarray(trades["profit_vnd"], dtype=np.float64)
+    exit_time = np.asarray(trades["exit_time"], dtype='datetime64[ns]')
+    order = np.argsort(exit_time, kind='stable')
+    profit, exit_time = profit[order], exit_time[order]
+    known = ~np.isnan(profit)
+    profit, exit_time = profit[known], exit_time[known]
+    if not len(profit):
+        return Ledger(profit, np.empty(0, dtype=np.int64))
+    exit_day = exit_time.astype('datetime64[D]')
+    day = (exit_day - exit_day[0]).astype(np.int64)
+    # Index of the last trade of every day, forward-filled over the days without a trade
+    last_trade = np.full(day[-1] + 1, -1, dtype=np.int64)
+    last_trade[day] = np.arange(len(day))
+    return Ledger(profit, np.maximum.accumulate(last_trade))
+
+def score_paths(profit):
+    # Total profit, MDD (%) and capital curves of every row of a (samples, trades) profit
+    # matrix, whose columns are the trade slots in exit-time order. The capital curves are
+    # built in place of profit.
+    capital = np.cumsum(profit, axis=1, out=profit)
+    capital += initial_capital
+    running_max = np.maximum.accumulate(capital, axis=1)
+    peak = running_max[:, -1].copy()
+    drawdown = np.subtract(running_max, capital, out=running_max).max(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mdd = np.where(peak != 0, drawdown / peak * 100, 0.0)
+    return capital[:, -1] - initial_capital, mdd, capital
+
+def daily_sharpe(capital, last_trade):
+    # Sharpe ratio of the capital at the last exit of each calendar day, as metrics.compute
+    if len(last_trade) < 2:
+        return np.full(len(capital), np.nan)
+    daily_equity = capital[:, last_trade]
+    # Daily returns, zero on the first day as pct_change().fillna(0) gives
+    excess_returns = np.zeros(daily_equity.shape)
+    np.divide(daily_equity[:, 1:], daily_equity[:, :-1], out=excess_returns[:, 1:])
+    del daily_equity
+    excess_returns[:, 1:] -= 1
+    excess_returns -= risk_free_rate_annual / trading_days_per_year
+    mean_excess_return = excess_returns.mean(axis=1)
+    std_excess_return = excess_returns.std(axis=1, ddof=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sharpe = (mean_excess_return / std_excess_return) * np.sqrt(trading_days_per_year)
+    return np.where(std_excess_return != 0, sharpe, np.nan)
+
+def draw_indices(rng, method, samples, trades):
+    # (samples, trades) index matrix of the trades filling each slot
+    if method == 'bootstrap':
+        return rng.integers(0, trades, size=(samples, trades))
+    return rng.permuted(np.broadcast_to(np.arange(trades), (samples, trades)), axis=1)
+
+def simulate(trades, samples=10_000, method='bootstrap', seed=None, max_chunk_bytes=MAX_CHUNK_BYTES):
+    # {'total_profit', 'mdd', 'sharpe'}: one value per resampled ledger. Samples are drawn
+    # in chunks whose matrices take about max_chunk_bytes together.
+    if method not in METHODS:
+        raise ValueError(f"Unknown method '{method}', expected one of {METHODS}")
+    ledger = prepare(trades)
+    n = len(ledger.profit)
+    results = {name: np.full(samples, np.nan) for name in ('total_profit', 'mdd', 'sharpe')}
+    if n == 0:
+        return results
+    rng = np.random.default_rng(seed)
+    chunk = max(1, max_chunk_bytes // (8 * CHUNK_MATRICES * max(n, len(ledger.last_trade))))
+    for start in range(0, samples, chunk):
+        size = min(chunk, samples - start)
+        profit = ledger.profit[draw_indices(rng, method, size, n)]
+        total_profit, mdd, capital = score_paths(profit)
+        results['total_profit'][start:start + size] = total_profit
+        results['mdd'][start:start + size] = mdd
+        results['sharpe'][start:start + size] = daily_sharpe(capital, ledger.last_trade)
+    return results
+
+def analyze(trades, samples=10_000, method='bootstrap', confidence=0.95, seed=None,
+            max_chunk_bytes=MAX_CHUNK_BYTES):
+    # Confidence intervals of the total profit, MDD and Sharpe ratio, plus the share of
+    # resampled ledgers that lose money
+    ledger = prepare(trades)
+    observed = {'total_profit': 0.0, 'mdd': 0.0, 'sharpe': np.nan}  # As metrics.compute without trades
+    if len(ledger.profit):
+        total_profit, mdd, capital = score_paths(ledger.profit[None, :].copy())
+        observed = {'total_profit': total_profit[0], 'mdd': mdd[0],
+                    'sharpe': daily_sharpe(capital, ledger.last_trade)[0]}
+    results = simulate(trades, samples, method, seed, max_chunk_bytes)
+    tail = (1 - confidence) / 2 * 100
+    intervals = {}
+    for name, values in results.items():
+        values = values[~np.isnan(values)]
+        low, median, high = np.percentile(values, [tail, 50, 100 - tail]) if len(values) else (np.nan,) * 3
+        intervals[name] = Interval(float(observed[name]), float(low), float(median), float(high))
+    totals = results['total_profit'][~np.isnan(results['total_profit'])]
+    loss_probability = float(np.mean(totals < 0) * 100) if len(totals) else np.nan
+    return intervals, loss_probability
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bootstrap and permutation confidence intervals of a trade ledger")
+    parser.add_argument("--trades", default="src/trades", help="Trade ledger written by backtest.py")
+    parser.add_argument("--samples", type=int, default=10_000, help="Resampled ledgers per method")
+    parser.add_argument("--method", choices=METHODS + ('both',), default='both')
+    parser.add_argument("--confidence", type=float, default=0.95, help="Confidence level of the intervals")
+    parser.add_argument("--seed", type=int, help="Seed for the RNG to make the run reproducible")
+    args = parser.parse_args()
+
+    trades = storage.read_trades(args.trades)
+    print(f"{len(trades)} trades from {args.trades}, {args.samples} samples, "
+          f"{args.confidence * 100:g}% intervals")
+    for method in (METHODS if args.method == 'both' else (args.method,)):
+        intervals, loss_probability = analyze(trades, args.samples, method, args.confidence, args.seed)
+        print(f"\n{method}:")
+        for name, label, unit in (('total_profit', 'Total Profit', ' VND'), ('mdd', 'Maximum Drawdown (MDD)', '%'),
+                                  ('sharpe', 'Daily-based Sharpe Ratio', '')):
+            interval = intervals[name]
+            print(f"- {label}: {interval.observed:.2f}{unit}, median {interval.median:.2f}{unit}, "
+                  f"interval [{interval.low:.2f}, {interval.high:.2f}]{unit}")
+        print(f"- Probability of a loss: {loss_probability:.2f}%")
@@ -0,0 +1,124 @@
+import math
+
+# Search strategies for optimize.py. A strategy decides which parameter sets to score next
+# from the scores so far, through evaluate(param_sets, fraction) -> [result or None], where
+# fraction is the share of the in-sample days a trial is scored on (1.0 is the full period).
+# Every strategy draws from the rng it is given, so a seeded rng makes the search reproducible.
+# The search space is a list of (name, low, high, is_integer), see optimize.SPACE.
+MIN_TRADES = 10  # A trial needs more trades than this (on the full period) to count
+
+def score(result, objective="profit", fraction=1.0):
+    # Value of a trial to maximize: -inf for failed trials and those with too few trades
+    # (the trade minimum is scaled to the days scored)
+    if result is None or result["total_trades"] <= MIN_TRADES * fraction:
+        return -math.inf
+    value = result["sharpe"] if objective == "sharpe" else result["total_profit"]
+    return -math.inf if math.isnan(value) else value
+
+def make_params(values, space):
+    # Parameter set from values in space order, rounded and constrained as sample_params does
+    params = {}
+    for (name, low, high, is_integer), value in zip(space, values):
+        value = min(max(value, low), high)
+        params[name] = int(round(value)) if is_integer else round(value, 2)
+    # But the total time is not more than 500 minutes for a day
+    if params["time_frame"] * params["sma_window"] > 100:
+        params["sma_window"] = 100 // params["time_frame"]
+    return {name: params[name] for name in ("sma_window", "take_profit", "stop_loss", "time_frame")}
+
+def _unit(params, space):
+    # Parameters mapped to the unit cube
+    return [(params[name] - low) / (high - low) for name, low, high, _ in space]
+
+def _from_unit(point, space):
+    return make_params([low + x * (high - low) for x, (_, low, high, _) in zip(point, space)], space)
+
+def random_search(evaluate, sample, budget, objective="profit"):
+    # budget independent draws, all scored on the full period
+    param_sets = [sample() for _ in range(budget)]
+    return list(zip(param_sets, evaluate(param_sets, 1.0)))
+
+def successive_halving(evaluate, sample, n, eta=3, min_fraction=1 / 9, objective="profit"):
+    # Score n draws on the first min_fraction of the days, keep the best 1/eta of them and
+    # score those on eta times more days, until the survivors are scored on the full period.
+    # Returns the full-period (params, result) pairs.
+    rungs = max(0, round(math.log(1 / min_fraction, eta)))
+    candidates = [sample() for _ in range(n)]
+    for rung in range(rungs + 1):
+        fraction = eta ** (rung - rungs)
+        results = evaluate(candidates, fraction)
+        if rung == rungs:
+            return list(zip(candidates, results))
+        ranked = sorted(range(len(candidates)), key=lambda i: -score(results[i], objective, fraction))
+        candidates = [candidates[i] for i in ranked[:max(1, len(candidates) // eta)]]
+    return []
+
+def hyperband(evaluate, sample, budget, eta=3, max_rungs=2, objective="profit"):
+    # Successive halving brackets from aggressive (many draws, min fraction eta^-max_rungs)
+    # to plain random search (few draws, full period). budget is the number of draws of
+    # the most aggressive bracket; the others get fewer draws for about the same total days.
+    scored = []
+    for rungs in range(max_rungs, -1, -1):
+        n = max(1, math.ceil(budget * (max_rungs + 1) / (rungs + 1) * eta ** (rungs - max_rungs)))
+        scored += successive_halving(evaluate, sample, n, eta, eta ** -rungs, objective)
+    return scored
+
+def _reflect(x):
+    # Fold a kernel draw back into [0, 1] (clipping would pile draws up on the bounds)
+    x = abs(x) % 2
+    return 2 - x if x > 1 else x
+
+def _parzen(point, centers, bandwidth):
+    # Density at point of a Gaussian kernel mixture on centers plus one uniform component,
+    # on the unit cube
+    total = 1.0
+    for center in centers:
+        total += math.prod(
+            math.exp(-0.5 * ((x - c) / bandwidth) ** 2) / (bandwidth * math.sqrt(2 * math.pi))
+            for x, c in zip(point, center))
+    return total / (len(centers) + 1)
+
+def tpe(evaluate, sample, budget, rng, space, startup=20, batch_size=16, gamma=0.25, candidates=24,
+        objective="profit"):
+    # Tree-structured Parzen estimator: after `startup` random draws, split the scored
+    # trials into the best gamma share and the rest, model each group's density with
+    # Gaussian kernels, and draw new trials near the good ones where good/bad is highest.
+    # Trials are proposed batch_size at a time so a batch runs in parallel.
+    scored = []
+    seen = set()
+    while len(scored) < budget:
+        size = min(batch_size, budget - len(scored))
+        ranked = sorted(scored, key=lambda item: -score(item[1], objective))
+        # Only trials with a score can be good; until there are some, keep drawing at random
+        n_good = min(int(math.ceil(gamma * len(ranked))),
+                     sum(score(result, objective) > -math.inf for _, result in ranked))
+        if len(scored) < startup or n_good == 0:
+            batch = [sample() for _ in range(min(size, max(1, startup - len(scored))))]
+        else:
+            good = [_unit(params, space) for params, _ in ranked[:n_good]]
+            bad = [_unit(params, space) for params, _ in ranked[n_good:]]
+            bandwidth = max(0.03, 0.3 * len(good) ** -0.2)
+            batch = []
+            for _ in range(size):
+                best, best_ratio = None, -math.inf
+                for _ in range(candidates):
+                    center = rng.choice(good)
+                    point = [_reflect(rng.gauss(c, bandwidth)) for c in center]
+                    params = _from_unit(point, space)
+                    key = tuple(sorted(params.items()))
+                    if key in seen:
+                        continue
+                    unit = _unit(params, space)
+                    ratio = _parzen(unit, good, bandwidth) / _parzen(unit, bad, bandwidth)
+                    if ratio > best_ratio:
+                        best, best_ratio = params, ratio
+                if best is None:
+                    best = sample()
+                seen.add(tuple(sorted(best.items())))
+                batch.append(best)
+        for params in batch:
+            seen.add(tuple(sorted(params.items())))
+        scored += zip(batch, evaluate(batch, 1.0))
+    return scored
+
+STRATEGIES = ["random", "halving", "hyperband", "tpe"]
@@ -0,0 +1,204 @@
+import os
+import json
+import shutil
+import hashlib
+
+import numpy as np
+
+# Columnar on-disk tables: one directory per table, one raw little-endian binary file per
+# column and a meta.json with the dtypes, the row count and the categories of coded columns.
+# Columns are memory-mapped on load, so reading a table does not copy it. Reading tables as
+# arrays needs NumPy only; pandas is imported by the functions that take or return frames.
+META_FILE = 'meta.json'
+
+tick_columns = ['datetime', 'tickersymbol', 'price']
+candle_columns = ['datetime', 'tickersymbol', 'open', 'high', 'low', 'close']
+trade_columns = ['type', 'entry_price', 'entry_time', 'deposit', 'exit_price', 'exit_time',
+                 'raw_points', 'net_points', 'profit_vnd', 'profit_pct']
+
+def _digest_update(digest, name, values):
+    digest.update(name.encode())
+    digest.update(values.dtype.str.encode())
+    digest.update(memoryview(values.view(np.uint8)))
+
+class TableWriter:
+    # Appends batches of columns to a new table; the table only replaces the old one on close()
+    def __init__(self, path, dtypes, categories=None, sorted_by=None, extra=None):
+        self.path = path.rstrip('/')
+        self.tmp_path = self.path + '.tmp'
+        self.dtypes = {name: np.dtype(dtype).newbyteorder('<') for name, dtype in dtypes.items()}
+        self.meta = {
+            'length': 0,
+            'columns': {name: dtype.str for name, dtype in self.dtypes.items()},
+            'categories': categories if categories is not None else {},
+            'sorted_by': sorted_by,
+            **(extra or {}),
+        }
+        self.digest = hashlib.sha256()
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+        self.files = {name: open(os.path.join(self.tmp_path, name + '.bin'), 'wb') for name in self.dtypes}
+
+    def append(self, columns):
+        lengths = {len(values) for values in columns.values()}
+        if len(lengths) > 1 or set(columns) != set(self.dtypes):
+            raise ValueError(f"Batch for {self.path} must have equal-length columns {list(self.dtypes)}")
+        for name, dtype in self.dtypes.items():
+            values = np.ascontiguousarray(columns[name], dtype=dtype)
+            values.tofile(self.files[name])
+            _digest_update(self.digest, name, values)
+        self.meta['length'] += lengths.pop() if lengths else 0
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.meta['version'] = self.digest.hexdigest()[:16]
+        with open(os.path.join(self.tmp_path, META_FILE), 'w') as f:
+            json.dump(self.meta, f)
+
+        # Swap the finished table in place of the old one
+        old_path = self.path + '.old'
+        if os.path.isdir(self.path):
+            shutil.rmtree(old_path, ignore_errors=True)
+            os.replace(self.path, old_path)
+        os.replace(self.tmp_path, self.path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        return self.meta
+
+    def abort(self):
+        for f in self.files.values():
+            f.close()
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def write_table(path, columns, categories=None, sorted_by=None, extra=None):
+    # columns: {name: 1-D array}; a column listed in categories holds integer codes.
+    # extra: additional JSON-serializable entries stored in meta.json
+    columns = {name: np.asarray(values) for name, values in columns.items()}
+    with TableWriter(path, {name: values.dtype for name, values in columns.items()},
+                     categories, sorted_by, extra) as writer:
+        writer.append(columns)
+    return writer.meta
+
+def read_meta(path):
+    with open(os.path.join(path, META_FILE), 'r') as f:
+        return json.load(f)
+
+def table_version(path):
+    return read_meta(path)['version']
+
+def read_table(path, columns=None, mmap=True):
+    # Returns ({name: array}, meta); arrays are read-only memory maps unless mmap=False
+    meta = read_meta(path)
+    length = meta['length']
+    arrays = {}
+    for name in columns or meta['columns']:
+        dtype = np.dtype(meta['columns'][name])
+        file_path = os.path.join(path, name + '.bin')
+        if length == 0:
+            arrays[name] = np.empty(0, dtype=dtype)
+        elif mmap:
+            arrays[name] = np.memmap(file_path, dtype=dtype, mode='r', shape=(length,))
+        else:
+            arrays[name] = np.fromfile(file_path, dtype=dtype, count=length)
+    return arrays, meta
+
+def encode_categories(values):
+    # Sorted categories, so ordering by code is the same as ordering by label
+    categories, codes = np.unique(np.asarray(values, dtype=object).astype(str), return_inverse=True)
+    return codes.astype(np.uint16), [str(c) for c in categories]
+
+def decode_categories(codes, categories):
+    return np.asarray(categories, dtype=object)[codes]
+
+def table_to_frame(arrays, meta):
+    import pandas as pd
+    data = {}
+    for name, values in arrays.items():
+        if name in meta['categories']:
+            data[name] = decode_categories(values, meta['categories'][name])
+        else:
+            data[name] = values
+    return pd.DataFrame(data, copy=False)
+
+# --- Ticks ---
+def tick_datetimes(values):
+    import pandas as pd
+    dt = pd.to_datetime(pd.Series(values))
+    if dt.dt.tz is not None:
+        dt = dt.dt.tz_localize(None)
+    return dt.to_numpy(dtype='datetime64[ns]')
+
+def write_ticks(path, df):
+    # Stored sorted by (tickersymbol, datetime), the order data_processing works in
+    import pandas as pd
+    codes, categories = encode_categories(df['tickersymbol'].to_numpy())
+    dt = tick_datetimes(df['datetime'])
+    order = np.lexsort((dt, codes))
+    return write_table(path, {
+        'datetime': dt[order],
+        'tickersymbol': codes[order],
+        'price': pd.to_numeric(df['price'], errors='coerce').to_numpy(dtype=np.float64)[order],
+    }, categories={'tickersymbol': categories}, sorted_by=['tickersymbol', 'datetime'])
+
+def read_ticks(path):
+    arrays, meta = read_table(path, tick_columns)
+    df = table_to_frame(arrays, meta)
+    if meta.get('sorted_by') != ['tickersymbol', 'datetime']:
+        df = df.sort_values(['tickersymbol', 'datetime'], kind='stable', ignore_index=True)
+    return df
+
+# --- Candles ---
+def write_candles(path, df, extra=None):
+    # df: candle DataFrame with a datetime column or index, optionally with SMA
+    # extra: how the candles were built, stored in meta.json (see write_table)
+    import pandas as pd
+    df = df.reset_index() if 'datetime' not in df.columns else df
+    codes, categories = encode_categories(df['tickersymbol'].to_numpy())
+    columns = {
+        'datetime': pd.to_datetime(df['datetime']).to_numpy(dtype='datetime64[ns]'),
+        'tickersymbol': codes,
+    }
+    for name in ('open', 'high', 'low', 'close', 'SMA'):
+        if name in df.columns:
+            columns[name] = df[name].to_numpy(dtype=np.float64)
+    return write_table(path, columns, categories={'tickersymbol': categories}, extra=extra)
+
+def read_candles(path):
+    # Candles as a DataFrame indexed by datetime, the layout of data_processing.resample_candles
+    arrays, meta = read_table(path)
+    return table_to_frame(arrays, meta).set_index('datetime')
+
+# --- Trades ---
+def write_trades(path, trades_df):
+    import pandas as pd
+    columns = {}
+    categories = {}
+    if trades_df.empty:
+        trades_df = pd.DataFrame({name: pd.Series(dtype='datetime64[ns]' if name.endswith('_time') else
+                                                  object if name == 'type' else np.float64)
+                                  for name in trade_columns})
+    for name in trade_columns:
+        if name == 'type':
+            columns[name], categories[name] = encode_categories(trades_df[name].to_numpy())
+        elif name.endswith('_time'):
+            columns[name] = pd.to_datetime(trades_df[name]).to_numpy(dtype='datetime64[ns]')
+        else:
+            columns[name] = trades_df[name].to_numpy(dtype=np.float64)
+    return write_table(path, columns, categories=categories)
+
+def read_trades(path, frame=True):
+    # A DataFrame, or with frame=False {column: array} without loading pandas
+    arrays, meta = read_table(path, trade_columns)
+    if not frame:
+        return {name: decode_categories(values, meta['categories'][name]) if name in meta['categories'] else values
+                for name, values in arrays.items()}
+    return table_to_frame(arrays, meta)
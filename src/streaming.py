@@ -0,0 +1,433 @@
+import json
+import math
+import time
+import argparse
+
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+import backtest
+import data_processing
+
+# Event-driven version of the backtest for paper trading. Ticks are pushed one at a time; each
+# contract keeps an in-progress N-minute candle, and every finished candle (including the
+# empty gap candles resample() produces) runs one step of the backtest loop for its contract:
+# overnight close, take-profit/stop-loss exits on the close, then the 3-candle entry pattern
+# against the SMA. The SMA, the last candles and the open positions are kept per contract, so
+# a live feed that interleaves the ticks of several contracts trades each contract on its own
+# series; only the capital is shared. Fed the ticks in the order of the candle files (by
+# contract, then time), the trades are those of backtest.run_backtest on the same candles
+# with the SMA computed per contract (contract_candles).
+NS_PER_MINUTE = 60 * 10**9
+MINUTES_PER_DAY = 24 * 60
+
+class RollingMean:
+    # rolling(window, min_periods=window).mean() one value at a time, in O(1) per value.
+    # The compensated sums follow pandas' roll_mean so the SMA is bit-for-bit the same.
+    def __init__(self, window):
+        self.window = window
+        self.values = deque()
+        self.nobs = 0
+        self.neg_ct = 0
+        self.sum_x = 0.0
+        self.compensation_add = 0.0
+        self.compensation_remove = 0.0
+        self.same_value_count = 0
+        self.prev_value = None
+
+    def _add(self, value):
+        if value == value:
+            self.nobs += 1
+            y = value - self.compensation_add
+            t = self.sum_x + y
+            self.compensation_add = t - self.sum_x - y
+            self.sum_x = t
+            if math.copysign(1.0, value) < 0:
+                self.neg_ct += 1
+            if value == self.prev_value:
+                self.same_value_count += 1
+            else:
+                self.same_value_count = 1
+            self.prev_value = value
+
+    def _remove(self, value):
+        if value == value:
+            self.nobs -= 1
+            y = -value - self.compensation_remove
+            t = self.sum_x + y
+            self.compensation_remove = t - self.sum_x - y
+            self.sum_x = t
+            if math.copysign(1.0, value) < 0:
+                self.neg_ct -= 1
+
+    def push(self, value):
+        # Add one value and return the mean of the last window values (NaN if any is NaN)
+        if self.prev_value is None:
+            self.prev_value = value
+            self.same_value_count = 0
+        self.values.append(value)
+        if len(self.values) > self.window:
+            self._remove(self.values.popleft())
+        self._add(value)
+        if self.nobs < self.window or self.nobs == 0:
+            return np.nan
+        if self.same_value_count >= self.nobs:
+            return self.prev_value
+        result = self.sum_x / self.nobs
+        if self.neg_ct == 0 and result < 0:
+            return 0.0
+        if self.neg_ct == self.nobs and result > 0:
+            return 0.0
+        return result
+
+class CandleBuilder:
+    # The in-progress candle of one contract. Candles are time_frame-minute bins counted from
+    # midnight of the contract's first day, as resample() bins them.
+    def __init__(self, ticker, time_frame, first_minute):
+        self.ticker = ticker
+        self.time_frame = time_frame
+        self.origin = first_minute // MINUTES_PER_DAY * MINUTES_PER_DAY
+        self.bin = None
+        self.open = self.high = self.low = self.close = np.nan
+
+    def start_minute(self, bin_):
+        return self.origin + bin_ * self.time_frame
+
+    def bin_of(self, minute):
+        return (minute - self.origin) // self.time_frame
+
+    def update(self, price):
+        if price != price:
+            return  # A tick without a price only extends the candle range
+        if self.open != self.open:
+            self.open = self.high = self.low = self.close = price
+        else:
+            if price > self.high:
+                self.high = price
+            if price < self.low:
+                self.low = price
+            self.close = price
+
+    def reset(self, bin_):
+        self.bin = bin_
+        self.open = self.high = self.low = self.close = np.nan
+
+class ContractState:
+    # The strategy state of one contract: its candle, SMA, last candles and open positions
+    def __init__(self, ticker, time_frame, first_minute, sma_window):
+        self.builder = CandleBuilder(ticker, time_frame, first_minute)
+        self.sma = RollingMean(sma_window)
+        self.recent = deque(maxlen=4)  # (minute, open, high, low, close) of the last candles
+        self.prev_minute = None
+        self.prev_close = None
+        self.slots = {}  # Slots of the contract's open positions (as keys), in opening order
+
+class StreamingEngine:
+    def __init__(self, take_profit=3, stop_loss=-1, time_frame=1, sma_window=50, initial=backtest.initial_asset):
+        self.take_profit = take_profit
+        self.stop_loss = stop_loss
+        self.time_frame = time_frame
+        self.sma_window = sma_window
+        self.contracts = {}
+        self.candles = 0
+        # Same accounting as the batch backtest, in a state of its own, shared by the contracts
+        self.state = backtest.BacktestState(initial)
+
+    # --- Ticks ---
+    def on_tick(self, ticker, timestamp_ns, price):
+        # Returns the number of candles the tick finished
+        minute = timestamp_ns // NS_PER_MINUTE
+        contract = self.contracts.get(ticker)
+        if contract is None:
+            contract = self.contracts[ticker] = ContractState(ticker, self.time_frame, minute, self.sma_window)
+            builder = contract.builder
+            builder.reset(builder.bin_of(minute))
+            builder.update(price)
+            return 0
+        builder = contract.builder
+        bin_ = builder.bin_of(minute)
+        if bin_ == builder.bin:
+            builder.update(price)
+            return 0
+        if bin_ < builder.bin:
+            raise ValueError(f"Tick for {ticker} at {pd.Timestamp(timestamp_ns)} is older than its current candle")
+        # The tick starts a new candle: finish the current one and the empty ones in between
+        self._on_candle(contract)
+        gap = bin_ - builder.bin - 1
+        if gap:
+            self._on_gap(contract, builder.bin + 1, gap)
+        builder.reset(bin_)
+        builder.update(price)
+        return 1 + gap
+
+    def finish_contract(self, ticker):
+        # A contract whose ticks have ended (it expired): finish its in-progress candle and
+        # close its positions at its last candle
+        contract = self.contracts.get(ticker)
+        if contract is None:
+            return
+        if contract.builder.bin is not None:
+            self._on_candle(contract)
+            contract.builder.bin = None
+        if contract.slots:
+            self._close_contract(contract, contract.prev_close, self._timestamp(contract.prev_minute))
+
+    def finish(self):
+        # End of the stream: finish every contract and close the remaining positions
+        for ticker in list(self.contracts):
+            self.finish_contract(ticker)
+        return self.state.trades_frame()
+
+    # --- Candles ---
+    @staticmethod
+    def _timestamp(minute):
+        return pd.Timestamp(minute * NS_PER_MINUTE)
+
+    def _close_contract(self, contract, exit_price, exit_time):
+        # Close each open position of one contract, in opening order
+        for slot in list(contract.slots):
+            self.state.close_position(slot, exit_price, exit_time)
+        contract.slots.clear()
+
+    def _open(self, contract, position_type, entry_price, entry_time):
+        slot = self.state.open_position(position_type, entry_price, entry_time)
+        if slot is not None:
+            contract.slots[slot] = None
+
+    def _on_gap(self, contract, first_bin, count):
+        # Empty candles only matter for the overnight close and the SMA window
+        builder = contract.builder
+        first_minute = builder.start_minute(first_bin)
+        last_minute = builder.start_minute(first_bin + count - 1)
+        if contract.slots and contract.prev_minute is not None:
+            # The first candle of a new day closes everything at the previous candle
+            day = contract.prev_minute // MINUTES_PER_DAY
+            if first_minute // MINUTES_PER_DAY != day:
+                self._close_contract(contract, contract.prev_close, self._timestamp(contract.prev_minute))
+            elif last_minute // MINUTES_PER_DAY != day:
+                next_day = (day + 1) * MINUTES_PER_DAY
+                offset = -(-(next_day - first_minute) // self.time_frame)  # First candle of the next day
+                before = first_minute + (offset - 1) * self.time_frame
+                self._close_contract(contract, np.nan, self._timestamp(before))
+        # Once the window is all NaN, further NaNs leave the rolling sums unchanged
+        for _ in range(min(count, contract.sma.window)):
+            contract.sma.push(np.nan)
+        empty_start = max(count - contract.recent.maxlen, 0)
+        for i in range(empty_start, count):
+            contract.recent.append((first_minute + i * self.time_frame, np.nan, np.nan, np.nan, np.nan))
+        contract.prev_minute = last_minute
+        contract.prev_close = np.nan
+        self.candles += count
+
+    def _on_candle(self, contract):
+        builder = contract.builder
+        minute = builder.start_minute(builder.bin)
+        close = builder.close
+        sma = contract.sma.push(close)
+
+        # --- Overnight Position Closing ---
+        if (contract.slots and contract.prev_minute is not None and
+                minute // MINUTES_PER_DAY != contract.prev_minute // MINUTES_PER_DAY):
+            self._close_contract(contract, contract.prev_close, self._timestamp(contract.prev_minute))
+
+        # --- Check Exit Conditions for Each Open Position ---
+        if contract.slots:
+            book = self.state.positions
+            timestamp = self._timestamp(minute)
+            for slot in list(contract.slots):
+                if book.kind[slot] == 0:  # long
+                    unrealized_points = close - book.entry_price[slot]
+                else:
+                    unrealized_points = book.entry_price[slot] - close
+                if unrealized_points >= self.take_profit or unrealized_points <= self.stop_loss:
+                    self.state.close_position(slot, close, timestamp)
+                    del contract.slots[slot]
+
+        # --- Check for Entry Signals ---
+        contract.recent.append((minute, builder.open, builder.high, builder.low, close))
+        if len(contract.recent) == 4 and sma == sma:
+            step = self.time_frame
+            (m0, o0, h0, l0, c0), (m1, o1, h1, l1, c1), (m2, o2, h2, l2, c2), _ = contract.recent
+            if minute - m2 == step and m2 - m1 == step and m1 - m0 == step:
+                if (c0 < o0 and c1 < o1 and c2 < o2) and h2 < close and sma < close:
+                    self._open(contract, 'long', close, self._timestamp(minute))
+                if (c0 > o0 and c1 > o1 and c2 > o2) and l2 > close and sma > close:
+                    self._open(contract, 'short', close, self._timestamp(minute))
+
+        contract.prev_minute = minute
+        contract.prev_close = close
+        self.candles += 1
+
+# --- Latency ---
+class LatencyHistogram:
+    # Power-of-two nanosecond buckets: bucket b holds latencies in [2**(b-1), 2**b)
+    def __init__(self, name):
+        self.name = name
+        self.counts = np.zeros(64, dtype=np.int64)
+        self.total_ns = 0
+
+    def record(self, ns):
+        self.counts[int(ns).bit_length()] += 1
+        self.total_ns += ns
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    def percentile(self, q):
+        # Upper bound of the bucket holding the q-th percentile, in nanoseconds
+        if not self.count:
+            return np.nan
+        rank = np.searchsorted(np.cumsum(self.counts), q / 100 * self.count)
+        return 2 ** int(rank)
+
+    def report(self):
+        lines = [f"{self.name}: {self.count:,} events, mean {self.total_ns / max(self.count, 1) / 1000:.2f} us, "
+                 f"p50 < {self.percentile(50) / 1000:g} us, p99 < {self.percentile(99) / 1000:g} us, "
+                 f"p99.9 < {self.percentile(99.9) / 1000:g} us"]
+        peak = self.counts.max()
+        for b in np.flatnonzero(self.counts):
+            low = 2 ** (int(b) - 1) if b else 0
+            bar = '#' * max(1, int(40 * self.counts[b] / peak))
+            lines.append(f"  {low / 1000:>10g} - {2 ** int(b) / 1000:<10g} us {self.counts[b]:>10,} {bar}")
+        return "\n".join(lines)
+
+def contract_ticks(ticks):
+    # The ticks of the candle files in replay order: traded contracts only, by contract
+    # and then by time, as data_processing.resample_candles groups them
+    candle = data_processing.filter_contracts(ticks)
+    codes, tickers = pd.factorize(candle['tickersymbol'], sort=True)
+    order = np.argsort(codes, kind='stable')
+    return (np.asarray(tickers, dtype=object)[codes[order]],
+            candle.index.to_numpy(dtype='datetime64[ns]').view(np.int64)[order],
+            candle['price'].to_numpy(dtype=np.float64)[order])
+
+def time_ticks(ticks):
+    # The ticks of the candle files as a live feed sends them: traded contracts only, in time
+    # order with the contracts interleaved
+    candle = data_processing.filter_contracts(ticks)
+    return (candle['tickersymbol'].to_numpy(dtype=object),
+            candle.index.to_numpy(dtype='datetime64[ns]').view(np.int64),
+            candle['price'].to_numpy(dtype=np.float64))
+
+def contract_sma(df, sma_window):
+    # The SMA of each contract on its own closes, as the engine keeps it
+    return df.groupby('tickersymbol', sort=False)['close'].transform(
+        lambda close: close.rolling(window=sma_window, min_periods=sma_window).mean())
+
+def contract_candles(ticks, time_frame=1, sma_window=50):
+    # data_processing's candles with the SMA computed per contract (add_sma runs one rolling
+    # window over all the contracts)
+    df = data_processing.resample_candles(ticks, time_frame).reset_index()
+    df['SMA'] = contract_sma(df, sma_window)
+    return df
+
+def signal_changes(ticks, time_frame=1, sma_window=50):
+    # The entry signals on which data_processing's candles and contract_candles disagree: one
+    # row per candle and position type, with the candle's position within its contract and
+    # whether the signal is in the data_processing candles (else in contract_candles). The
+    # candles only differ in the SMA, and only on the first sma_window - 1 candles of each
+    # contract after the first, whose batch window still holds closes of the one before it.
+    pipeline = data_processing.add_sma(data_processing.resample_candles(ticks, time_frame), sma_window)
+    per_contract = pipeline.assign(SMA=contract_sma(pipeline, sma_window))
+    position = pipeline.groupby('tickersymbol', sort=False).cumcount().to_numpy()
+    changes = []
+    for position_type, pipeline_signal, contract_signal in zip(
+            ('long', 'short'),
+            backtest.find_entry_signals(backtest.candles_to_arrays(pipeline), time_frame),
+            backtest.find_entry_signals(backtest.candles_to_arrays(per_contract), time_frame)):
+        idx = np.flatnonzero(pipeline_signal != contract_signal)
+        changes.append(pd.DataFrame({
+            'datetime': pipeline['datetime'].to_numpy()[idx],
+            'tickersymbol': pipeline['tickersymbol'].to_numpy()[idx],
+            'type': position_type,
+            'close': pipeline['close'].to_numpy()[idx],
+            'position': position[idx],
+            'pipeline': pipeline_signal[idx],
+        }))
+    return pd.concat(changes, ignore_index=True).sort_values(['datetime', 'tickersymbol', 'type'], ignore_index=True)
+
+def replay(ticks, take_profit=3, stop_loss=-1, time_frame=1, sma_window=50, histograms=None,
+           order='contract', initial=backtest.initial_asset):
+    # Push ticks through a StreamingEngine as fast as possible. Returns the trades; per-tick
+    # latencies go to histograms['tick'] and, for ticks that finish a candle, histograms['candle'].
+    # order='contract' feeds the ticks contract by contract (each contract is finished before
+    # the next one starts), order='time' interleaves them in time like a live feed.
+    engine = StreamingEngine(take_profit, stop_loss, time_frame, sma_window, initial)
+    tickers, timestamps, prices = contract_ticks(ticks) if order == 'contract' else time_ticks(ticks)
+    tick_latency = histograms['tick'] if histograms else None
+    candle_latency = histograms['candle'] if histograms else None
+    clock = time.perf_counter_ns
+    current = None
+    for ticker, timestamp, price in zip(tickers.tolist(), timestamps.tolist(), prices.tolist()):
+        if order == 'contract' and ticker != current:
+            if current is not None:
+                engine.finish_contract(current)
+            current = ticker
+        if tick_latency is None:
+            engine.on_tick(ticker, timestamp, price)
+            continue
+        started = clock()
+        finished = engine.on_tick(ticker, timestamp, price)
+        elapsed = clock() - started
+        tick_latency.record(elapsed)
+        if finished:
+            candle_latency.record(elapsed)
+    return engine.finish()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay ticks through the streaming engine")
+    parser.add_argument("--sample", choices=["in-sample", "out-sample"], default="in-sample",
+                        help="Which part of the ticks to replay")
+    parser.add_argument("--params", action="store_true", help="Use external params")
+    parser.add_argument("--interleaved", action="store_true",
+                        help="Feed the ticks of all contracts in time order, as a live feed does")
+    parser.add_argument("--check", action="store_true",
+                        help="Compare the trades with the batch backtest (contract by contract replay)")
+    args = parser.parse_args()
+    params = {"take_profit": 3, "stop_loss": -1, "time_frame": 1, "sma_window": 50}
+    if args.params:
+        with open('src/params.json', 'r') as pf:
+            params.update(json.load(pf))
+    if args.check and args.interleaved:
+        parser.error("--check compares the contract by contract replay with the batch backtest")
+
+    ticks = data_processing.load_ticks(data_processing.ensure_tick_store())
+    in_sample_ticks, out_sample_ticks = data_processing.split_dataset(ticks)
+    sample_ticks = in_sample_ticks if args.sample == "in-sample" else out_sample_ticks
+
+    histograms = {"tick": LatencyHistogram("Per-tick latency"),
+                  "candle": LatencyHistogram("Ticks finishing a candle")}
+    started = time.perf_counter()
+    trades_df = replay(sample_ticks, params["take_profit"], params["stop_loss"],
+                       params["time_frame"], params["sma_window"], histograms,
+                       'time' if args.interleaved else 'contract')
+    elapsed = time.perf_counter() - started
+    print(f"Replayed {len(sample_ticks):,} ticks in {elapsed:.2f}s ({len(sample_ticks) / elapsed:,.0f} ticks/s)")
+    print(histograms["tick"].report())
+    print(histograms["candle"].report())
+    total_profit = trades_df['profit_vnd'].sum() if not trades_df.empty else 0
+    print(f"Total Trades: {len(trades_df)}")
+    print(f"Total Profit: {total_profit}")
+
+    if args.check:
+        candles = contract_candles(sample_ticks, params["time_frame"], params["sma_window"])
+        batch_df = backtest.run_backtest(backtest.candles_to_arrays(candles), params["take_profit"],
+                                         params["stop_loss"], params["time_frame"])
+        try:
+            pd.testing.assert_frame_equal(trades_df, batch_df, check_dtype=False)
+            print("Trades match the batch backtest.")
+        except AssertionError as e:
+            print(f"Trades differ from the batch backtest:\n{e}")
+            raise SystemExit(1)
+
+        # The data_processing candles differ from contract_candles only at contract starts
+        changes = signal_changes(sample_ticks, params["time_frame"], params["sma_window"])
+        late = changes[changes['position'] >= params["sma_window"] - 1]
+        if len(late):
+            print(f"Entry signals of the data_processing candles differ after the start of a contract:\n{late}")
+            raise SystemExit(1)
+        print(f"{len(changes)} entry signals of the data_processing candles differ, all within "
+              f"the first {params['sma_window'] - 1} candles of a contract.")
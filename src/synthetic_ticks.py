@@ -0,0 +1,93 @@
+import os
+import argparse
+
+import numpy as np
+import pandas as pd
+
+# Seeded synthetic VN30F matched ticks in the layout of the downloaded ticks.csv
+# (datetime, tickersymbol, price). Each weekday has a morning and an afternoon session and an
+# ATC print, so the data has lunch gaps, overnight gaps and weekends. Ticks are spread over the
+# listed contracts: the front month (which rolls after its expiry, the third Thursday), the
+# next month, and the next quarter month, which data_processing.filter_contracts drops.
+SESSIONS = [((9, 0), (11, 30)), ((13, 0), (14, 30))]  # Continuous matching, (hour, minute)
+ATC = (14, 45)                                        # Closing auction print
+TICK_SIZE = 0.1
+CONTRACT_SHARE = (0.75, 0.2, 0.05)                    # Front month, next month, quarterly
+
+def third_thursday(year, month):
+    first_weekday = pd.Timestamp(year=year, month=month, day=1).weekday()
+    return pd.Timestamp(year=year, month=month, day=1 + (3 - first_weekday) % 7 + 14)
+
+def _add_months(year, month, n):
+    index = year * 12 + month - 1 + n
+    return index // 12, index % 12 + 1
+
+def listed_contracts(day):
+    # (year, month) of the front month, the next month and the next quarter month after those
+    year, month = day.year, day.month
+    if day.normalize() > third_thursday(year, month):
+        year, month = _add_months(year, month, 1)
+    front = (year, month)
+    next_month = _add_months(year, month, 1)
+    quarter = _add_months(*next_month, 1)
+    while quarter[1] % 3:
+        quarter = _add_months(*quarter, 1)
+    return front, next_month, quarter
+
+def ticker(year, month):
+    return f"VN30F{year % 100:02d}{month:02d}"
+
+def generate_ticks(days=21, start='2023-01-03', ticks_per_day=4000, seed=0, start_price=1050.0):
+    # Ticks of `days` trading days starting at `start`, in matching (datetime) order
+    rng = np.random.default_rng(seed)
+    trading_days = pd.bdate_range(start, periods=days)
+    session_seconds = [(end[0] - begin[0]) * 3600 + (end[1] - begin[1]) * 60 for begin, end in SESSIONS]
+    rate = ticks_per_day / sum(session_seconds)
+
+    # Tick times: Poisson counts per session, uniform inside the session
+    counts = rng.poisson(rate * np.array(session_seconds), size=(days, len(SESSIONS)))
+    day_ns = trading_days.to_numpy(dtype='datetime64[ns]').view(np.int64)
+    times = []
+    for s, (begin, _) in enumerate(SESSIONS):
+        session_start = day_ns + (begin[0] * 3600 + begin[1] * 60) * 10**9
+        n = counts[:, s]
+        offsets = rng.uniform(0, session_seconds[s], n.sum()) * 10**9
+        times.append(np.repeat(session_start, n) + offsets.astype(np.int64) // 1000 * 1000)  # Microseconds, as stored
+    # One closing auction print per day
+    times.append(day_ns + (ATC[0] * 3600 + ATC[1] * 60) * 10**9)
+    times = np.sort(np.concatenate(times))
+    day_of_tick = np.searchsorted(day_ns, times, side='right') - 1
+
+    # Index level: a random walk in tick steps, shared by every contract
+    steps = np.round(rng.normal(0, 0.3, len(times)) / TICK_SIZE).astype(np.int64)
+    level = start_price / TICK_SIZE + np.cumsum(steps)
+
+    # Contract of every tick; later contracts trade half a point above the nearer one
+    contracts = [listed_contracts(day) for day in trading_days]
+    labels = sorted({ticker(*c) for listed in contracts for c in listed})
+    codes = np.array([[labels.index(ticker(*c)) for c in listed] for listed in contracts])
+    which = rng.choice(len(CONTRACT_SHARE), size=len(times), p=CONTRACT_SHARE)
+    price = (level + which * 5) * TICK_SIZE
+
+    return pd.DataFrame({
+        'datetime': pd.to_datetime(times),
+        'tickersymbol': np.asarray(labels, dtype=object)[codes[day_of_tick, which]],
+        'price': np.round(price, 1),
+    })
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic VN30F ticks as a ticks.csv")
+    parser.add_argument("--days", type=int, default=21, help="Number of trading days")
+    parser.add_argument("--start", default="2023-01-03", help="First trading day")
+    parser.add_argument("--ticks-per-day", type=int, default=4000, help="Average ticks per day")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generator")
+    parser.add_argument("--output", default="src/ticks.csv", help="CSV file to write")
+    parser.add_argument("--force", action="store_true", help="Overwrite the output file if it exists")
+    args = parser.parse_args()
+    # The default output is where data_collecting.py keeps the downloaded ticks
+    if os.path.exists(args.output) and not args.force:
+        parser.error(f"{args.output} already exists; pass --force to overwrite it")
+
+    ticks = generate_ticks(args.days, args.start, args.ticks_per_day, args.seed)
+    ticks.to_csv(args.output, index=False)
+    print(f"Wrote {len(ticks):,} ticks of {ticks['tickersymbol'].nunique()} contracts to {args.output}")
@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import storage
+import instrument
+import continuous
+import data_processing
+
+# Raw ticks of the traded contracts, sorted by contract and time, for range queries by time:
+# the ticks of one contract in [start, end) are one pair of binary searches. Used by the
+# tick-precise exit mode of backtest.py to find the first tick that crosses a threshold.
+class TickIndex:
+    def __init__(self, tickers, offsets, times, prices):
+        self.tickers = list(tickers)                 # contract label per slot
+        self.slots = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.offsets = np.asarray(offsets, dtype=np.int64)  # ticks of slot i: offsets[i]:offsets[i + 1]
+        self.times = np.asarray(times, dtype=np.int64)      # nanoseconds since the epoch
+        self.prices = np.asarray(prices, dtype=np.float64)
+
+    @classmethod
+    @instrument.timed('load')
+    def from_ticks(cls, ticks):
+        # The same ticks the candles are resampled from: traded contracts with a price
+        candle = data_processing.filter_contracts(ticks)
+        candle = candle[candle['price'].notna()]
+        codes, tickers = pd.factorize(candle['tickersymbol'], sort=True)
+        order = np.argsort(codes, kind='stable')
+        codes = codes[order]
+        offsets = np.searchsorted(codes, np.arange(len(tickers) + 1), side='left')
+        times = candle.index.to_numpy(dtype='datetime64[ns]').view(np.int64)[order]
+        return cls(tickers, offsets, times, candle['price'].to_numpy(dtype=np.float64)[order])
+
+    @classmethod
+    @instrument.timed('load')
+    def from_front_month(cls, front_ticks):
+        # The ticks of continuous.front_month_ticks under the continuous ticker, so the exits
+        # of the continuous candles scan the contract that was the front month at the time
+        times = front_ticks.index.to_numpy(dtype='datetime64[ns]').view(np.int64)
+        return cls([continuous.CONTINUOUS_TICKER], [0, len(times)], times,
+                   front_ticks['price'].to_numpy(dtype=np.float64))
+
+    def __len__(self):
+        return len(self.times)
+
+    def range(self, ticker, start, end):
+        # (lo, hi) such that times[lo:hi] are the contract's ticks with start <= time < end
+        slot = self.slots.get(ticker)
+        if slot is None:
+            return 0, 0
+        first, last = self.offsets[slot], self.offsets[slot + 1]
+        times = self.times[first:last]
+        return (first + int(np.searchsorted(times, start, side='left')),
+                first + int(np.searchsorted(times, end, side='left')))
+
+def load_sample_index(sample, ticks_path=data_processing.ticks_path, continuous_settings=None):
+    # TickIndex of the in-sample or out-sample ticks, split as data_processing splits them.
+    # continuous_settings ({'roll_days_before', 'adjust'}) indexes the front-month ticks of
+    # the continuous series instead, split as continuous.process splits them.
+    ticks = data_processing.load_ticks(data_processing.ensure_tick_store(ticks_path)
+                                       if not ticks_path.endswith('.csv') else ticks_path)
+    if continuous_settings is not None:
+        return TickIndex.from_front_month(continuous.sample_ticks(ticks, **continuous_settings)[sample])
+    in_sample_ticks, out_sample_ticks = data_processing.split_dataset(ticks)
+    return TickIndex.from_ticks(in_sample_ticks if sample == 'in-sample' else out_sample_ticks)
+
+def load_candle_index(input_file, ticks_path=data_processing.ticks_path):
+    # TickIndex for the tick exits of a candle file (e.g. 'src/in-sample'), with the ticks
+    # its candles were resampled from
+    store_path = input_file.removesuffix('.json')
+    meta = storage.read_meta(store_path) if os.path.isdir(store_path) else {}
+    settings = meta.get('continuous')
+    if settings is None and continuous.CONTINUOUS_TICKER in meta.get('categories', {}).get('tickersymbol', []):
+        raise ValueError(f"{store_path} holds a continuous series without its roll settings; "
+                         f"run data_processing.py --continuous again to use tick exits")
+    return load_sample_index(os.path.basename(store_path), ticks_path, settings)
@@ -0,0 +1,159 @@
+import os
+import json
+import shutil
+import bisect
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+import storage
+
+# The tick store is partitioned by trading day: partitions/<YYYY-MM-DD>/ is a columnar tick
+# table (see storage.py) and manifest.json lists the partitions with their content version,
+# the (datetime, tickersymbol) watermark of the last ingested tick and the store version.
+# A partition is sorted by (tickersymbol, datetime), so each contract is one row range of it;
+# the manifest indexes those ranges per (day, contract) for range queries (see ticks()).
+MANIFEST_FILE = 'manifest.json'
+PARTITION_DIR = 'partitions'
+
+class TickStore:
+    def __init__(self, path):
+        self.path = path.rstrip('/')
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self):
+        try:
+            with open(os.path.join(self.path, MANIFEST_FILE), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'partitions': {}, 'watermark': None, 'version': None}
+
+    def _save_manifest(self):
+        digest = hashlib.sha256()
+        for day, partition in sorted(self.manifest['partitions'].items()):
+            digest.update(f'{day}:{partition["version"]};'.encode())
+        self.manifest['version'] = digest.hexdigest()[:16]
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = os.path.join(self.path, MANIFEST_FILE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(tmp_path, os.path.join(self.path, MANIFEST_FILE))
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.path, MANIFEST_FILE))
+
+    @property
+    def version(self):
+        # Changes whenever any partition changes, which invalidates the cached candles
+        return self.manifest['version']
+
+    @property
+    def watermark(self):
+        # (datetime64, tickersymbol) of the last ingested tick, or None for an empty store
+        if self.manifest['watermark'] is None:
+            return None
+        dt, ticker = self.manifest['watermark']
+        return np.datetime64(dt, 'ns'), ticker
+
+    def days(self):
+        return sorted(self.manifest['partitions'])
+
+    def partition_path(self, day):
+        return os.path.join(self.path, PARTITION_DIR, day)
+
+    def read_day(self, day):
+        return storage.read_ticks(self.partition_path(day))
+
+    def write_day(self, day, df):
+        # Replace one day's partition; the partition is stored sorted by (tickersymbol, datetime)
+        meta = storage.write_ticks(self.partition_path(day), df)
+        self.manifest['partitions'][day] = {'version': meta['version'], 'length': meta['length'],
+                                            'contracts': self._index_day(day)}
+
+    def _index_day(self, day):
+        # {contract: [start, stop]} row range of each contract in a day partition; the byte
+        # offset of a row in a column file is row * itemsize
+        arrays, meta = storage.read_table(self.partition_path(day), ['tickersymbol'])
+        contracts = meta['categories']['tickersymbol']
+        bounds = np.searchsorted(arrays['tickersymbol'], np.arange(len(contracts) + 1), side='left')
+        return {contract: [int(bounds[i]), int(bounds[i + 1])]
+                for i, contract in enumerate(contracts) if bounds[i + 1] > bounds[i]}
+
+    def contract_rows(self, day):
+        partition = self.manifest['partitions'][day]
+        if 'contracts' not in partition:
+            # Stores written before the index existed
+            partition['contracts'] = self._index_day(day)
+        return partition['contracts']
+
+    def ticks(self, contract, start=None, end=None):
+        # Ticks of one contract with start <= datetime < end (None for unbounded), as a DataFrame
+        # in the layout of read_ticks. Only the partitions of the days in range are opened, and
+        # only the contract's row range of their memory-mapped columns is read.
+        days = self.days()
+        start = None if start is None else pd.Timestamp(start).to_datetime64().astype('datetime64[ns]')
+        end = None if end is None else pd.Timestamp(end).to_datetime64().astype('datetime64[ns]')
+        first = 0 if start is None else bisect.bisect_left(days, str(start.astype('datetime64[D]')))
+        # The day of the last nanosecond before end, so an end at midnight opens no partition of that day
+        last = len(days) if end is None else bisect.bisect_right(days, str((end - np.timedelta64(1, 'ns')).astype('datetime64[D]')))
+        times, prices = [], []
+        for day in days[first:last]:
+            rows = self.contract_rows(day).get(contract)
+            if rows is None:
+                continue
+            arrays, _ = storage.read_table(self.partition_path(day), ['datetime', 'price'])
+            dt = arrays['datetime'][rows[0]:rows[1]]
+            lo = 0 if start is None else np.searchsorted(dt, start, side='left')
+            hi = len(dt) if end is None else np.searchsorted(dt, end, side='left')
+            times.append(np.array(dt[lo:hi]))
+            prices.append(np.array(arrays['price'][rows[0] + lo:rows[0] + hi]))
+        times = np.concatenate(times) if times else np.empty(0, 'datetime64[ns]')
+        return pd.DataFrame({
+            'datetime': times,
+            'tickersymbol': np.full(len(times), contract, dtype=object),
+            'price': np.concatenate(prices) if prices else np.empty(0, np.float64),
+        })
+
+    def append(self, df, watermark=None):
+        # Merge new ticks into their day partitions and record the watermark in one manifest update
+        if len(df):
+            dt = storage.tick_datetimes(df['datetime'])
+            df = pd.DataFrame({'datetime': dt, 'tickersymbol': df['tickersymbol'].to_numpy(),
+                               'price': df['price'].to_numpy()})
+            for day, rows in df.groupby(dt.astype('datetime64[D]').astype(str), sort=True):
+                if day in self.manifest['partitions']:
+                    rows = pd.concat([self.read_day(day), rows], ignore_index=True)
+                self.write_day(day, rows)
+        if watermark is not None:
+            dt, ticker = watermark
+            self.manifest['watermark'] = [str(np.datetime64(dt, 'ns')), str(ticker)]
+        self._save_manifest()
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.manifest = {'partitions': {}, 'watermark': None, 'version': None}
+
+    def read_ticks(self):
+        # All ticks as one DataFrame sorted by (tickersymbol, datetime)
+        frames = []
+        for day in self.days():
+            arrays, meta = storage.read_table(self.partition_path(day), storage.tick_columns)
+            frames.append(storage.table_to_frame(arrays, meta))
+        if not frames:
+            return pd.DataFrame({'datetime': np.empty(0, 'datetime64[ns]'),
+                                 'tickersymbol': np.empty(0, object),
+                                 'price': np.empty(0, np.float64)})
+        df = pd.concat(frames, ignore_index=True)
+        # Days are in order and each day is sorted, so a stable sort by ticker is enough
+        return df.sort_values('tickersymbol', kind='stable', ignore_index=True)
+
+def convert_csv(csv_path, path):
+    # Rebuild the tick store from a downloaded ticks.csv
+    df = pd.read_csv(csv_path, parse_dates=['datetime'])
+    store = TickStore(path)
+    store.clear()
+    last = df.sort_values(['datetime', 'tickersymbol'], kind='stable').iloc[-1:] if len(df) else None
+    watermark = None if last is None else (last['datetime'].iloc[0], last['tickersymbol'].iloc[0])
+    store.append(df, watermark)
+    return store
@@ -0,0 +1,112 @@
+import json
+import math
+import time
+import sqlite3
+import hashlib
+
+# Optimization results in SQLite, one row per (parameter set, data version). A trial that is
+# already stored for the current candles is never run again, and every result is committed
+# as soon as it arrives, so an interrupted optimization resumes where it stopped.
+RESULTS_PATH = 'src/optimization_results.db'
+
+param_columns = ['sma_window', 'take_profit', 'stop_loss', 'time_frame']
+metric_columns = ['total_profit', 'total_trades', 'sharpe']
+
+schema = """
+    CREATE TABLE IF NOT EXISTS trials (
+        params_hash TEXT NOT NULL,
+        data_version TEXT NOT NULL,
+        params TEXT NOT NULL,
+        sma_window INTEGER,
+        take_profit REAL,
+        stop_loss REAL,
+        time_frame INTEGER,
+        total_profit REAL,
+        total_trades INTEGER,
+        sharpe REAL,
+        created_at REAL NOT NULL,
+        PRIMARY KEY (params_hash, data_version)
+    );
+    CREATE INDEX IF NOT EXISTS trials_by_sharpe ON trials (data_version, sharpe);
+    CREATE INDEX IF NOT EXISTS trials_by_profit ON trials (data_version, total_profit);
+"""
+
+def params_hash(params):
+    # 3 and 3.0 are the same parameter value, so numbers are hashed as floats
+    normalized = {name: float(value) if isinstance(value, (int, float)) else value
+                  for name, value in params.items()}
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode()).hexdigest()[:16]
+
+def _result(row):
+    # SQLite stores a NaN Sharpe ratio as NULL
+    return {
+        'params': json.loads(row['params']),
+        'total_profit': row['total_profit'],
+        'total_trades': row['total_trades'],
+        'sharpe': math.nan if row['sharpe'] is None else row['sharpe'],
+    }
+
+class TrialStore:
+    def __init__(self, path=RESULTS_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(schema)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def get(self, params, data_version):
+        row = self.conn.execute(
+            'SELECT * FROM trials WHERE params_hash = ? AND data_version = ?',
+            (params_hash(params), data_version)).fetchone()
+        return None if row is None else _result(row)
+
+    def get_many(self, param_sets, data_version):
+        # {params_hash: result} of the stored trials among param_sets
+        keys = list({params_hash(params) for params in param_sets})
+        found = {}
+        for i in range(0, len(keys), 500):  # Stay below SQLite's bound-parameter limit
+            chunk = keys[i:i + 500]
+            rows = self.conn.execute(
+                f'SELECT * FROM trials WHERE data_version = ? AND params_hash IN ({",".join("?" * len(chunk))})',
+                [data_version, *chunk])
+            found.update((row['params_hash'], _result(row)) for row in rows)
+        return found
+
+    def put(self, result, data_version):
+        params = result['params']
+        sharpe = result['sharpe']
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO trials VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (params_hash(params), data_version, json.dumps(params, sort_keys=True),
+                 *(params.get(name) for name in param_columns),
+                 result['total_profit'], result['total_trades'],
+                 None if sharpe is None or math.isnan(sharpe) else sharpe, time.time()))
+
+    def top(self, k=10, by='sharpe', min_trades=10, data_version=None):
+        # Best k trials by a metric, keeping only those with more than min_trades trades
+        if by not in metric_columns:
+            raise ValueError(f"Unknown metric '{by}', expected one of {metric_columns}")
+        query = f'SELECT * FROM trials WHERE total_trades > ? AND {by} IS NOT NULL'
+        args = [min_trades]
+        if data_version is not None:
+            query += ' AND data_version = ?'
+            args.append(data_version)
+        query += f' ORDER BY {by} DESC LIMIT ?'
+        args.append(k)
+        return [_result(row) for row in self.conn.execute(query, args)]
+
+    def count(self, data_version=None):
+        if data_version is None:
+            return self.conn.execute('SELECT COUNT(*) FROM trials').fetchone()[0]
+        return self.conn.execute('SELECT COUNT(*) FROM trials WHERE data_version = ?',
+                                 (data_version,)).fetchone()[0]
@@ -0,0 +1,214 @@
+import os
+import json
+import random
+import argparse
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+import backtest
+import metrics
+import optimize
+import search
+import storage
+import data_processing
+
+from candle_cache import CandleCache
+from candle_pyramid import MINUTES_PER_DAY, NS_PER_MINUTE
+
+# Walk-forward optimization. The trading days of all the ticks are cut into rolling folds:
+# fold i trains on train_blocks blocks of days and is tested on the block right after them,
+# and the next fold moves one block forward. Every fold optimizes its train window, its best
+# parameters are backtested on its test window, and the test ledgers are stitched into one
+# out-of-sample ledger. Windows are time cuts of one candle series per (time_frame,
+# sma_window) built from the cached full-period candle pyramid, so the SMA is already warm
+# at the start of each window and no window is ever stored on its own.
+FOLDS = 4
+TRAIN_BLOCKS = 3           # Train window length in test windows (3 gives 75/25 folds)
+TRADES_PATH = 'src/walk_forward_trades'
+SUMMARY_PATH = 'src/walk_forward.json'
+
+def trading_days(pyramid):
+    # Days (as day numbers since the epoch) with at least one traded candle
+    codes, bins, _, _, _, close = pyramid.level(1)
+    minutes = pyramid.origins[codes] + bins
+    return np.unique(minutes[~np.isnan(close)] // MINUTES_PER_DAY)
+
+def make_folds(days, folds=FOLDS, train_blocks=TRAIN_BLOCKS, anchored=False):
+    # [(train_start, train_end, test_start, test_end)] in nanoseconds, ends exclusive; with
+    # anchored, every train window starts at the first day (expanding windows)
+    block = len(days) // (folds + train_blocks)
+    if block == 0:
+        raise ValueError(f"{len(days)} trading days are too few for {folds} folds of "
+                         f"{train_blocks}+1 blocks")
+    day_ns = lambda k: int(days[k]) * MINUTES_PER_DAY * NS_PER_MINUTE
+    bounds = []
+    for i in range(folds):
+        train_first = 0 if anchored else i * block
+        test_first = (i + train_blocks) * block
+        test_last = test_first + block if i < folds - 1 else len(days)  # Last fold takes the rest
+        test_end = day_ns(test_last - 1) + MINUTES_PER_DAY * NS_PER_MINUTE
+        bounds.append((day_ns(train_first), day_ns(test_first), day_ns(test_first), test_end))
+    return bounds
+
+def window_candles(candles, start, end):
+    # Rows of the candle arrays with start <= datetime < end, in their original order
+    dt = candles['datetime'].view(np.int64)
+    rows = (dt >= start) & (dt < end)
+    return {name: values if name == 'tickers' else values[rows] for name, values in candles.items()}
+
+# --- Fold worker ---
+_cache = None
+_arrays = OrderedDict()  # (time_frame, sma_window) -> full-period candle arrays
+MAX_ARRAYS = 4
+
+def init_worker(ticks_path):
+    global _cache
+    _cache = CandleCache(ticks_path)
+    _arrays.clear()
+
+def _full_candles(time_frame, sma_window):
+    key = (time_frame, sma_window)
+    if key in _arrays:
+        _arrays.move_to_end(key)
+    else:
+        _arrays[key] = backtest.candles_to_arrays(_cache.full_samples(time_frame, sma_window))
+        if len(_arrays) > MAX_ARRAYS:
+            _arrays.popitem(last=False)
+    return _arrays[key]
+
+def score_group(param_group, windows):
+    # Scores of the trials sharing (time_frame, sma_window) on every window: one batched
+    # backtest per window on the same full-period candles
+    time_frame, sma_window = param_group[0]["time_frame"], param_group[0]["sma_window"]
+    candles = _full_candles(time_frame, sma_window)
+    scores = []
+    for start, end in windows:
+        grid = backtest.run_backtest_grid(
+            window_candles(candles, start, end),
+            [params["take_profit"] for params in param_group],
+            [params["stop_loss"] for params in param_group],
+            time_frame,
+        )
+        scores.append([{
+            "params": params,
+            "total_profit": float(score.total_profit),
+            "total_trades": int(score.total_trades),
+            "sharpe": float(score.sharpe),
+        } for params, score in zip(param_group, grid.itertuples())])
+    return scores
+
+def test_fold(params, start, end):
+    # Trade ledger of params on one test window
+    candles = window_candles(_full_candles(params["time_frame"], params["sma_window"]), start, end)
+    return backtest.run_backtest(candles, params["take_profit"], params["stop_loss"], params["time_frame"])
+
+def walk_forward(param_sets, folds, ticks_path=data_processing.ticks_path, workers=None, objective="profit",
+                 report=print):
+    # Optimize every fold's train window over param_sets and test the winners. All the folds
+    # share one pool: each task scores one (time_frame, sma_window) group on every train
+    # window, and the tasks are submitted largest first (short time frames have the most
+    # candles) so no core idles while one long task finishes at the end. The test backtests
+    # of the folds run in the same pool. Returns [(params, train_result, test_trades)].
+    workers = workers or os.cpu_count() or 1
+    groups = {}
+    unique = {json.dumps(params, sort_keys=True): params for params in param_sets}
+    rank = {key: i for i, key in enumerate(unique)}  # Ties go to the earlier draw, whatever finishes first
+    for params in unique.values():
+        groups.setdefault((params["time_frame"], params["sma_window"]), []).append(params)
+    order = sorted(groups, key=lambda key: (key[0], -len(groups[key])))
+    train_windows = [(train_start, train_end) for train_start, train_end, _, _ in folds]
+
+    best = [(-np.inf, 0, None, None) for _ in folds]
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(ticks_path,)) as pool:
+        pending = {pool.submit(score_group, groups[key], train_windows): key for key in order}
+        for done, future in enumerate(as_completed(pending), 1):
+            try:
+                fold_scores = future.result()
+            except Exception as e:
+                # Handle errors gracefully: skip this group of trials
+                report(f"Error: trial group {pending[future]} failed (skipping).")
+                report(repr(e))
+                continue
+            for i, results in enumerate(fold_scores):
+                for result in results:
+                    candidate = (search.score(result, objective),
+                                 -rank[json.dumps(result["params"], sort_keys=True)])
+                    if candidate > best[i][:2]:
+                        best[i] = (*candidate, result["params"], result)
+            if done % max(1, len(pending) // 10) == 0:
+                report(f"[walk_forward.py] {done}/{len(pending)} trial groups scored")
+
+        tests = [pool.submit(test_fold, params, test_start, test_end) if params is not None else None
+                 for (_, _, params, _), (_, _, test_start, test_end) in zip(best, folds)]
+        return [(params, train_result, test.result() if test is not None else None)
+                for (_, _, params, train_result), test in zip(best, tests)]
+
+def stitch(ledgers):
+    # One out-of-sample ledger from the test ledgers, in fold order
+    ledgers = [ledger for ledger in ledgers if ledger is not None and not ledger.empty]
+    if not ledgers:
+        return pd.DataFrame(columns=['entry_time', 'exit_time', 'profit_vnd'])
+    return pd.concat(ledgers, ignore_index=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Walk-forward optimization over rolling time folds")
+    parser.add_argument("--folds", type=int, default=FOLDS, help="Number of train/test folds")
+    parser.add_argument("--train-blocks", type=int, default=TRAIN_BLOCKS,
+                        help="Train window length, in test windows")
+    parser.add_argument("--anchored", action="store_true",
+                        help="Start every train window at the first day (expanding windows)")
+    parser.add_argument("--trials", type=int, default=optimize.NUM_COMBINATIONS,
+                        help="Random parameter sets scored on every train window")
+    parser.add_argument("--objective", choices=["profit", "sharpe"], default="profit",
+                        help="What picks each fold's parameters (more than 10 trades)")
+    parser.add_argument("--seed", type=int, help="Seed for the RNG to make the run reproducible")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of worker processes (default: number of CPU cores)")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+        print(f"[walk_forward.py] Random seed set to {args.seed}")
+    ticks_path = data_processing.ensure_tick_store()
+
+    # Build the full-period pyramid once, before the workers need it
+    days = trading_days(CandleCache(ticks_path).full_pyramid())
+    folds = make_folds(days, args.folds, args.train_blocks, args.anchored)
+    param_sets = [optimize.sample_params() for _ in range(args.trials)]
+    results = walk_forward(param_sets, folds, ticks_path, args.workers, args.objective)
+
+    ledger = stitch([test for _, _, test in results])
+    summary = {"folds": [], "objective": args.objective, "trials": args.trials, "seed": args.seed}
+    window = lambda start, end: f"{pd.Timestamp(start):%Y-%m-%d}..{pd.Timestamp(end - 1):%Y-%m-%d}"
+    print()
+    for i, ((train_start, train_end, test_start, test_end), (params, train, test)) in enumerate(zip(folds, results)):
+        fold = {"train": window(train_start, train_end), "test": window(test_start, test_end), "params": params}
+        if params is None:
+            print(f"Fold {i}: train {fold['train']}, test {fold['test']}: no parameter set with more than 10 trades")
+        else:
+            scores = metrics.compute(test)
+            fold.update(train_profit=train["total_profit"], train_sharpe=train["sharpe"],
+                        test_profit=float(scores.total_profit), test_trades=int(scores.total_trades),
+                        test_sharpe=float(scores.sharpe))
+            print(f"Fold {i}: train {fold['train']}, test {fold['test']}: {params}\n"
+                  f"  train => Total Profit: {train['total_profit']} VND, Sharpe Ratio: {train['sharpe']:.2f}\n"
+                  f"  test  => Total Profit: {scores.total_profit} VND, Total Trades: {scores.total_trades}, "
+                  f"Sharpe Ratio: {scores.sharpe:.2f}")
+        summary["folds"].append(fold)
+
+    # The stitched out-of-sample ledger, scored like evaluate.py scores a backtest
+    scores = metrics.compute(ledger)
+    summary["out_of_sample"] = scores._asdict()
+    print(f"\nStitched out-of-sample ({len(ledger)} trades):")
+    print(f"- Total Profit: {scores.total_profit} VND")
+    print(f"- Holding Period Return (HPR): {scores.hpr:.2f}%")
+    print(f"- Maximum Drawdown (MDD): {scores.mdd:.2f}%")
+    print(f"- Daily-based Sharpe Ratio: {scores.sharpe}")
+    storage.write_trades(TRADES_PATH, ledger)
+    with open(SUMMARY_PATH, "w") as f:
+        json.dump(summary, f, indent=4, default=float)
+    print(f"Out-of-sample trades written to {TRADES_PATH}, fold summary to {SUMMARY_PATH}")
@@ -0,0 +1,394 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import argparse
+import threading
+import multiprocessing
+
+from contextlib import contextmanager
+
+import optimize
+import candle_cache
+import data_processing
+
+# Durable queue of optimizer trials in SQLite (WAL mode), shared by any number of worker
+# processes on this host or on other hosts that see the same file (a shared filesystem).
+# The coordinator (optimize.py --queue) adds one job per run and one task per trial group
+# (trials sharing time_frame and sma_window, which run_trial_group scores together). A worker
+# leases the oldest pending task for lease_seconds, scores it against its own candle cache
+# and stores the results as JSON in the task row. While a task runs, a heartbeat thread of the
+# worker renews its lease, so only a task whose worker crashed or was stopped runs out of
+# lease; it is leased again, up to max_attempts times. Workers only lease tasks of jobs with
+# their own data version (checked again when new ticks arrive), so a host with other ticks
+# never scores a job. The heartbeat also registers the worker and its data versions, so a
+# coordinator whose job no live worker can serve fails instead of waiting forever.
+QUEUE_PATH = 'src/optimization_queue.db'
+LEASE_SECONDS = 60          # Lease of a task without a heartbeat renewing it
+MAX_ATTEMPTS = 3
+POLL_SECONDS = 0.1
+HEARTBEAT_SECONDS = 5       # Worker registration and lease renewal, at most lease_seconds / 3 apart
+WORKER_TIMEOUT = 3 * HEARTBEAT_SECONDS  # A worker without a heartbeat for this long is gone
+VERSION_CHECK_SECONDS = 5   # An idle worker checks its ticks for a new data version this often
+WORKER_WAIT_SECONDS = 60    # A job no live worker serves for this long fails
+
+schema = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        job_id TEXT PRIMARY KEY,
+        data_version TEXT NOT NULL,
+        tick_exits INTEGER NOT NULL,
+        created_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS tasks (
+        task_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        job_id TEXT NOT NULL REFERENCES jobs (job_id),
+        param_group TEXT NOT NULL,
+        fraction REAL NOT NULL,
+        state TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        lease_owner TEXT,
+        lease_expires REAL,
+        results TEXT,
+        error TEXT,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS tasks_by_state ON tasks (state, task_id);
+    CREATE INDEX IF NOT EXISTS tasks_by_job ON tasks (job_id, state);
+    CREATE TABLE IF NOT EXISTS workers (
+        worker_id TEXT PRIMARY KEY,
+        data_versions TEXT NOT NULL,
+        seen_at REAL NOT NULL
+    );
+"""
+STATES = ('pending', 'leased', 'done', 'failed')
+
+class WorkQueue:
+    def __init__(self, path=QUEUE_PATH, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # Autocommit: every statement is its own transaction, except the explicit lease one
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(schema)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # --- Coordinator side ---
+    def add_job(self, data_version, tick_exits=False):
+        job_id = uuid.uuid4().hex
+        self.conn.execute('INSERT INTO jobs VALUES (?, ?, ?, ?)',
+                          (job_id, data_version, int(tick_exits), time.time()))
+        return job_id
+
+    def add_task(self, job_id, param_group, fraction=1.0):
+        cursor = self.conn.execute(
+            'INSERT INTO tasks (job_id, param_group, fraction, updated_at) VALUES (?, ?, ?, ?)',
+            (job_id, json.dumps(param_group), fraction, time.time()))
+        return cursor.lastrowid
+
+    def task(self, task_id):
+        # (state, results, error); a lease that ran out on the last attempt counts as failed
+        row = self.conn.execute('SELECT * FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+        if row['state'] == 'leased' and row['lease_expires'] < time.time() and row['attempts'] >= self.max_attempts:
+            return 'failed', None, f"lease expired on attempt {row['attempts']}"
+        return row['state'], row['results'] and json.loads(row['results']), row['error']
+
+    def cancel(self, job_id):
+        # Drop the unfinished tasks of a job nobody waits for any more
+        self.conn.execute(
+            "UPDATE tasks SET state = 'failed', error = 'cancelled', updated_at = ? "
+            "WHERE job_id = ? AND state IN ('pending', 'leased')", (time.time(), job_id))
+
+    def progress(self, job_id=None):
+        # {job_id: {state: count}}
+        query = 'SELECT job_id, state, COUNT(*) AS n FROM tasks'
+        args = []
+        if job_id is not None:
+            query += ' WHERE job_id = ?'
+            args.append(job_id)
+        counts = {}
+        for row in self.conn.execute(query + ' GROUP BY job_id, state', args):
+            counts.setdefault(row['job_id'], dict.fromkeys(STATES, 0))[row['state']] = row['n']
+        return counts
+
+    def live_workers(self, data_version, within=WORKER_TIMEOUT):
+        # Number of workers with a heartbeat in the last `within` seconds that serve data_version
+        rows = self.conn.execute('SELECT data_versions FROM workers WHERE seen_at >= ?', (time.time() - within,))
+        return sum(data_version in json.loads(row['data_versions']) for row in rows)
+
+    # --- Worker side ---
+    def heartbeat(self, worker_id, data_versions):
+        self.conn.execute('INSERT OR REPLACE INTO workers VALUES (?, ?, ?)',
+                          (worker_id, json.dumps(sorted(data_versions)), time.time()))
+
+    def unregister(self, worker_id):
+        self.conn.execute('DELETE FROM workers WHERE worker_id = ?', (worker_id,))
+
+    def lease(self, worker_id, data_versions):
+        # The oldest task of a job with one of data_versions that is pending or whose lease
+        # ran out, leased to worker_id; None if there is none. BEGIN IMMEDIATE takes the write
+        # lock first, so two workers never lease the same task.
+        now = time.time()
+        versions = list(data_versions)
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            # A lease that ran out on the last attempt fails the task for good
+            self.conn.execute(
+                "UPDATE tasks SET state = 'failed', error = 'lease expired on attempt ' || attempts, "
+                "updated_at = ? WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, now, self.max_attempts))
+            row = self.conn.execute(
+                "SELECT tasks.task_id, tasks.param_group, tasks.fraction, jobs.job_id, jobs.data_version, "
+                "jobs.tick_exits FROM tasks JOIN jobs ON jobs.job_id = tasks.job_id "
+                "WHERE (tasks.state = 'pending' OR (tasks.state = 'leased' AND tasks.lease_expires < ?)) "
+                f"AND jobs.data_version IN ({','.join('?' * len(versions))}) "
+                "ORDER BY tasks.task_id LIMIT 1", [now, *versions]).fetchone()
+            if row is not None:
+                self.conn.execute(
+                    "UPDATE tasks SET state = 'leased', attempts = attempts + 1, lease_owner = ?, "
+                    "lease_expires = ?, updated_at = ? WHERE task_id = ?",
+                    (worker_id, now + self.lease_seconds, now, row['task_id']))
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        return {**dict(row), 'param_group': json.loads(row['param_group']), 'tick_exits': bool(row['tick_exits'])}
+
+    def renew(self, task_id, worker_id):
+        # Extend the lease of a task still held by worker_id; False if it was lost meanwhile
+        cursor = self.conn.execute(
+            "UPDATE tasks SET lease_expires = ? WHERE task_id = ? AND state = 'leased' AND lease_owner = ?",
+            (time.time() + self.lease_seconds, task_id, worker_id))
+        return cursor.rowcount == 1
+
+    def complete(self, task_id, worker_id, results):
+        # False if the lease was lost to another worker meanwhile (its results are kept)
+        cursor = self.conn.execute(
+            "UPDATE tasks SET state = 'done', results = ?, error = NULL, updated_at = ? "
+            "WHERE task_id = ? AND state = 'leased' AND lease_owner = ?",
+            (json.dumps(results), time.time(), task_id, worker_id))
+        return cursor.rowcount == 1
+
+    def fail(self, task_id, worker_id, error):
+        # Back to pending for another attempt, or failed for good after max_attempts
+        self.conn.execute(
+            "UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "error = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ? "
+            "WHERE task_id = ? AND state = 'leased' AND lease_owner = ?",
+            (self.max_attempts, error, time.time(), task_id, worker_id))
+
+# --- Queue worker ---
+def worker_versions(ticks_path=data_processing.ticks_path):
+    # The data versions of the jobs a worker with these ticks can score
+    if not ticks_path.endswith(".csv"):
+        data_processing.ensure_tick_store(ticks_path)
+    return [optimize.trials_version(ticks_path, tick_exits) for tick_exits in (False, True)]
+
+class Heartbeat(threading.Thread):
+    # Registers a worker and renews the lease of its current task (task_id) every interval,
+    # on a connection of its own, while the worker's main thread scores the task
+    def __init__(self, queue_path, worker_id, versions, lease_seconds=LEASE_SECONDS):
+        super().__init__(daemon=True)
+        self.queue_path = queue_path
+        self.worker_id = worker_id
+        self.versions = versions
+        self.lease_seconds = lease_seconds
+        self.interval = min(lease_seconds / 3, HEARTBEAT_SECONDS)
+        self.task_id = None
+        self.stopped = threading.Event()
+
+    def run(self):
+        with WorkQueue(self.queue_path, self.lease_seconds) as queue:
+            while not self.stopped.wait(self.interval):
+                queue.heartbeat(self.worker_id, self.versions)
+                task_id = self.task_id
+                if task_id is not None:
+                    queue.renew(task_id, self.worker_id)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+def work(queue_path=QUEUE_PATH, ticks_path=data_processing.ticks_path, lease_seconds=LEASE_SECONDS,
+         idle_exit=None, cache_dir=candle_cache.CACHE_DIR):
+    # Lease and score trial groups until the queue has been empty for idle_exit seconds
+    # (forever by default). Returns the number of tasks completed.
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    versions = worker_versions(ticks_path)
+    checked = time.monotonic()
+    tick_exits = None
+    completed = 0
+    idle_since = time.monotonic()
+    with WorkQueue(queue_path, lease_seconds) as queue:
+        queue.heartbeat(worker_id, versions)
+        heartbeat = Heartbeat(queue_path, worker_id, versions, lease_seconds)
+        heartbeat.start()
+        try:
+            while True:
+                task = queue.lease(worker_id, versions)
+                if task is None:
+                    if idle_exit is not None and time.monotonic() - idle_since > idle_exit:
+                        return completed
+                    if time.monotonic() - checked > VERSION_CHECK_SECONDS:
+                        # Ticks synced since the worker started: serve the jobs of the new version
+                        checked = time.monotonic()
+                        latest = worker_versions(ticks_path)
+                        if latest != versions:
+                            versions = heartbeat.versions = latest
+                            queue.heartbeat(worker_id, versions)
+                            tick_exits = None  # Reload the candle cache for the new ticks
+                    time.sleep(POLL_SECONDS)
+                    continue
+                if task['tick_exits'] != tick_exits:
+                    tick_exits = task['tick_exits']
+                    optimize.init_worker(ticks_path, tick_exits, cache_dir)
+                heartbeat.task_id = task['task_id']
+                try:
+                    results = optimize.run_trial_group(task['param_group'], task['fraction'])
+                except Exception as e:
+                    queue.fail(task['task_id'], worker_id, repr(e))
+                else:
+                    completed += queue.complete(task['task_id'], worker_id, results)
+                finally:
+                    heartbeat.task_id = None
+                idle_since = time.monotonic()
+        finally:
+            heartbeat.stop()
+            queue.unregister(worker_id)
+
+def start_workers(count, queue_path=QUEUE_PATH, ticks_path=data_processing.ticks_path,
+                  lease_seconds=LEASE_SECONDS, idle_exit=None, cache_dir=candle_cache.CACHE_DIR):
+    processes = [multiprocessing.Process(target=work, daemon=True,
+                                         args=(queue_path, ticks_path, lease_seconds, idle_exit, cache_dir))
+                 for _ in range(count)]
+    for process in processes:
+        process.start()
+    return processes
+
+def stop_workers(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join()
+
+# --- Coordinator ---
+class QueuedTask:
+    # Future-like handle of one queued trial group: result() waits for a worker to finish it
+    def __init__(self, pool, task_id):
+        self.pool = pool
+        self.task_id = task_id
+        self._results = None
+
+    def result(self, timeout=None):
+        # TimeoutError after timeout seconds; RuntimeError if the task failed or no live
+        # worker serves the job's data version (see QueuePool.check_workers)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._results is None:
+            state, results, error = self.pool.queue.task(self.task_id)
+            if state == 'done':
+                self._results = results
+            elif state == 'failed':
+                raise RuntimeError(f"queued task {self.task_id} failed: {error}")
+            else:
+                self.pool.check_workers()
+                if deadline is not None and time.monotonic() > deadline:
+                    raise TimeoutError(f"queued task {self.task_id} is still {state} after {timeout:g}s")
+                time.sleep(POLL_SECONDS)
+        return self._results
+
+class QueuePool:
+    # Stand-in for the process pool of optimize.run_trials: trial groups go to the queue
+    def __init__(self, queue, job_id, data_version, worker_wait=WORKER_WAIT_SECONDS):
+        self.queue = queue
+        self.job_id = job_id
+        self.data_version = data_version
+        self.worker_wait = worker_wait
+        self.served = time.monotonic()  # Last time a live worker served the job (or the start)
+        self.checked = None
+
+    def submit_group(self, param_group, fraction=1.0):
+        # Queue one trial group for optimize.run_trial_group on a worker
+        return QueuedTask(self, self.queue.add_task(self.job_id, param_group, fraction))
+
+    def check_workers(self):
+        # RuntimeError once no live worker has served the job's data version for worker_wait
+        # seconds: the workers are gone, or their ticks differ from the coordinator's
+        now = time.monotonic()
+        if self.checked is not None and now - self.checked < 1:
+            return
+        self.checked = now
+        if self.queue.live_workers(self.data_version):
+            self.served = now
+        elif now - self.served > self.worker_wait:
+            raise RuntimeError(f"no live queue worker has served data version {self.data_version} for "
+                               f"{self.worker_wait:g}s; start workers with the same ticks "
+                               f"(python src/work_queue.py --queue {self.queue.path})")
+
+@contextmanager
+def coordinator(queue_path=QUEUE_PATH, ticks_path=data_processing.ticks_path, workers=None, tick_exits=False,
+                trace=None, lease_seconds=LEASE_SECONDS, worker_wait=WORKER_WAIT_SECONDS,
+                cache_dir=candle_cache.CACHE_DIR):
+    # QueuePool of a new job for optimize.run_trials, with `workers` local queue workers
+    # (default: one per CPU core, 0 for remote workers only) while it is open. Unfinished
+    # tasks of the job are cancelled when it closes, and waiting for them fails once no live
+    # worker has served the job for worker_wait seconds.
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    if not ticks_path.endswith(".csv"):
+        data_processing.ensure_tick_store(ticks_path)
+    data_version = optimize.trials_version(ticks_path, tick_exits)
+    # Build the candle pyramid once, before the workers need it
+    optimize.init_worker(ticks_path, tick_exits, cache_dir)
+    warmup = optimize.warm_cache()
+    if trace is not None:
+        trace.write({"kind": "warmup", "data_version": data_version, **warmup})
+    with WorkQueue(queue_path, lease_seconds) as queue:
+        job_id = queue.add_job(data_version, tick_exits)
+        processes = start_workers(workers, queue_path, ticks_path, lease_seconds, cache_dir=cache_dir)
+        try:
+            yield QueuePool(queue, job_id, data_version, worker_wait)
+        finally:
+            stop_workers(processes)
+            queue.cancel(job_id)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Worker processes for a shared optimization queue")
+    parser.add_argument("--queue", default=QUEUE_PATH, help="SQLite queue file shared with the coordinator")
+    parser.add_argument("--ticks", default=data_processing.ticks_path,
+                        help="Tick store (or ticks.csv) the workers score against; it sets their data version")
+    parser.add_argument("--cache-dir", default=candle_cache.CACHE_DIR, help="Candle cache of the workers")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="Number of worker processes (default: number of CPU cores)")
+    parser.add_argument("--lease", type=float, default=LEASE_SECONDS,
+                        help="Seconds a leased task is kept before another worker may retry it")
+    parser.add_argument("--idle-exit", type=float, default=None,
+                        help="Stop after the queue has been empty for this many seconds")
+    parser.add_argument("--status", action="store_true", help="Print the task counts of every job and exit")
+    args = parser.parse_args()
+
+    if args.status:
+        with WorkQueue(args.queue) as queue:
+            for job_id, counts in queue.progress().items():
+                print(f"{job_id}: " + ", ".join(f"{counts[state]} {state}" for state in STATES))
+        raise SystemExit(0)
+
+    processes = start_workers(args.processes or os.cpu_count() or 1, args.queue, args.ticks, args.lease,
+                              args.idle_exit, args.cache_dir)
+    print(f"[work_queue.py] {len(processes)} workers serving {args.queue}")
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        stop_workers(processes)
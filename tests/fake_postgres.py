@@ -0,0 +1,167 @@
+import os
+import re
+import sys
+import time
+import argparse
+import tempfile
+import threading
+
+from contextlib import contextmanager
+
+if __name__ == "__main__":
+    # Run as a script: the modules in src/ import each other by name, as in tests/conftest.py
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import psycopg
+import pandas as pd
+
+import data_collecting
+import synthetic_ticks
+
+from tick_store import TickStore
+
+# In-memory stand-in for the "quote"."matched" table, answering the queries of
+# data_collecting.py (tick_query, contracts_query and range_query) through the psycopg calls
+# the collector makes: connect(), conn.execute(), conn.cursor(name=...) with fetchmany(),
+# and psycopg.Error on a failed query. Each query can wait a fixed latency, like a server
+# round trip, and the first `failures` range queries fail, to exercise the retries. With
+# fail_after, the connection is lost once that many rows have been fetched.
+# `with database.installed():` routes data_collecting.connect to the stand-in.
+class FakeDatabase:
+    def __init__(self, ticks, latency=0.0, failures=0, fail_after=None):
+        self.ticks = ticks.sort_values(['datetime', 'tickersymbol'], kind='stable', ignore_index=True)
+        # Ticks of each contract in datetime order, for the range queries
+        self.contracts = {ticker: group.reset_index(drop=True) for ticker, group in self.ticks.groupby('tickersymbol')}
+        self.latency = latency   # Seconds per query
+        self.failures = failures  # Range queries that still have to fail
+        self.fail_after = fail_after  # Rows fetched before the connection is lost
+        self.lock = threading.Lock()
+        self.stats = {'queries': 0, 'fetches': 0, 'rows': 0, 'failures': 0, 'open': 0, 'max_open': 0}
+
+    def connect(self, db_info=None):
+        return FakeConnection(self)
+
+    @contextmanager
+    def installed(self):
+        connect = data_collecting.connect
+        data_collecting.connect = self.connect
+        try:
+            yield self
+        finally:
+            data_collecting.connect = connect
+
+    def query(self, query, params):
+        with self.lock:
+            self.stats['queries'] += 1
+            failing = query == data_collecting.range_query and self.failures > 0
+            if failing:
+                self.failures -= 1
+                self.stats['failures'] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if failing:
+            raise psycopg.Error('connection lost')
+
+        if query == data_collecting.range_query:
+            ticks = self.contracts.get(params['ticker'], self.ticks.iloc[:0])
+            lo, hi = ticks['datetime'].searchsorted([pd.Timestamp(params['range_start']), pd.Timestamp(params['range_end'])])
+            ticks = ticks.iloc[lo:hi]
+            ticks = ticks[ticks['datetime'] <= pd.Timestamp(params['until'])]
+        else:
+            ticks = self.ticks
+        watermark_datetime = pd.Timestamp(params['watermark_datetime'])
+        after = ((ticks['datetime'] > watermark_datetime) |
+                 ((ticks['datetime'] == watermark_datetime) & (ticks['tickersymbol'] > params['watermark_ticker'])))
+        ticks = ticks[(ticks['datetime'] >= pd.Timestamp(params['start'])) & after]
+        if query == data_collecting.range_query:
+            return self.rows(ticks)
+        # SQL LIKE pattern: % is any run of characters, _ is one character
+        pattern = ''.join('.*' if c == '%' else '.' if c == '_' else re.escape(c) for c in params['ticker_pattern'])
+        ticks = ticks[ticks['tickersymbol'].str.fullmatch(pattern)]
+        if query == data_collecting.contracts_query:
+            bounds = ticks.groupby('tickersymbol')['datetime'].agg(['min', 'max'])
+            return [(ticker, lo.to_pydatetime(), hi.to_pydatetime()) for ticker, lo, hi in bounds.itertuples()]
+        if query == data_collecting.tick_query:
+            return self.rows(ticks)
+        raise psycopg.Error(f'Unknown query: {query}')
+
+    @staticmethod
+    def rows(ticks):
+        return list(zip(ticks['datetime'].dt.to_pydatetime(), ticks['tickersymbol'], ticks['price']))
+
+class FakeCursor:
+    def __init__(self, database, rows=()):
+        self.database = database
+        self.rows = list(rows)
+        self.position = 0
+        self.itersize = 100
+
+    def execute(self, query, params):
+        self.rows = self.database.query(query, params)
+        self.position = 0
+        return self
+
+    def fetchmany(self, size):
+        database = self.database
+        rows = self.rows[self.position:self.position + size]
+        with database.lock:
+            database.stats['fetches'] += 1
+            if database.fail_after is not None and database.stats['rows'] + len(rows) > database.fail_after:
+                database.fail_after = None
+                raise psycopg.Error('connection lost')
+            database.stats['rows'] += len(rows)
+        self.position += len(rows)
+        return rows
+
+    def fetchall(self):
+        return self.fetchmany(len(self.rows))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+class FakeConnection:
+    def __init__(self, database):
+        self.database = database
+        self.autocommit = False
+        with database.lock:
+            database.stats['open'] += 1
+            database.stats['max_open'] = max(database.stats['max_open'], database.stats['open'])
+
+    def execute(self, query, params):
+        return FakeCursor(self.database).execute(query, params)
+
+    def cursor(self, name=None):
+        return FakeCursor(self.database)
+
+    def close(self):
+        with self.database.lock:
+            self.database.stats['open'] -= 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+if __name__ == "__main__":
+    # Download timings against the stand-in for several connection counts
+    parser = argparse.ArgumentParser(description="Time the tick download against an in-memory database")
+    parser.add_argument("--days", type=int, default=63, help="Trading days of synthetic ticks")
+    parser.add_argument("--latency", type=float, default=0.1, help="Seconds per query")
+    parser.add_argument("--connections", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--range-days", type=int, default=7, help="Days per range query of one contract")
+    args = parser.parse_args()
+
+    ticks = synthetic_ticks.generate_ticks(days=args.days)
+    print(f"{len(ticks):,} ticks over {args.days} days, {args.latency * 1000:g} ms per query")
+    for connections in args.connections:
+        database = FakeDatabase(ticks, args.latency)
+        with tempfile.TemporaryDirectory() as workdir, database.installed():
+            started = time.perf_counter()
+            data_collecting.parallel_sync({}, workdir, connections, args.range_days, report=lambda message: None)
+            elapsed = time.perf_counter() - started
+            version = TickStore(workdir).version
+        print(f"{connections} connections: {elapsed:.1f}s, {database.stats['queries']} queries, store {version}")
@@ -0,0 +1,147 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import backtest
+import evaluate
+import metrics
+
+SESSIONS = [(9 * 60, 11 * 60 + 30), (13 * 60, 14 * 60 + 45)]  # Traded minutes of a day
+
+def make_candles(seed, time_frame=1, sma_window=5, days=4, price=1000, tickers=('VN30F2301', 'VN30F2302')):
+    # Candles laid out as data_processing writes them: contract by contract, one row per
+    # time_frame bin from the contract's first to its last traded bin (empty bins are NaN),
+    # and one SMA over all the rows, as add_sma computes it
+    rng = np.random.default_rng(seed)
+    day_minutes = np.concatenate([np.arange(start, end) for start, end in SESSIONS])
+    day_bins = np.unique(day_minutes // time_frame) * time_frame
+    frames = []
+    for ticker in tickers:
+        traded = np.concatenate([day * 24 * 60 + day_bins for day in range(days)])
+        traded = traded[rng.random(len(traded)) > 0.1]
+        minutes = np.arange(traded[0], traded[-1] + 1, time_frame)
+        is_traded = np.isin(minutes, traded)
+        close = price + np.cumsum(np.round(rng.normal(0, 4, is_traded.sum()))) / 10
+        open_ = close + np.round(rng.normal(0, 3, len(close))) / 10
+        high = np.maximum(open_, close) + np.abs(np.round(rng.normal(0, 2, len(close)))) / 10
+        low = np.minimum(open_, close) - np.abs(np.round(rng.normal(0, 2, len(close)))) / 10
+        frame = pd.DataFrame({
+            'datetime': pd.Timestamp('2023-01-02') + pd.to_timedelta(minutes, unit='min'),
+            'tickersymbol': ticker,
+        })
+        for name, values in (('open', open_), ('high', high), ('low', low), ('close', close)):
+            frame[name] = np.nan
+            frame.loc[is_traded, name] = values
+        frames.append(frame)
+    df = pd.concat(frames, ignore_index=True)
+    df['SMA'] = df['close'].rolling(window=sma_window, min_periods=sma_window).mean()
+    return df
+
+def loop_backtest(df, take_profit, stop_loss, time_frame):
+    # The candle loop of the original backtest.py, the reference of the vectorized engine
+    available_asset = backtest.initial_asset
+    open_positions = []
+    trades = []
+
+    def open_position(position_type, entry_price, entry_time):
+        nonlocal available_asset
+        deposit = (entry_price * backtest.multiplier * backtest.margin_ratio) / backtest.AR
+        if available_asset < deposit:
+            return
+        available_asset -= deposit
+        open_positions.append({'type': position_type, 'entry_price': entry_price,
+                               'entry_time': entry_time, 'deposit': deposit})
+
+    def close_position(position, exit_price, exit_time):
+        nonlocal available_asset
+        entry_price = position['entry_price']
+        if position['type'] == 'long':
+            raw_points = exit_price - entry_price
+        else:
+            raw_points = entry_price - exit_price
+        net_points = raw_points - backtest.fee_points
+        profit_vnd = net_points * backtest.multiplier
+        available_asset += position['deposit'] + profit_vnd
+        if pd.isna(exit_time):
+            return
+        trades.append({**position, 'exit_price': exit_price, 'exit_time': exit_time, 'raw_points': raw_points,
+                       'net_points': net_points, 'profit_vnd': profit_vnd,
+                       'profit_pct': profit_vnd / position['deposit']})
+
+    def close_all_positions(exit_price, exit_time):
+        for pos in open_positions.copy():
+            close_position(pos, exit_price, exit_time)
+            open_positions.remove(pos)
+
+    df_list = df.to_dict('records')
+    step = pd.Timedelta(minutes=time_frame)
+    for i, current_candle in enumerate(df_list):
+        current_time = current_candle['datetime']
+        if i > 0 and current_time.date() != df_list[i - 1]['datetime'].date():
+            close_all_positions(df_list[i - 1]['close'], df_list[i - 1]['datetime'])
+        for pos in open_positions.copy():
+            if pos['type'] == 'long':
+                unrealized_points = current_candle['close'] - pos['entry_price']
+            else:
+                unrealized_points = pos['entry_price'] - current_candle['close']
+            if unrealized_points >= take_profit or unrealized_points <= stop_loss:
+                close_position(pos, current_candle['close'], current_time)
+                open_positions.remove(pos)
+        if i >= 3:
+            if ((current_time - df_list[i - 1]['datetime'] == step) and
+                    (df_list[i - 1]['datetime'] - df_list[i - 2]['datetime'] == step) and
+                    (df_list[i - 2]['datetime'] - df_list[i - 3]['datetime'] == step) and
+                    (current_candle['tickersymbol'] == df_list[i - 1]['tickersymbol'] ==
+                     df_list[i - 2]['tickersymbol'] == df_list[i - 3]['tickersymbol'])):
+                prev_candles = df_list[i - 3:i]
+                bearish_pattern = all(candle['close'] < candle['open'] for candle in prev_candles)
+                bullish_pattern = all(candle['close'] > candle['open'] for candle in prev_candles)
+                if np.isnan(current_candle['SMA']):
+                    continue
+                if (bearish_pattern and (df_list[i - 1]['high'] < current_candle['close']) and
+                        (current_candle['SMA'] < current_candle['close'])):
+                    open_position('long', current_candle['close'], current_time)
+                if (bullish_pattern and (df_list[i - 1]['low'] > current_candle['close']) and
+                        (current_candle['SMA'] > current_candle['close'])):
+                    open_position('short', current_candle['close'], current_time)
+    if open_positions:
+        close_all_positions(df_list[-1]['close'], df_list[-1]['datetime'])
+    return pd.DataFrame(trades)
+
+# seed, time_frame, take_profit, stop_loss, price; at 3000 points a deposit takes most of the
+# capital, so entries are refused while a position is open
+CASES = [(1, 1, 3, -1, 1000), (2, 1, 1, -0.5, 1000), (3, 5, 2, -2, 1000), (4, 1, 100, -100, 1000),
+         (5, 1, 3, -1, 3000)]
+
+@pytest.mark.parametrize('seed, time_frame, take_profit, stop_loss, price', CASES)
+def test_engine_matches_the_candle_loop(seed, time_frame, take_profit, stop_loss, price, capsys):
+    df = make_candles(seed, time_frame, price=price)
+    expected = loop_backtest(df, take_profit, stop_loss, time_frame)
+    trades = backtest.run_backtest(backtest.candles_to_arrays(df), take_profit, stop_loss, time_frame)
+    assert len(expected)
+    pd.testing.assert_frame_equal(trades, expected, check_dtype=False)
+    if price == 3000:
+        assert 'Insufficient funds' in capsys.readouterr().out
+
+TAKE_PROFITS = [1, 2, 3, 5, 100]
+STOP_LOSSES = [-0.5, -1, -2, -100]
+
+def degenerate(sharpe):
+    # A ledger whose daily returns have no variance (e.g. every day after a NaN close) has a
+    # Sharpe ratio of NaN or of float noise divided by a zero standard deviation
+    return np.isnan(sharpe) or abs(sharpe) > 1e12
+
+@pytest.mark.parametrize('seed, time_frame, price', [(1, 1, 1000), (3, 5, 1000), (5, 1, 3000)])
+def test_grid_matches_single_runs(seed, time_frame, price):
+    candles = backtest.candles_to_arrays(make_candles(seed, time_frame, days=8, price=price))
+    take_profits, stop_losses = (grid.ravel() for grid in np.meshgrid(TAKE_PROFITS, STOP_LOSSES))
+    scores = backtest.run_backtest_grid(candles, take_profits, stop_losses, time_frame)
+    assert len(scores) == len(take_profits)
+    for row in scores.itertuples():
+        single = evaluate.evaluate(backtest.run_backtest(candles, row.take_profit, row.stop_loss, time_frame))
+        assert row.total_trades == single['total_trades']
+        for name in metrics.Metrics._fields:
+            if name == 'sharpe' and degenerate(single['sharpe']):
+                assert degenerate(row.sharpe)
+            else:
+                assert getattr(row, name) == pytest.approx(single[name], rel=1e-9, abs=1e-3, nan_ok=True), name
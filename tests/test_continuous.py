@@ -0,0 +1,39 @@
+import io
+import contextlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import backtest
+import continuous
+import storage
+import synthetic_ticks
+import tick_index
+
+@pytest.fixture(scope='module')
+def ticks():
+    return synthetic_ticks.generate_ticks(days=60, ticks_per_day=3000, seed=5)
+
+@pytest.mark.parametrize('adjust', ['none', 'difference'])
+def test_tick_exits_fill_at_front_month_ticks(ticks, adjust):
+    samples = continuous.process(ticks, time_frame=5, sma_window=10, adjust=adjust)
+    front = continuous.sample_ticks(ticks, adjust=adjust)['in-sample']
+    candles = backtest.candles_to_arrays(samples['in-sample'])
+    index = tick_index.TickIndex.from_front_month(front)
+    with contextlib.redirect_stdout(io.StringIO()):
+        by_candle = backtest.run_backtest(candles, 1, -1, 5)
+        by_tick = backtest.run_backtest(candles, 1, -1, 5, index)
+    assert len(by_tick) and (by_tick['exit_time'] != by_candle['exit_time']).any()
+    # Every tick exit is a front-month tick, at the price the candles were built from
+    ticks_at = pd.Series(front['price'].to_numpy(), index=front.index)
+    tick_exit = ~by_tick['exit_time'].isin(by_candle['exit_time'])
+    for exit_time, exit_price in by_tick.loc[tick_exit, ['exit_time', 'exit_price']].itertuples(index=False):
+        assert np.isclose(ticks_at.loc[[exit_time]], exit_price).any()
+
+def test_continuous_store_without_roll_settings_is_refused(ticks, tmp_path):
+    samples = continuous.process(ticks, time_frame=5, sma_window=10)
+    path = str(tmp_path / 'in-sample')
+    storage.write_candles(path, samples['in-sample'])
+    with pytest.raises(ValueError, match='roll settings'):
+        tick_index.load_candle_index(path)
@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+import pandas as pd
+
+psycopg = pytest.importorskip('psycopg')
+
+import data_collecting
+import synthetic_ticks
+
+from fake_postgres import FakeDatabase
+from tick_store import TickStore
+
+def make_ticks(days=3, ticks_per_day=40, tickers=('VN30F2301', 'VN30F2302'), seed=0):
+    # Ticks of each contract spread over the sessions of a few days
+    rng = np.random.default_rng(seed)
+    frames = []
+    for ticker in tickers:
+        for day in range(days):
+            minutes = np.sort(rng.integers(9 * 60, 14 * 60 + 45, ticks_per_day))
+            frames.append(pd.DataFrame({
+                'datetime': pd.Timestamp('2023-01-02') + pd.Timedelta(days=day) + pd.to_timedelta(minutes, unit='min'),
+                'tickersymbol': ticker,
+                'price': 1000 + np.round(rng.normal(0, 5, ticks_per_day), 1),
+            }))
+    return pd.concat(frames, ignore_index=True)
+
+@pytest.fixture(scope='module')
+def ticks():
+    return synthetic_ticks.generate_ticks(days=15, ticks_per_day=500, seed=1)
+
+def quiet(message):
+    pass
+
+def sync(database, path, batch_size=25, **kwargs):
+    with database.connect() as conn:
+        return data_collecting.sync_ticks(conn, str(path), batch_size, report=quiet, **kwargs)
+
+def by_contract(ticks):
+    return ticks.sort_values(['tickersymbol', 'datetime'], kind='stable', ignore_index=True)
+
+# Two contracts trade 40 ticks a day each, so batches of 80 end on the last tick of a day
+# and the other sizes end batches mid-day, just after and just before a day edge
+@pytest.mark.parametrize('batch_size', [7, 79, 80, 81, 1000])
+def test_batches_across_day_edges_rebuild_the_table(batch_size, tmp_path):
+    ticks = make_ticks()
+    database = FakeDatabase(ticks)
+    assert sync(database, tmp_path, batch_size) == len(ticks)
+    # One fetch per batch and one that finds the cursor empty
+    assert database.stats['fetches'] == -(-len(ticks) // batch_size) + 1
+    store = TickStore(str(tmp_path))
+    assert store.days() == ['2023-01-02', '2023-01-03', '2023-01-04']
+    last = database.ticks.iloc[-1]
+    assert store.watermark == (np.datetime64(last['datetime'], 'ns'), last['tickersymbol'])
+    pd.testing.assert_frame_equal(store.read_ticks(), by_contract(ticks), check_dtype=False)
+
+def test_incremental_syncs_resume_at_the_watermark(tmp_path):
+    ticks = make_ticks()
+    full = tmp_path / 'full'
+    sync(FakeDatabase(ticks), full)
+
+    # The first sync stops in the middle of a day, so the second one appends to its partition
+    cut = ticks['datetime'].sort_values().iloc[len(ticks) // 2]
+    incremental = tmp_path / 'incremental'
+    first = sync(FakeDatabase(ticks[ticks['datetime'] <= cut]), incremental)
+    database = FakeDatabase(ticks)
+    second = sync(database, incremental)
+    assert first + second == len(ticks)
+    assert database.stats['rows'] == second
+    assert sync(FakeDatabase(ticks), incremental) == 0
+
+    stores = [TickStore(str(path)) for path in (full, incremental)]
+    assert stores[1].version == stores[0].version
+    assert stores[1].watermark == stores[0].watermark
+    pd.testing.assert_frame_equal(stores[1].read_ticks(), stores[0].read_ticks())
+
+def test_interrupted_sync_keeps_finished_days(tmp_path):
+    ticks = make_ticks()
+    database = FakeDatabase(ticks, fail_after=150)
+    with pytest.raises(psycopg.Error):
+        sync(database, tmp_path)
+    # The first day (80 ticks) was flushed, the second one was lost with the connection
+    store = TickStore(str(tmp_path))
+    assert store.days() == ['2023-01-02']
+    first_day = database.ticks.iloc[79]
+    assert store.watermark == (np.datetime64(first_day['datetime'], 'ns'), first_day['tickersymbol'])
+
+    assert sync(database, tmp_path) == len(ticks) - 80
+    pd.testing.assert_frame_equal(TickStore(str(tmp_path)).read_ticks(), by_contract(ticks), check_dtype=False)
+
+def test_parallel_sync_matches_the_streaming_sync(ticks, tmp_path):
+    sync(FakeDatabase(ticks), tmp_path / 'full', batch_size=700)
+    database = FakeDatabase(ticks)
+    with database.installed():
+        assert data_collecting.parallel_sync({}, str(tmp_path / 'parallel'), connections=3, range_days=4, report=quiet) == len(ticks)
+        assert data_collecting.parallel_sync({}, str(tmp_path / 'parallel'), connections=3, range_days=4, report=quiet) == 0
+    assert database.stats['max_open'] <= 3
+
+    stores = [TickStore(str(tmp_path / name)) for name in ('full', 'parallel')]
+    assert stores[1].version == stores[0].version
+    assert stores[1].watermark == stores[0].watermark
+    pd.testing.assert_frame_equal(stores[1].read_ticks(), stores[0].read_ticks())
+
+def test_incremental_parallel_sync_matches_full(ticks, tmp_path):
+    cut = ticks['datetime'].iloc[len(ticks) // 3]
+    for part in (ticks[ticks['datetime'] <= cut], ticks):
+        with FakeDatabase(part).installed():
+            data_collecting.parallel_sync({}, str(tmp_path / 'parallel'), connections=2, report=quiet)
+    sync(FakeDatabase(ticks), tmp_path / 'full', batch_size=700)
+    assert TickStore(str(tmp_path / 'parallel')).version == TickStore(str(tmp_path / 'full')).version
+
+def test_failed_range_queries_are_retried(ticks, tmp_path, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(data_collecting.time, 'sleep', sleeps.append)
+    database = FakeDatabase(ticks, failures=2)
+    with database.installed():
+        data_collecting.parallel_sync({}, str(tmp_path / 'retried'), connections=1, retries=3, report=quiet)
+    sync(FakeDatabase(ticks), tmp_path / 'full', batch_size=700)
+    assert database.stats['failures'] == 2
+    assert sleeps == [0.5, 1.0]  # Exponential backoff of the one range that failed twice
+    assert database.stats['open'] == 0  # Failed connections were closed, the pool was emptied
+    assert TickStore(str(tmp_path / 'retried')).version == TickStore(str(tmp_path / 'full')).version
+
+def test_range_query_fails_after_the_last_retry(ticks, tmp_path, monkeypatch):
+    monkeypatch.setattr(data_collecting.time, 'sleep', lambda seconds: None)
+    with FakeDatabase(ticks, failures=3).installed():
+        with pytest.raises(psycopg.Error):
+            data_collecting.parallel_sync({}, str(tmp_path / 'failed'), connections=1, retries=2, report=quiet)
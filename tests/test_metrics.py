@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import metrics
+
+def pandas_metrics(trades_df):
+    # HPR, drawdown and Sharpe ratio as the original evaluate.py computed them, with exits
+    # at the same time taken in ledger order
+    initial_capital = metrics.initial_capital
+    total_profit = trades_df["profit_vnd"].sum() if not trades_df.empty else 0
+    final_capital = initial_capital + total_profit
+    hpr = ((final_capital - initial_capital) / initial_capital) * 100
+
+    capital = initial_capital + trades_df.sort_values(by="exit_time", kind="stable")["profit_vnd"].cumsum()
+    running_max = capital.cummax()
+    drawdown = running_max - capital
+    mdd = (drawdown.max() / running_max.max()) * 100 if running_max.max() != 0 else 0
+
+    trades_df = trades_df.dropna(subset=["exit_time"]).sort_values(by="exit_time", kind="stable")
+    trades_df = trades_df.reset_index(drop=True)
+    trades_df["capital"] = initial_capital + trades_df["profit_vnd"].cumsum()
+    trades_df["date"] = trades_df["exit_time"].dt.floor("D")
+    daily_equity = trades_df.groupby("date")["capital"].last()
+    all_days = pd.date_range(start=daily_equity.index.min(), end=daily_equity.index.max(), freq="D")
+    daily_equity = daily_equity.reindex(all_days, method="ffill")
+    excess_returns = daily_equity.pct_change().fillna(0) - metrics.risk_free_rate_annual / metrics.trading_days_per_year
+    std = excess_returns.std()
+    sharpe = excess_returns.mean() / std * np.sqrt(metrics.trading_days_per_year) if std != 0 else np.nan
+    return total_profit, final_capital, hpr, mdd, sharpe
+
+def make_ledger(seed, trades=60, days=6):
+    # Trades in closing order; several positions close at the same minute, as at the end of
+    # a day, and a few profits are unknown (a NaN close)
+    rng = np.random.default_rng(seed)
+    exit_minute = np.sort(rng.integers(0, days * 4, trades)) * 6 * 60
+    exit_time = pd.Timestamp('2023-01-02') + pd.to_timedelta(exit_minute, unit='min')
+    entry_time = exit_time - pd.to_timedelta(rng.integers(1, 120, trades), unit='min')
+    profit = np.round(rng.normal(0, 300_000, trades), -3)
+    profit[rng.random(trades) < 0.05] = np.nan
+    return pd.DataFrame({'entry_time': entry_time, 'exit_time': exit_time, 'profit_vnd': profit})
+
+@pytest.mark.parametrize('seed', range(4))
+def test_single_ledger_matches_pandas(seed):
+    ledger = make_ledger(seed)
+    assert ledger['exit_time'].duplicated().any()
+    result = metrics.compute(ledger)
+    expected = pandas_metrics(ledger)
+    assert result.total_trades == len(ledger)
+    assert (result.total_profit, result.final_capital, result.hpr, result.mdd) == pytest.approx(expected[:4], rel=1e-12)
+    assert result.sharpe == pytest.approx(expected[4], rel=1e-9)
+
+def test_batch_ledgers_match_single_ledgers():
+    # Ledgers drawn from the same trades: padding by the trades of other ledgers must not
+    # change the order of exits at the same time
+    ledger = make_ledger(7, trades=80)
+    rng = np.random.default_rng(7)
+    traded = rng.random((len(ledger), 12)) < 0.6
+    traded[:, 0] = True
+    traded[:, 1] = False
+    batch = metrics.compute_batch(ledger['entry_time'].to_numpy(), ledger['exit_time'].to_numpy(),
+                                  np.broadcast_to(ledger['profit_vnd'].to_numpy()[:, None], traded.shape), traded)
+    for column in range(traded.shape[1]):
+        single = metrics.compute(ledger[traded[:, column]])
+        for name in metrics.Metrics._fields:
+            assert getattr(batch, name)[column] == pytest.approx(getattr(single, name), rel=1e-9, nan_ok=True), name
+
+def test_win_rate_profit_factor_and_exposure():
+    ledger = pd.DataFrame({
+        'entry_time': pd.to_datetime(['2023-01-02 09:00', '2023-01-02 09:30', '2023-01-02 11:00', '2023-01-02 13:00']),
+        'exit_time': pd.to_datetime(['2023-01-02 10:00', '2023-01-02 10:30', '2023-01-02 11:00', '2023-01-02 14:00']),
+        'profit_vnd': [300_000.0, -100_000.0, np.nan, -200_000.0],
+    })
+    result = metrics.compute(ledger)
+    assert result.total_trades == 4
+    assert result.total_profit == 0
+    assert result.win_rate == pytest.approx(100 / 3)
+    assert result.profit_factor == pytest.approx(1.0)
+    # Held 09:00-10:30 and 13:00-14:00 out of 09:00-14:00
+    assert result.exposure == pytest.approx(150 / 300 * 100)
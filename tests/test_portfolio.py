@@ -0,0 +1,74 @@
+import io
+import contextlib
+
+import pandas as pd
+import pytest
+
+import backtest
+import portfolio
+import data_processing
+
+from portfolio import Strategy
+from test_backtest import make_candles
+
+AMPLE = 10**15  # VND, no entry is ever refused
+
+STRATEGIES = [
+    Strategy('reversal', sma_window=5, take_profit=3, stop_loss=-1),
+    Strategy('reversal-long', sma_window=8, take_profit=2, stop_loss=-1, sides=('long',)),
+    Strategy('reversal-short', sma_window=5, take_profit=1, stop_loss=-2, sides=('short',)),
+]
+
+def quietly(function, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+def solo(seed, strategy, time_frame, initial=AMPLE):
+    # The strategy's ledger from run_backtest on candles with its own SMA window
+    candles = backtest.candles_to_arrays(make_candles(seed, time_frame, strategy.sma_window))
+    trades = quietly(backtest.run_backtest, candles, strategy.take_profit, strategy.stop_loss, time_frame,
+                     initial=initial)
+    return trades[trades['type'].isin(strategy.sides)].reset_index(drop=True)
+
+@pytest.mark.parametrize('seed,time_frame', [(0, 1), (1, 1), (2, 5)])
+def test_single_strategy_matches_run_backtest(seed, time_frame):
+    # With the backtest's own capital, refused entries included
+    candles = backtest.candles_to_arrays(make_candles(seed, time_frame, sma_window=5, price=3000))
+    strategy = Strategy('reversal', sma_window=5, take_profit=3, stop_loss=-1)
+    expected = quietly(backtest.run_backtest, candles, 3, -1, time_frame)
+    [ledger] = quietly(portfolio.run_portfolio, candles, [strategy], time_frame)
+    assert len(ledger)
+    pd.testing.assert_frame_equal(ledger, expected)
+
+@pytest.mark.parametrize('seed,time_frame', [(0, 1), (3, 5)])
+def test_ample_capital_matches_solo_runs(seed, time_frame):
+    # Without refusals the strategies do not interact: each ledger is that of its solo run
+    candles = backtest.candles_to_arrays(make_candles(seed, time_frame))
+    ledgers = quietly(portfolio.run_portfolio, candles, STRATEGIES, time_frame, initial=AMPLE)
+    for strategy, ledger in zip(STRATEGIES, ledgers):
+        assert len(ledger)
+        pd.testing.assert_frame_equal(ledger, solo(seed, strategy, time_frame))
+
+def test_strategies_share_the_account():
+    # With one account's capital, entries of one strategy are refused for margin the others locked
+    candles = backtest.candles_to_arrays(make_candles(0, price=3000))
+    initial = 2 * 3000 * backtest.multiplier * backtest.margin_ratio / backtest.AR
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        ledgers = portfolio.run_portfolio(candles, STRATEGIES, initial=initial)
+    alone = [len(solo(0, strategy, 1, initial)) for strategy in STRATEGIES]
+    assert 'Insufficient funds' in output.getvalue()
+    assert sum(len(ledger) for ledger in ledgers) < sum(alone)
+
+def test_time_frame_is_checked_against_the_store(tmp_path):
+    candles = make_candles(0, time_frame=5)
+    recorded, unknown = str(tmp_path / 'recorded'), str(tmp_path / 'unknown')
+    data_processing.save_candles(candles, recorded, {'time_frame': 5})
+    data_processing.save_candles(candles, unknown)
+    assert portfolio.candle_time_frame(recorded) == 5
+    assert portfolio.candle_time_frame(recorded, 5) == 5
+    with pytest.raises(ValueError, match='resampled at 5 minutes'):
+        portfolio.candle_time_frame(recorded, 1)
+    assert portfolio.candle_time_frame(unknown, 1) == 1
+    with pytest.raises(ValueError, match='--time-frame'):
+        portfolio.candle_time_frame(unknown)
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import metrics
+import robustness
+
+from test_metrics import make_ledger
+
+def known_ledger(seed):
+    # make_ledger without the unknown profits, so every day with an exit has a capital
+    ledger = make_ledger(seed)
+    return ledger[ledger['profit_vnd'].notna()].reset_index(drop=True)
+
+@pytest.mark.parametrize('seed', range(4))
+def test_observed_values_match_metrics(seed):
+    ledger = known_ledger(seed)
+    assert ledger['exit_time'].duplicated().any()
+    intervals, _ = robustness.analyze(ledger, samples=10, seed=seed)
+    expected = metrics.compute(ledger)
+    assert intervals['total_profit'].observed == pytest.approx(expected.total_profit, rel=1e-12)
+    assert intervals['mdd'].observed == pytest.approx(expected.mdd, rel=1e-12)
+    assert intervals['sharpe'].observed == pytest.approx(expected.sharpe, rel=1e-9)
+
+def test_unknown_profits_are_left_out():
+    ledger = make_ledger(1)
+    assert ledger['profit_vnd'].isna().any()
+    intervals, _ = robustness.analyze(ledger, samples=10, seed=1)
+    expected = metrics.compute(ledger)
+    assert intervals['total_profit'].observed == pytest.approx(expected.total_profit, rel=1e-12)
+    assert intervals['mdd'].observed == pytest.approx(expected.mdd, rel=1e-12)
+
+@pytest.mark.parametrize('method', robustness.METHODS)
+def test_samples_match_metrics_of_resampled_ledgers(method):
+    # Every sample is the ledger whose slots hold the drawn trades
+    ledger = known_ledger(2)
+    results = robustness.simulate(ledger, samples=20, method=method, seed=3)
+    slots = ledger.sort_values('exit_time', kind='stable', ignore_index=True)
+    draws = robustness.draw_indices(np.random.default_rng(3), method, 20, len(slots))
+    for i, drawn in enumerate(draws):
+        resampled = slots.assign(profit_vnd=slots['profit_vnd'].to_numpy()[drawn])
+        expected = metrics.compute(resampled)
+        assert results['total_profit'][i] == pytest.approx(expected.total_profit, rel=1e-12)
+        assert results['mdd'][i] == pytest.approx(expected.mdd, rel=1e-9)
+        assert results['sharpe'][i] == pytest.approx(expected.sharpe, rel=1e-9)
+
+def test_permutation_keeps_total_profit():
+    ledger = known_ledger(0)
+    results = robustness.simulate(ledger, samples=500, method='permutation', seed=0)
+    assert results['total_profit'] == pytest.approx(np.full(500, ledger['profit_vnd'].sum()), rel=1e-12)
+    assert np.ptp(results['mdd']) > 0 and np.ptp(results['sharpe']) > 0
+
+def test_seed_makes_runs_reproducible():
+    ledger = known_ledger(0)
+    first = robustness.analyze(ledger, samples=200, seed=4)
+    assert robustness.analyze(ledger, samples=200, seed=4) == first
+    assert robustness.analyze(ledger, samples=200, seed=5) != first
+
+def test_chunks_cover_every_sample():
+    # A chunk budget below one sample still scores every sample, one per chunk
+    ledger = known_ledger(0)
+    results = robustness.simulate(ledger, samples=7, method='bootstrap', seed=0, max_chunk_bytes=1)
+    assert not np.isnan(results['total_profit']).any()
+
+def test_empty_ledger():
+    ledger = pd.DataFrame({'entry_time': pd.Series(dtype='datetime64[ns]'),
+                           'exit_time': pd.Series(dtype='datetime64[ns]'), 'profit_vnd': pd.Series(dtype=float)})
+    intervals, loss_probability = robustness.analyze(ledger, samples=10)
+    assert intervals['total_profit'].observed == 0 and np.isnan(intervals['total_profit'].median)
+    assert np.isnan(loss_probability)
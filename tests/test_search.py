@@ -0,0 +1,93 @@
+import math
+import random
+
+import pytest
+
+import search
+import optimize
+
+def profit(params):
+    # A smooth objective with its best at take_profit 7, stop_loss -1
+    return -(params["take_profit"] - 7) ** 2 - (params["stop_loss"] + 1) ** 2
+
+class Recorder:
+    # evaluate() for the strategies: scores every trial with profit() whatever the fraction,
+    # and records the (number of trials, fraction) of each call
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, param_sets, fraction):
+        self.calls.append((len(param_sets), fraction))
+        return [{"total_trades": 100, "total_profit": profit(params), "sharpe": 0.0} for params in param_sets]
+
+def sampler(seed, drawn=None):
+    # sample() for the strategies, appending every draw to drawn
+    rng = random.Random(seed)
+    def sample():
+        params = optimize.sample_params(rng)
+        if drawn is not None:
+            drawn.append(params)
+        return params
+    return sample
+
+def test_random_search_scores_every_draw_on_the_full_period():
+    evaluate = Recorder()
+    scored = search.random_search(evaluate, sampler(0), 12)
+    assert evaluate.calls == [(12, 1.0)]
+    assert len(scored) == 12
+
+def test_successive_halving_keeps_the_best_third():
+    evaluate = Recorder()
+    drawn = []
+    scored = search.successive_halving(evaluate, sampler(1, drawn), 27)
+    assert evaluate.calls == [(27, pytest.approx(1 / 9)), (9, pytest.approx(1 / 3)), (3, 1)]
+    assert len(scored) == 3
+    # The draw that scores best on the short periods survives every rung
+    assert max(drawn, key=profit) in [params for params, _ in scored]
+
+def test_hyperband_runs_brackets_for_the_same_budget():
+    evaluate = Recorder()
+    scored = search.hyperband(evaluate, sampler(2), 9)
+    assert evaluate.calls == [
+        (9, pytest.approx(1 / 9)), (3, pytest.approx(1 / 3)), (1, 1),  # 9 draws from 1/9 of the days
+        (5, pytest.approx(1 / 3)), (1, 1),                             # 5 draws from 1/3 of the days
+        (3, 1),                                                        # 3 draws on the full period
+    ]
+    assert len(scored) == 5
+
+def run_tpe(seed, budget=60):
+    evaluate = Recorder()
+    rng = random.Random(seed)
+    scored = search.tpe(evaluate, lambda: optimize.sample_params(rng), budget, rng, optimize.SPACE)
+    return evaluate, scored
+
+def test_tpe_spends_its_budget_on_new_trials():
+    evaluate, scored = run_tpe(3)
+    assert sum(size for size, _ in evaluate.calls) == len(scored) == 60
+    assert all(fraction == 1.0 for _, fraction in evaluate.calls)
+    keys = [tuple(sorted(params.items())) for params, _ in scored]
+    assert len(set(keys)) == len(keys)
+    for params, _ in scored:
+        assert params == search.make_params([params[name] for name, *_ in optimize.SPACE], optimize.SPACE)
+
+def test_tpe_is_reproducible_and_moves_to_good_trials():
+    _, first = run_tpe(4)
+    _, second = run_tpe(4)
+    assert first == second
+    startup = [profit(params) for params, _ in first[:20]]
+    guided = [profit(params) for params, _ in first[20:]]
+    assert sum(guided) / len(guided) > sum(startup) / len(startup)
+
+def test_make_params_clamps_rounds_and_limits_the_sma_span():
+    params = search.make_params([150.4, 7.129, -9, 6.6], optimize.SPACE)
+    assert params == {"sma_window": 14, "take_profit": 7.13, "stop_loss": -5.0, "time_frame": 7}
+    params = search.make_params([40, 3, -1, 2], optimize.SPACE)
+    assert params["sma_window"] == 40
+
+def test_score_needs_enough_trades_for_the_period():
+    result = {"total_trades": 5, "total_profit": 1.0, "sharpe": 2.0}
+    assert search.score(result) == -math.inf
+    assert search.score(result, fraction=1 / 3) == 1.0
+    assert search.score(result, "sharpe", fraction=1 / 3) == 2.0
+    assert search.score(None) == -math.inf
+    assert search.score({"total_trades": 50, "total_profit": math.nan, "sharpe": 0.0}) == -math.inf
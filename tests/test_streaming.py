@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import backtest
+import streaming
+import data_processing
+
+PARAMS = [(1, 50, 3, -1), (5, 10, 2, -2), (3, 20, 1.5, -0.5)]  # time_frame, sma_window, take_profit, stop_loss
+SESSIONS = [(9 * 60, 11 * 60 + 30), (13 * 60, 14 * 60 + 45)]  # Traded minutes of a day
+
+def make_ticks(seed):
+    # Four months of ticks of the monthly contracts: each one trades from the start of the
+    # month before its own until the 20th of its month, a few points off a shared index
+    rng = np.random.default_rng(seed)
+    days = pd.bdate_range('2023-01-02', '2023-04-28')
+    minutes = np.concatenate([np.arange(start, end) for start, end in SESSIONS])
+    frames = []
+    index = 1000.0
+    for day in days:
+        counts = rng.poisson(6, len(minutes))
+        seconds = np.repeat(minutes * 60, counts) + rng.integers(0, 60, counts.sum())
+        seconds.sort()
+        path = index + np.cumsum(np.round(rng.normal(0, 0.3, len(seconds)), 1))
+        index = path[-1]
+        for month in range(1, 6):
+            start = pd.Timestamp(2023, month, 1) - pd.DateOffset(months=1)
+            if not start <= day <= pd.Timestamp(2023, month, 20):
+                continue
+            frames.append(pd.DataFrame({
+                'datetime': day + pd.to_timedelta(seconds, unit='s'),
+                'tickersymbol': f'VN30F23{month:02d}',
+                'price': np.round(path + month - 2 + np.round(rng.normal(0, 0.2, len(path)), 1), 1),
+            }))
+    df = pd.concat(frames, ignore_index=True)
+    return df.sort_values(['tickersymbol', 'datetime'], kind='stable', ignore_index=True)
+
+@pytest.fixture(scope='module')
+def ticks():
+    # A seed on which every parameter set has entry signals at the start of a contract
+    return make_ticks(5)
+
+def by_position(trades):
+    return trades.sort_values(['entry_time', 'type', 'entry_price', 'exit_time'], ignore_index=True)
+
+@pytest.mark.parametrize('time_frame, sma_window, take_profit, stop_loss', PARAMS)
+def test_contract_replay_matches_batch_backtest(ticks, time_frame, sma_window, take_profit, stop_loss):
+    trades = streaming.replay(ticks, take_profit, stop_loss, time_frame, sma_window)
+    candles = backtest.candles_to_arrays(streaming.contract_candles(ticks, time_frame, sma_window))
+    batch = backtest.run_backtest(candles, take_profit, stop_loss, time_frame)
+    assert len(trades)
+    pd.testing.assert_frame_equal(trades, batch, check_dtype=False)
+
+def split_changed(trades, changes):
+    # The trades whose entry is one of the changed signals, and the others
+    keys = ['entry_time', 'type', 'entry_price']
+    changed = changes.rename(columns={'datetime': 'entry_time', 'close': 'entry_price'})[keys + ['pipeline']]
+    merged = trades.merge(changed, on=keys, how='left', indicator=True)
+    listed = (merged['_merge'] == 'both').to_numpy()
+    return merged.loc[listed, 'pipeline'].to_numpy(), by_position(trades[~listed])
+
+@pytest.mark.parametrize('time_frame, sma_window, take_profit, stop_loss', PARAMS)
+def test_replay_matches_pipeline_candles_off_contract_starts(ticks, time_frame, sma_window, take_profit, stop_loss):
+    # data_processing's candles run one SMA window over all the contracts. With enough capital
+    # that no entry is refused, each trade only depends on its entry, so the streaming trades
+    # are those of the pipeline candles except the entries signal_changes lists, which are
+    # all within the first sma_window - 1 candles of a contract.
+    initial = 10**15
+    trades = streaming.replay(ticks, take_profit, stop_loss, time_frame, sma_window, initial=initial)
+    pipeline = data_processing.add_sma(data_processing.resample_candles(ticks, time_frame), sma_window)
+    batch = backtest.run_backtest(backtest.candles_to_arrays(pipeline), take_profit, stop_loss, time_frame,
+                                  initial=initial)
+    changes = streaming.signal_changes(ticks, time_frame, sma_window)
+    assert len(changes)
+    assert (changes['position'] < sma_window - 1).all()
+    assert changes['pipeline'].all()  # The per-contract SMA is NaN where the windows differ
+
+    batch_changed, batch_rest = split_changed(batch, changes)
+    stream_changed, stream_rest = split_changed(trades, changes)
+    assert len(batch_changed) and batch_changed.all()
+    assert not len(stream_changed)
+    assert len(batch_rest)
+    pd.testing.assert_frame_equal(stream_rest, batch_rest, check_dtype=False)
+
+@pytest.mark.parametrize('time_frame, sma_window, take_profit, stop_loss', PARAMS)
+def test_interleaved_replay_matches_contract_replay(ticks, time_frame, sma_window, take_profit, stop_loss):
+    # With enough capital no entry is refused, so the order the contracts arrive in cannot
+    # change the trades, only the order they close in
+    initial = 10**15
+    by_contract = streaming.replay(ticks, take_profit, stop_loss, time_frame, sma_window, initial=initial)
+    by_time = streaming.replay(ticks, take_profit, stop_loss, time_frame, sma_window, order='time', initial=initial)
+    assert len(by_time)
+    pd.testing.assert_frame_equal(by_position(by_time), by_position(by_contract))
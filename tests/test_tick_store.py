@@ -0,0 +1,52 @@
+import os
+
+import pandas as pd
+import pytest
+
+import storage
+import synthetic_ticks
+
+from tick_store import TickStore
+
+@pytest.fixture(scope='module')
+def store(tmp_path_factory):
+    path = tmp_path_factory.mktemp('ticks')
+    ticks = synthetic_ticks.generate_ticks(days=8, ticks_per_day=1500, seed=4)
+    store = TickStore(str(path / 'store'))
+    last = ticks.iloc[-1]
+    store.append(ticks, (last['datetime'], last['tickersymbol']))
+    return store
+
+RANGES = [
+    (None, None),
+    ('2023-01-04 10:15:00', '2023-01-06 13:30:00'),  # Starts and ends mid-session
+    ('2023-01-04', '2023-01-06'),                    # Whole days, the end at midnight
+    ('2023-01-05 14:45:00', '2023-01-05 14:45:00'),  # Empty range
+    (None, '2023-01-05'),
+    ('2023-01-10 09:00:00', None),
+]
+
+@pytest.mark.parametrize('start, end', RANGES)
+def test_range_query_opens_only_days_in_range(store, start, end, monkeypatch):
+    full = store.read_ticks()
+    opened = []
+    read_table = storage.read_table
+    def recording_read_table(path, columns=None, mmap=True):
+        opened.append(os.path.basename(path))
+        return read_table(path, columns, mmap)
+    monkeypatch.setattr(storage, 'read_table', recording_read_table)
+
+    first = pd.Timestamp(start) if start is not None else pd.Timestamp.min
+    last = pd.Timestamp(end) if end is not None else pd.Timestamp.max
+    for contract in full['tickersymbol'].unique():
+        opened.clear()
+        ticks = store.ticks(contract, start, end)
+        rows = full[(full['tickersymbol'] == contract) & (full['datetime'] >= first) & (full['datetime'] < last)]
+        pd.testing.assert_frame_equal(ticks, rows.reset_index(drop=True), check_dtype=False)
+        # Each partition is opened at most once, and only for the days the range covers
+        assert len(opened) == len(set(opened))
+        in_range = [day for day in store.days()
+                    if pd.Timestamp(day) < last and pd.Timestamp(day) + pd.Timedelta(days=1) > first]
+        assert set(opened) <= set(in_range)
+        traded = rows['datetime'].dt.strftime('%Y-%m-%d').unique()
+        assert set(traded) <= set(opened)
@@ -0,0 +1,104 @@
+import math
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import backtest
+import evaluate
+import optimize
+import search
+import walk_forward
+import synthetic_ticks
+import data_processing
+
+from candle_pyramid import MINUTES_PER_DAY, NS_PER_MINUTE
+
+DAY_NS = MINUTES_PER_DAY * NS_PER_MINUTE
+
+@pytest.fixture
+def ticks_path(tmp_path, monkeypatch):
+    # A tick store in a scratch directory; the candle cache lives under its relative src/
+    monkeypatch.chdir(tmp_path)
+    synthetic_ticks.generate_ticks(days=40, ticks_per_day=3000, seed=2).to_csv(tmp_path / 'ticks.csv', index=False)
+    return data_processing.ensure_tick_store(str(tmp_path / 'ticks'))
+
+def pipeline_candles(ticks_path, time_frame, sma_window):
+    # Candles of all the ticks built by data_processing, as the reference of the cached ones
+    ticks = data_processing.load_ticks(ticks_path)
+    return backtest.candles_to_arrays(data_processing.add_sma(data_processing.resample_candles(ticks, time_frame),
+                                                              sma_window))
+
+def test_folds_roll_one_block_forward():
+    days = np.arange(19000, 19030)
+    folds = walk_forward.make_folds(days, folds=4, train_blocks=3)
+    assert len(folds) == 4
+    for i, (train_start, train_end, test_start, test_end) in enumerate(folds):
+        assert train_start == (19000 + 4 * i) * DAY_NS
+        assert train_end == test_start == (19000 + 4 * i + 12) * DAY_NS
+        assert test_end == (19000 + 4 * i + 16 if i < 3 else 19030) * DAY_NS  # The last fold takes the rest
+    anchored = walk_forward.make_folds(days, folds=4, train_blocks=3, anchored=True)
+    assert [fold[0] for fold in anchored] == [19000 * DAY_NS] * 4
+    assert [fold[1:] for fold in anchored] == [fold[1:] for fold in folds]
+    with pytest.raises(ValueError):
+        walk_forward.make_folds(days[:6], folds=4, train_blocks=3)
+
+def test_window_candles_keeps_rows_in_the_window():
+    candles = {'datetime': np.array([0, 5, 10, 15], dtype='datetime64[ns]'), 'close': np.arange(4.0),
+               'tickers': np.array(['VN30F2301'], dtype=object)}
+    window = walk_forward.window_candles(candles, 5, 15)
+    assert window['close'].tolist() == [1.0, 2.0]
+    assert window['tickers'] is candles['tickers']
+
+@pytest.mark.parametrize('time_frame, sma_window', [(1, 30), (5, 10)])
+def test_fold_scores_match_direct_backtests(ticks_path, time_frame, sma_window):
+    walk_forward.init_worker(ticks_path)
+    days = walk_forward.trading_days(walk_forward._cache.full_pyramid())
+    folds = walk_forward.make_folds(days, folds=2, train_blocks=2)
+    group = [{'sma_window': sma_window, 'take_profit': take_profit, 'stop_loss': stop_loss, 'time_frame': time_frame}
+             for take_profit, stop_loss in [(2, -1), (3.5, -0.5), (8, -4.5)]]
+    windows = [(train_start, train_end) for train_start, train_end, _, _ in folds]
+    candles = pipeline_candles(ticks_path, time_frame, sma_window)
+
+    for (start, end), scores in zip(windows, walk_forward.score_group(group, windows)):
+        window = walk_forward.window_candles(candles, start, end)
+        for params, score in zip(group, scores):
+            single = evaluate.evaluate(backtest.run_backtest(window, params['take_profit'], params['stop_loss'],
+                                                             time_frame))
+            assert score['params'] == params
+            assert score['total_trades'] == single['total_trades']
+            assert score['total_profit'] == pytest.approx(single['total_profit'], rel=1e-12, abs=1e-3)
+            assert score['sharpe'] == pytest.approx(single['sharpe'], rel=1e-9, nan_ok=True)
+
+    for params in group:
+        _, _, test_start, test_end = folds[-1]
+        expected = backtest.run_backtest(walk_forward.window_candles(candles, test_start, test_end),
+                                         params['take_profit'], params['stop_loss'], time_frame)
+        pd.testing.assert_frame_equal(walk_forward.test_fold(params, test_start, test_end), expected)
+
+def test_walk_forward_picks_each_folds_best_trial(ticks_path):
+    rng = random.Random(5)
+    param_sets = [optimize.sample_params(rng) for _ in range(8)]
+    walk_forward.init_worker(ticks_path)
+    folds = walk_forward.make_folds(walk_forward.trading_days(walk_forward._cache.full_pyramid()), folds=2)
+    results = walk_forward.walk_forward(param_sets, folds, ticks_path, workers=2, report=lambda message: None)
+
+    for (train_start, train_end, test_start, test_end), (params, train, test) in zip(folds, results):
+        # The best score on the train window, ties going to the earlier draw
+        best, best_score = None, -math.inf
+        for candidate in param_sets:
+            candles = pipeline_candles(ticks_path, candidate['time_frame'], candidate['sma_window'])
+            trades = backtest.run_backtest(walk_forward.window_candles(candles, train_start, train_end),
+                                           candidate['take_profit'], candidate['stop_loss'], candidate['time_frame'])
+            value = search.score(evaluate.evaluate(trades))
+            if value > best_score:
+                best, best_score = candidate, value
+        assert params == best
+        if params is None:
+            continue
+        assert search.score(train) == pytest.approx(best_score, rel=1e-12)
+        candles = pipeline_candles(ticks_path, params['time_frame'], params['sma_window'])
+        expected = backtest.run_backtest(walk_forward.window_candles(candles, test_start, test_end),
+                                         params['take_profit'], params['stop_loss'], params['time_frame'])
+        pd.testing.assert_frame_equal(test, expected)
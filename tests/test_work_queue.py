@@ -0,0 +1,120 @@
+import os
+import time
+import signal
+import multiprocessing
+
+import pytest
+
+import optimize
+import work_queue
+import synthetic_ticks
+
+from work_queue import WorkQueue
+
+# The workers are forked, so a test can change what they run before starting them
+fork = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+pytestmark = pytest.mark.skipif(fork is None, reason='needs fork()')
+
+GROUPS = [[{"time_frame": 1, "sma_window": window, "take_profit": take_profit, "stop_loss": -1}
+           for take_profit in (1, 2, 3)] for window in (5, 8, 13, 21, 34, 55)]
+
+@pytest.fixture
+def setup(tmp_path):
+    ticks_path = str(tmp_path / 'ticks.csv')
+    synthetic_ticks.generate_ticks(days=5, ticks_per_day=1000).to_csv(ticks_path, index=False)
+    return str(tmp_path / 'queue.db'), ticks_path, str(tmp_path / 'cache')
+
+def start(target, *args):
+    process = fork.Process(target=target, args=args, daemon=True)
+    process.start()
+    return process
+
+def stuck_work(queue_path, ticks_path, lease_seconds, cache_dir):
+    # A worker whose trial group never finishes, until it is killed
+    optimize.run_trial_group = lambda param_group, fraction=1.0: time.sleep(3600)
+    work_queue.work(queue_path, ticks_path, lease_seconds, None, cache_dir)
+
+def wait_for(condition, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.05)
+
+def task_row(queue, task_id):
+    return queue.conn.execute('SELECT * FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+
+def test_every_task_is_completed_once_by_local_workers(setup):
+    queue_path, ticks_path, cache_dir = setup
+    with WorkQueue(queue_path) as queue:
+        job_id = queue.add_job(optimize.trials_version(ticks_path))
+        task_ids = [queue.add_task(job_id, group) for group in GROUPS]
+        workers = work_queue.start_workers(3, queue_path, ticks_path, 30, 2, cache_dir)
+        for process in workers:
+            process.join(120)
+            assert process.exitcode == 0
+        # The workers built their candles from ticks_path into cache_dir
+        assert os.listdir(cache_dir)
+
+        optimize.init_worker(ticks_path, False, cache_dir)
+        for task_id, group in zip(task_ids, GROUPS):
+            row = task_row(queue, task_id)
+            assert row['state'] == 'done' and row['attempts'] == 1
+            state, results, error = queue.task(task_id)
+            expected = optimize.run_trial_group(group)
+            assert [r['total_profit'] for r in results] == [r['total_profit'] for r in expected]
+        assert queue.progress(job_id)[job_id]['done'] == len(GROUPS)
+
+def test_running_task_keeps_its_lease_and_a_killed_worker_task_is_retried(setup):
+    queue_path, ticks_path, cache_dir = setup
+    lease_seconds = 1
+    with WorkQueue(queue_path, lease_seconds) as queue:
+        job_id = queue.add_job(optimize.trials_version(ticks_path))
+        task_id = queue.add_task(job_id, GROUPS[0])
+        stuck = start(stuck_work, queue_path, ticks_path, lease_seconds, cache_dir)
+        wait_for(lambda: task_row(queue, task_id)['state'] == 'leased')
+        owner = task_row(queue, task_id)['lease_owner']
+
+        # The heartbeat renews the lease of the running task: another worker does not take it
+        worker = start(work_queue.work, queue_path, ticks_path, lease_seconds, 8, cache_dir)
+        time.sleep(3 * lease_seconds)
+        row = task_row(queue, task_id)
+        assert row['state'] == 'leased' and row['lease_owner'] == owner and row['attempts'] == 1
+
+        # Once the stuck worker is killed, its lease runs out and the other worker retries the task
+        os.kill(stuck.pid, signal.SIGKILL)
+        stuck.join()
+        worker.join(120)
+        row = task_row(queue, task_id)
+        assert row['state'] == 'done' and row['attempts'] == 2 and row['lease_owner'] != owner
+        assert len(queue.task(task_id)[1]) == len(GROUPS[0])
+
+def test_idle_worker_picks_up_jobs_of_new_ticks(setup, monkeypatch):
+    queue_path, ticks_path, cache_dir = setup
+    monkeypatch.setattr(work_queue, 'VERSION_CHECK_SECONDS', 0.2)
+    with WorkQueue(queue_path) as queue:
+        worker = start(work_queue.work, queue_path, ticks_path, 30, 10, cache_dir)
+        old_version = optimize.trials_version(ticks_path)
+        wait_for(lambda: queue.live_workers(old_version))
+
+        # Ticks synced after the worker started have another data version
+        synthetic_ticks.generate_ticks(days=6, ticks_per_day=1000).to_csv(ticks_path, index=False)
+        new_version = optimize.trials_version(ticks_path)
+        assert new_version != old_version
+        task_id = queue.add_task(queue.add_job(new_version), GROUPS[0])
+        pool = work_queue.QueuePool(queue, None, new_version, worker_wait=30)
+        assert len(work_queue.QueuedTask(pool, task_id).result(timeout=60)) == len(GROUPS[0])
+        worker.terminate()
+        worker.join()
+
+def test_waiting_fails_without_a_worker_for_the_data_version(setup):
+    queue_path, ticks_path, cache_dir = setup
+    with WorkQueue(queue_path) as queue:
+        job_id = queue.add_job('other-ticks')
+        queue.heartbeat('elsewhere-1', [optimize.trials_version(ticks_path)])
+        pool = work_queue.QueuePool(queue, job_id, 'other-ticks', worker_wait=0.5)
+        with pytest.raises(RuntimeError, match='no live queue worker'):
+            pool.submit_group(GROUPS[0]).result()
+
+        pool = work_queue.QueuePool(queue, job_id, 'other-ticks', worker_wait=60)
+        with pytest.raises(TimeoutError):
+            pool.submit_group(GROUPS[0]).result(timeout=0.5)